@@ -0,0 +1,26 @@
+import json
+import argparse
+
+from mm2 import analysis
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Recount clears and skips of recorded videos, one video per player")
+    parser.add_argument("videos", nargs="+", help="Video files, in player order")
+    parser.add_argument("--processes", type=int, help="Worker processes, one per CPU core if omitted")
+    parser.add_argument("--segment", type=float, default=120,
+                        help="Seconds of video per segment, segments are analysed in parallel")
+    parser.add_argument("--fps", type=float, default=30, help="Frames checked per second of video")
+    parser.add_argument("--output", help="Write the events and final scores as JSON to this file")
+    args = parser.parse_args()
+
+    result = analysis.analyze(args.videos, processes=args.processes, segment_seconds=args.segment,
+                              analysis_fps=args.fps)
+    analysis.print_report(result)
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump({"events": [event._asdict() for event in result["events"]],
+                       "scores": [{"player": player, "score": points, "skips": skips}
+                                  for player, (points, skips) in enumerate(result["scores"])],
+                       "video_seconds": result["video_seconds"]}, file, indent=2)
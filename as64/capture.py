@@ -0,0 +1,389 @@
+import os
+import time
+from abc import ABC, abstractmethod
+
+import numpy as np
+import cv2
+
+from as64 import screen, config, discovery
+from as64.session import CaptureSession
+
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp", ".tif", ".tiff")
+
+
+class CaptureBackend(ABC):
+    """
+    Source of frames for the counter. A backend resolves one handle per player window and returns BGR or BGRA images
+    for a given handle. Handles must be truthy, printable objects.
+    """
+
+    # When False the counter does not pace itself and processes frames as fast as the backend can produce them
+    throttled = True
+
+    @abstractmethod
+    def get_handles(self, count):
+        """
+        Returns a list of 'count' handles, None where no source could be found
+        :param count: Number of windows requested
+        :return: List
+        """
+
+    @abstractmethod
+    def grab(self, handle):
+        """
+        Capture the current frame for a handle
+        :param handle: Handle returned by get_handles
+        :return: Numpy Array or None if no frame is available
+        """
+
+    def release(self, handle, image):
+        """
+        Hand a frame returned by grab back once it is no longer used, backends reusing their frame buffers may write a
+        later frame into it
+        """
+        pass
+
+    def get_time(self, handle):
+        """ Returns the time in seconds the last grabbed frame of a handle belongs to """
+        return time.time()
+
+    def get_title(self, handle):
+        return str(handle)
+
+    def is_valid(self, handle):
+        """ Returns True if frames can still be grabbed for a handle """
+        return handle is not None
+
+    def is_source(self, handle):
+        """
+        Returns True if a handle kept from an earlier run, possibly of an earlier process, still identifies one of the
+        sources get_handles would find
+        """
+        return self.is_valid(handle)
+
+    @abstractmethod
+    def get_size(self, handle):
+        """ Returns [width, height] of the frames of a handle """
+
+    def invalidate(self):
+        """ Forget any cached handles so that the next get_handles looks for sources again """
+        pass
+
+    def close(self):
+        pass
+
+
+class Win32Backend(CaptureBackend):
+    """
+    Captures VLC windows with the windows BitBlt method. Every window has its own CaptureSession, frames are BGRA
+    views of the session's buffers, which are reused once released.
+    """
+
+    def __init__(self, process_name="vlc.exe", window_discovery=None, buffers=4):
+        self._process_name = process_name
+        self._discovery = window_discovery if window_discovery else discovery.get_discovery()
+        self._buffers = buffers
+
+        # handle -> CaptureSession, every window is only captured by one thread
+        self._sessions = {}
+
+    def get_handles(self, count):
+        hwnds = self._discovery.find(self._process_name)
+        return [hwnds[i] if i < len(hwnds) else None for i in range(count)]
+
+    def invalidate(self):
+        self._discovery.invalidate(self._process_name)
+
+    def grab(self, handle):
+        session = self._sessions.get(handle)
+        if session is None:
+            session = self._sessions[handle] = CaptureSession(screen.GdiSource(handle), self._buffers)
+
+        return session.grab()
+
+    def release(self, handle, image):
+        session = self._sessions.get(handle)
+        if session:
+            session.release(image)
+
+    def get_title(self, handle):
+        return screen.get_title(handle)
+
+    def is_valid(self, handle):
+        if handle is not None and screen.is_window(handle):
+            return True
+
+        # The window is gone, free its GDI objects
+        session = self._sessions.pop(handle, None)
+        if session:
+            session.close()
+        return False
+
+    def is_source(self, handle):
+        # Window handles are reused, a window of the last run may now belong to another process
+        if not isinstance(handle, int) or not self.is_valid(handle):
+            return False
+
+        return discovery.get_process_name(screen.get_window_pid(handle)) == self._process_name
+
+    def get_size(self, handle):
+        return screen.get_capture_size(handle)
+
+    def close(self):
+        for session in self._sessions.values():
+            session.close()
+        self._sessions = {}
+
+
+class _VideoReader(object):
+    """ Sequential reader over a video file """
+
+    def __init__(self, path, loop):
+        self.path = path
+        self._loop = loop
+        self._capture = cv2.VideoCapture(path)
+        self.fps = self._capture.get(cv2.CAP_PROP_FPS) or 30
+
+        # Frames read or skipped so far, counting on across loops
+        self.index = 0
+        self.size = [int(self._capture.get(cv2.CAP_PROP_FRAME_WIDTH)),
+                     int(self._capture.get(cv2.CAP_PROP_FRAME_HEIGHT))]
+
+    def _next(self):
+        """ Move on to the next frame without decoding it, returns False at the end of a video that does not loop """
+        success = self._capture.grab()
+
+        if not success and self._loop and self.index:
+            self._capture.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            success = self._capture.grab()
+
+        if success:
+            self.index += 1
+        return success
+
+    def read(self):
+        if not self._next():
+            return None
+
+        success, frame = self._capture.retrieve()
+        return frame if success else None
+
+    def skip(self, frames):
+        """ Skip frames without decoding them """
+        for _ in range(frames):
+            if not self._next():
+                break
+
+    def get_time(self):
+        return self.index / self.fps
+
+    def close(self):
+        self._capture.release()
+
+
+class _ImageDirectoryReader(object):
+    """ Sequential reader over the images of a directory, in file name order """
+
+    def __init__(self, path, loop, fps, preload):
+        self.path = path
+        self._loop = loop
+        self.fps = fps
+        self.index = 0
+        self._files = [os.path.join(path, f) for f in sorted(os.listdir(path))
+                       if f.lower().endswith(IMAGE_EXTENSIONS)]
+
+        # Decoding dominates the cost of reading an image, preloading keeps it out of throughput measurements
+        self._frames = [cv2.imread(f) for f in self._files] if preload else None
+
+        first = self._load(0) if self._files else None
+        self.size = [first.shape[1], first.shape[0]] if first is not None else [0, 0]
+
+    def _load(self, i):
+        if self._frames is not None:
+            return self._frames[i]
+        return cv2.imread(self._files[i])
+
+    def read(self):
+        if not self._files:
+            return None
+
+        i = self.index
+        if i >= len(self._files):
+            if not self._loop:
+                return None
+            i %= len(self._files)
+
+        self.index += 1
+        return self._load(i)
+
+    def skip(self, frames):
+        self.index += frames
+
+    def get_time(self):
+        return self.index / self.fps
+
+    def close(self):
+        self._frames = None
+
+
+class ReplayBackend(CaptureBackend):
+    """
+    Replays video files or image directories, one source per window. In real time a source plays at its own frame
+    rate from its first grab, whatever rate the counter polls it at: frames that fell due between two grabs are
+    skipped, and a grab before the next frame is due returns the previous frame again.
+    """
+
+    def __init__(self, sources, loop=True, realtime=True, fps=30, preload=False):
+        self.throttled = realtime
+        self._readers = {}
+
+        # handle -> (wall time of the first grab, last frame read)
+        self._playback = {}
+
+        for path in sources:
+            if os.path.isdir(path):
+                self._readers[path] = _ImageDirectoryReader(path, loop, fps, preload)
+            else:
+                self._readers[path] = _VideoReader(path, loop)
+
+    def get_handles(self, count):
+        sources = list(self._readers)
+        return [sources[i] if i < len(sources) else None for i in range(count)]
+
+    def grab(self, handle):
+        reader = self._readers[handle]
+        if not self.throttled:
+            return reader.read()
+
+        now = time.perf_counter()
+        started, frame = self._playback.get(handle, (now, None))
+
+        due = int((now - started) * reader.fps)
+        if frame is None or due >= reader.index:
+            reader.skip(due - reader.index)
+            frame = reader.read()
+
+        self._playback[handle] = (started, frame)
+        return frame
+
+    def get_time(self, handle):
+        # Replaying faster than real time must not shorten the cooldown between detections, so use media time
+        if self.throttled:
+            return time.time()
+        return self._readers[handle].get_time()
+
+    def get_size(self, handle):
+        return self._readers[handle].size
+
+    def is_valid(self, handle):
+        return handle in self._readers
+
+    def close(self):
+        for reader in self._readers.values():
+            reader.close()
+
+
+class SyntheticBackend(CaptureBackend):
+    """
+    Generates frames without any external source. Streams are mostly noisy 'gameplay' frames with a course clear or a
+    skip injected at a fixed interval, painted into the configured regions so that the detectors fire, followed by a
+    short black transition to the next course.
+    """
+
+    def __init__(self, size=(1920, 1080), event_interval=600, realtime=True, fps=30, seed=0):
+        self.throttled = realtime
+        self._size = list(size)
+        self._event_interval = event_interval
+        self._fps = fps
+        self._frame_index = {}
+
+        width, height = self._size
+        rng = np.random.default_rng(seed)
+
+        # A handful of pre-generated gameplay frames so that the generator itself costs next to nothing per frame
+        self._gameplay = [rng.integers(0, 256, (height, width, 3), dtype=np.uint8) for _ in range(4)]
+
+        self._clear = self._gameplay[0].copy()
+        self._paint(self._clear, "course_clear", "course_clear")
+
+        self._skip = self._gameplay[1].copy()
+        self._paint(self._skip, "pause_menu", "pause_menu")
+        self._paint(self._skip, "exit_course", "exit_course")
+
+        # Frames of black screen after every event, half a second but at most a quarter of the interval
+        self._black = np.zeros((height, width, 3), dtype=np.uint8)
+        self._black_frames = min(fps // 2, event_interval // 4)
+
+    def _paint(self, image, region, bounds):
+        lower = np.array(config.get("thresholds", bounds + "_lower_bound"), dtype=np.int32)
+        upper = np.array(config.get("thresholds", bounds + "_upper_bound"), dtype=np.int32)
+
+        # Regions are fractions of the frame, or pixels of frames of the reference size if there is one
+        reference = config.get("detection", "reference_size")
+        if not reference or not all(reference):
+            reference = self._size
+        x, y, width, height = config.get("region", region)
+        if not all(isinstance(v, float) and 0 <= v <= 1 for v in (x, y, width, height)):
+            x, y, width, height = x / reference[0], y / reference[1], width / reference[0], height / reference[1]
+
+        left, top = int(round(x * self._size[0])), int(round(y * self._size[1]))
+        right, bottom = int(round((x + width) * self._size[0])), int(round((y + height) * self._size[1]))
+        image[top:bottom, left:right] = ((lower + upper) // 2).astype(np.uint8)
+
+    def get_handles(self, count):
+        handles = ["synthetic:{}".format(i) for i in range(count)]
+        for handle in handles:
+            self._frame_index.setdefault(handle, 0)
+        return handles
+
+    def grab(self, handle):
+        i = self._frame_index[handle]
+        self._frame_index[handle] = i + 1
+
+        if self._event_interval and i:
+            if i % self._event_interval == 0:
+                # Alternate between clears and skips
+                return self._clear if (i // self._event_interval) % 2 else self._skip
+
+            if i > self._event_interval and i % self._event_interval <= self._black_frames:
+                return self._black
+
+        return self._gameplay[i % len(self._gameplay)]
+
+    def get_time(self, handle):
+        if self.throttled:
+            return time.time()
+        return self._frame_index[handle] / self._fps
+
+    def get_size(self, handle):
+        return self._size
+
+    def is_valid(self, handle):
+        return handle in self._frame_index
+
+
+def create_backend(name=None):
+    """
+    Create the capture backend selected in the [capture] section of the config
+    :param name: Optional backend name overriding the config
+    :return: CaptureBackend
+    """
+    if name is None:
+        name = config.get("capture", "backend")
+
+    if name == "win32":
+        return Win32Backend(process_name=config.get("capture", "process_name"),
+                            buffers=config.get("capture", "frame_buffers"))
+    elif name == "replay":
+        return ReplayBackend(sources=config.get("capture", "replay_sources"),
+                             loop=config.get("capture", "loop"),
+                             realtime=config.get("capture", "realtime"),
+                             fps=config.get("capture", "replay_fps"),
+                             preload=config.get("capture", "preload"))
+    elif name == "synthetic":
+        return SyntheticBackend(size=config.get("capture", "synthetic_size"),
+                                event_interval=config.get("capture", "synthetic_event_interval"),
+                                realtime=config.get("capture", "realtime"))
+
+    raise ValueError("Unknown capture backend '{}'".format(name))
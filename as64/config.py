@@ -1,7 +1,10 @@
-import toml
+import os
 import copy
+import json
+import zlib
+import tempfile
 
-from as64.paths import base_path
+from as64.paths import base_path, copy_mode
 
 _config = {}
 _defaults = {}
@@ -10,6 +13,11 @@ _rollback = {}
 _CONFIG_FILE = base_path("config")
 _DEFAULTS_FILE = base_path("defaults")
 
+# Parsed config and defaults, reused while the files are unchanged so that starting up skips importing and running
+# the TOML parser
+_CACHE_FILE = base_path("config.cache")
+_cache = None
+
 
 def get(section, key=None):
     global _config
@@ -66,20 +74,44 @@ def rollback():
         _rollback = None
 
 
-def load():
+def load(data=None):
+    """
+    Read the config file
+    :param data: Config to use instead of reading the file, as returned by snapshot()
+    """
     global _config
 
+    if data is not None:
+        _config = copy.deepcopy(data)
+        return
+
     try:
-        with open(_CONFIG_FILE) as file:
-            _config = toml.load(file)
+        _config = _load_file(_CONFIG_FILE)
     except FileNotFoundError:
         generate()
 
 
+def reload():
+    """ Read the config file again, the current config can be restored with rollback() """
+    create_rollback()
+    load()
+
+
+def snapshot():
+    """ Returns a copy of the current config, e.g. for load() in another process """
+    if not _config:
+        load()
+
+    # Plain dictionaries and lists, the TOML parser's inline tables can not be pickled
+    return json.loads(json.dumps(_config))
+
+
 def save():
     global _config
     global _rollback
 
+    import toml
+
     try:
         with open(_CONFIG_FILE, 'w') as file:
             toml.dump(_config, file)
@@ -94,8 +126,56 @@ def save():
 def load_defaults():
     global _defaults
 
-    with open(_DEFAULTS_FILE) as file:
-        _defaults = toml.load(file)
+    _defaults = _load_file(_DEFAULTS_FILE)
+
+
+def _load_file(path):
+    """ Parse a TOML file, or take it from the cache if it has not changed since it was cached """
+    global _cache
+
+    with open(path, 'rb') as file:
+        content = file.read()
+
+    # Checksum of the content rather than the modification time, which some file systems only keep to the second
+    key = [len(content), zlib.crc32(content)]
+
+    if _cache is None:
+        try:
+            with open(_CACHE_FILE) as file:
+                _cache = json.load(file)
+        except (OSError, ValueError):
+            _cache = {}
+
+    entry = _cache.get(path)
+    if isinstance(entry, dict) and entry.get("key") == key:
+        # Copied, as the config is changed in place by set()
+        return copy.deepcopy(entry["data"])
+
+    import toml
+
+    data = toml.loads(content.decode("utf-8"))
+
+    _cache[path] = {"key": key, "data": copy.deepcopy(data)}
+    try:
+        # A temporary file of its own, shard and analysis workers load the config at the same time
+        handle, temp = tempfile.mkstemp(prefix="config.cache.", suffix=".tmp",
+                                        dir=os.path.dirname(_CACHE_FILE) or None)
+    except OSError:
+        # Caching is only an optimisation, the file was parsed all the same
+        return data
+
+    try:
+        with os.fdopen(handle, 'w') as file:
+            json.dump(_cache, file)
+        copy_mode(temp, _CACHE_FILE)
+        os.replace(temp, _CACHE_FILE)
+    except (OSError, TypeError, ValueError):
+        try:
+            os.remove(temp)
+        except OSError:
+            pass
+
+    return data
 
 
 def generate():
@@ -0,0 +1,134 @@
+import time
+from threading import Lock
+
+from as64 import screen, config
+
+
+def get_process_name(pid):
+    """ Returns the name of a process, None if it does not exist or can not be accessed """
+    import psutil
+
+    try:
+        return psutil.Process(pid).name()
+    except psutil.Error:
+        return None
+
+
+class Win32Enumerator(object):
+    """ Enumerates processes with psutil and top-level windows with EnumWindows """
+
+    def processes(self):
+        """ Returns a list of (pid, name) of running processes """
+        # Imported on first use, a counter restarted with its last windows never enumerates processes
+        import psutil
+
+        processes = []
+        for proc in psutil.process_iter(['name']):
+            # Names are fetched once by process_iter, inaccessible processes have a name of None
+            processes.append((proc.pid, proc.info['name']))
+        return processes
+
+    def windows(self):
+        """ Returns a list of (hwnd, pid) of visible and enabled top-level windows """
+        return screen.enumerate_windows()
+
+    def is_window(self, hwnd):
+        return screen.is_window(hwnd)
+
+
+class StaticEnumerator(object):
+    """ Enumerator over fixed lists of processes and windows, for benchmarks and tests without Win32 """
+
+    def __init__(self, processes, windows):
+        """
+        :param processes: List of (pid, name)
+        :param windows: List of (hwnd, pid)
+        """
+        self._processes = list(processes)
+        self._windows = list(windows)
+        self.enumerations = 0
+
+    def processes(self):
+        return list(self._processes)
+
+    def windows(self):
+        self.enumerations += 1
+        return list(self._windows)
+
+    def is_window(self, hwnd):
+        return any(h == hwnd for h, _ in self._windows)
+
+    def close_window(self, hwnd):
+        self._windows = [(h, p) for h, p in self._windows if h != hwnd]
+
+
+class WindowDiscovery(object):
+    """
+    Finds the windows of processes by name. Processes and windows are each enumerated once, into a pid -> hwnd
+    index, instead of enumerating every window once per process. Results are cached per process name until they
+    expire, are invalidated or one of the cached windows no longer exists.
+    """
+
+    def __init__(self, enumerator=None, ttl=30.0):
+        """
+        :param enumerator: Source of processes and windows, Win32Enumerator by default
+        :param ttl: Seconds a result is cached for
+        """
+        self._enumerator = enumerator if enumerator else Win32Enumerator()
+        self._ttl = ttl
+
+        # process name -> (time found, list of hwnds)
+        self._cache = {}
+        self._mutex = Lock()
+
+    def find(self, process_name):
+        """
+        Returns the first window of every process with the given name, in process enumeration order
+        :param process_name: e.g. vlc.exe
+        :return: List of hwnds
+        """
+        with self._mutex:
+            cached = self._cache.get(process_name)
+
+            if cached and time.monotonic() - cached[0] < self._ttl and \
+                    all(self._enumerator.is_window(hwnd) for hwnd in cached[1]):
+                return list(cached[1])
+
+            hwnds = self._discover(process_name)
+            self._cache[process_name] = (time.monotonic(), hwnds)
+
+            return list(hwnds)
+
+    def _discover(self, process_name):
+        # Filter by name up front so that only the windows of matching processes are indexed
+        pids = [pid for pid, name in self._enumerator.processes() if name == process_name]
+        if not pids:
+            return []
+
+        wanted = set(pids)
+        index = {}
+        for hwnd, pid in self._enumerator.windows():
+            if pid in wanted and pid not in index:
+                index[pid] = hwnd
+
+        return [index[pid] for pid in pids if pid in index]
+
+    def invalidate(self, process_name=None):
+        with self._mutex:
+            if process_name is None:
+                self._cache.clear()
+            else:
+                self._cache.pop(process_name, None)
+
+
+# Shared between capture backends so that counter restarts can reuse a recent discovery
+_discovery = None
+
+
+def get_discovery():
+    global _discovery
+
+    if _discovery is None:
+        _discovery = WindowDiscovery(ttl=config.get("capture", "discovery_ttl"))
+
+    return _discovery
@@ -2,6 +2,10 @@ import os
 import sys
 from pathlib import Path
 
+# Read once on import, the umask can only be read by setting it, which would race with threads creating files
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
 
 def base_path(relative_path=None):
     if not relative_path:
@@ -40,3 +44,16 @@ def rel_to_abs(p):
         return absolute_path(p)
     else:
         return p
+
+
+def copy_mode(temp, path):
+    """
+    Give a temporary file, created owner-only by tempfile.mkstemp, the permissions of the file it is about to replace,
+    or those of a new file if there is none
+    """
+    try:
+        mode = os.stat(path).st_mode & 0o7777
+    except OSError:
+        mode = 0o644 & ~_UMASK
+
+    os.chmod(temp, mode)
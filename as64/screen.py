@@ -1,88 +1,165 @@
-import win32gui
-import win32ui
-import win32process
-import win32con
+import ctypes
+from ctypes import wintypes
+
+try:
+    import win32gui
+    import win32ui
+    import win32process
+    import win32con
+except ImportError:
+    # pywin32 is only available on Windows, other platforms can still use the replay and synthetic capture backends
+    win32gui = win32ui = win32process = win32con = None
+
 import numpy as np
-import psutil
+import cv2
 
 
-def get_window_handles():
-    """ Returns a list of processes with a valid hwnd """
-    processes = []
-    for proc in psutil.process_iter():
-        hwnd = 0
-        try:
-            # Get process name & pid from process object.
-            process_name = proc.name()
-            process_id = proc.pid
+def enumerate_windows():
+    """ Returns a list of (hwnd, pid) of every visible and enabled top-level window, in z-order """
+    windows = []
 
-            if process_id is not None:
-                def callback(h, additional):
-                    if win32gui.IsWindowVisible(h) and win32gui.IsWindowEnabled(h):
-                        _, p = win32process.GetWindowThreadProcessId(h)
-                        if p == process_id:
-                            additional.append(h)
-                        return True
-                    return True
+    def callback(h, additional):
+        if win32gui.IsWindowVisible(h) and win32gui.IsWindowEnabled(h):
+            _, p = win32process.GetWindowThreadProcessId(h)
+            additional.append((h, p))
+        return True
 
-                additional = []
-                win32gui.EnumWindows(callback, additional)
+    win32gui.EnumWindows(callback, windows)
 
-                if additional:
-                    hwnd = additional[0]
+    return windows
 
-            if hwnd:
-                processes.append((proc, hwnd))
 
-        except (psutil.NoSuchProcess, psutil.AccessDenied, psutil.ZombieProcess):
-            pass
+def is_window(hwnd):
+    """ Returns True if the handle still identifies an existing window """
+    return bool(win32gui.IsWindow(hwnd))
+
+
+# Uncompressed pixels and a bitmap without a palette, from wingdi.h
+_BI_RGB = 0
+_DIB_RGB_COLORS = 0
+
+
+class _BitmapInfoHeader(ctypes.Structure):
+    _fields_ = [("biSize", ctypes.c_uint32), ("biWidth", ctypes.c_int32), ("biHeight", ctypes.c_int32),
+                ("biPlanes", ctypes.c_uint16), ("biBitCount", ctypes.c_uint16), ("biCompression", ctypes.c_uint32),
+                ("biSizeImage", ctypes.c_uint32), ("biXPelsPerMeter", ctypes.c_int32),
+                ("biYPelsPerMeter", ctypes.c_int32), ("biClrUsed", ctypes.c_uint32),
+                ("biClrImportant", ctypes.c_uint32)]
 
-    return processes
 
+class _BitmapInfo(ctypes.Structure):
+    _fields_ = [("bmiHeader", _BitmapInfoHeader), ("bmiColors", ctypes.c_uint32 * 3)]
 
-def get_hwnd(process_name, process_list):
-    """ Given a list of processes, return process with given name """
-    processes = []
-    for p in process_list:
-        if p[0].name() == process_name:
-            processes.append(p[1])
-    return processes
+
+# Declared so that 64 bit handles are not truncated to a C int
+try:
+    _GetDIBits = ctypes.windll.gdi32.GetDIBits
+    _GetDIBits.argtypes = [wintypes.HDC, wintypes.HBITMAP, wintypes.UINT, wintypes.UINT, ctypes.c_void_p,
+                           ctypes.POINTER(_BitmapInfo), wintypes.UINT]
+    _GetDIBits.restype = ctypes.c_int
+except AttributeError:
+    # Not on Windows
+    _GetDIBits = None
+
+
+class GdiSource(object):
+    """
+    Captures a window with the windows BitBlt method for a CaptureSession. The window's DC, the memory DC and the
+    bitmap are created once per window size and reused for every frame, the bitmap's pixels are copied straight into
+    the session's buffer. The bitmap is only selected into the memory DC for the BitBlt, GetDIBits requires it not to
+    be selected into any DC.
+    """
+
+    def __init__(self, hwnd):
+        self.hwnd = hwnd
+        self._size = None
+        self._window_dc = None
+        self._img_dc = None
+        self._mem_dc = None
+        self._bitmap = None
+
+        # Describes the buffer to GetDIBits: top-down rows (negative height) of 32 bit BGRA pixels
+        self._info = _BitmapInfo()
+        self._info.bmiHeader.biSize = ctypes.sizeof(_BitmapInfoHeader)
+        self._info.bmiHeader.biPlanes = 1
+        self._info.bmiHeader.biBitCount = 32
+        self._info.bmiHeader.biCompression = _BI_RGB
+
+    def get_size(self):
+        return get_capture_size(self.hwnd)
+
+    def resize(self, width, height):
+        self.close()
+
+        self._window_dc = win32gui.GetWindowDC(self.hwnd)
+        self._img_dc = win32ui.CreateDCFromHandle(self._window_dc)
+        self._mem_dc = self._img_dc.CreateCompatibleDC()
+        self._bitmap = win32ui.CreateBitmap()
+        self._bitmap.CreateCompatibleBitmap(self._img_dc, width, height)
+
+        self._info.bmiHeader.biWidth = width
+        self._info.bmiHeader.biHeight = -height
+        self._size = (width, height)
+
+    def read(self, buffer):
+        width, height = self._size
+        hdc = self._mem_dc.GetSafeHdc()
+        bitmap = self._bitmap.GetHandle()
+
+        previous = win32gui.SelectObject(hdc, bitmap)
+        try:
+            self._mem_dc.BitBlt((0, 0), (width, height), self._img_dc, (0, 0), win32con.SRCCOPY)
+        finally:
+            win32gui.SelectObject(hdc, previous)
+
+        lines = _GetDIBits(hdc, bitmap, 0, height, buffer.ctypes.data, ctypes.byref(self._info), _DIB_RGB_COLORS)
+        return lines == height
+
+    def close(self):
+        if self._bitmap is None:
+            return
+
+        try:
+            self._img_dc.DeleteDC()
+            self._mem_dc.DeleteDC()
+            win32gui.ReleaseDC(self.hwnd, self._window_dc)
+            win32gui.DeleteObject(self._bitmap.GetHandle())
+        except win32ui.error:
+            # The window is already gone
+            pass
+
+        self._window_dc = self._img_dc = self._mem_dc = self._bitmap = None
 
 
 def bit_blit(hwnd):
     """
-    Capture the window of a given handle using the windows BitBlt method.
+    Capture the window of a given handle using the windows BitBlt method. Repeated captures of a window should use a
+    CaptureSession with a GdiSource instead, which reuses its GDI objects and buffers.
     :param hwnd: Window Handle
     :return: Numpy Array
     """
-    left, top, right, bot = win32gui.GetWindowRect(hwnd)
-    width = right - left
-    height = bot - top
-
-    window_dc = win32gui.GetWindowDC(hwnd)
-    img_dc = win32ui.CreateDCFromHandle(window_dc)
-    mem_dc = img_dc.CreateCompatibleDC()
-    bitmap = win32ui.CreateBitmap()
-    bitmap.CreateCompatibleBitmap(img_dc, width, height)
-    mem_dc.SelectObject(bitmap)
-    mem_dc.BitBlt((0, 0), (width, height), img_dc, (0, 0), win32con.SRCCOPY)
+    source = GdiSource(hwnd)
+    width, height = source.get_size()
 
-    img = bitmap.GetBitmapBits(True)
-    info = bitmap.GetInfo()
-    img = np.fromstring(img, np.uint8).reshape(info['bmHeight'], info['bmWidth'], 4)[:, :, :3]
+    try:
+        source.resize(width, height)
+        img = np.empty((height, width, 4), dtype=np.uint8)
+        source.read(img)
+    finally:
+        source.close()
 
-    img_dc.DeleteDC()
-    mem_dc.DeleteDC()
-    win32gui.ReleaseDC(hwnd, window_dc)
-    win32gui.DeleteObject(bitmap.GetHandle())
-
-    return img
+    return cv2.cvtColor(img, cv2.COLOR_BGRA2BGR)
 
 
 def get_title(hwnd):
     return win32gui.GetWindowText(hwnd)
 
 
+def get_window_pid(hwnd):
+    """ Returns the id of the process owning a window """
+    return win32process.GetWindowThreadProcessId(hwnd)[1]
+
+
 def crop(image, x, y, width, height):
     return image[y:y + height, x:x + width]
 
@@ -0,0 +1,150 @@
+from threading import Lock
+
+import numpy as np
+import cv2
+
+
+class BufferPool(object):
+    """
+    Frame buffers of one size, handed out by acquire() and given back by release() once a frame is no longer used.
+    Buffers are only allocated while none are free, so a window capturing at a steady size allocates nothing per
+    frame. Changing the size drops every buffer of the old size.
+    """
+
+    def __init__(self, capacity=4, channels=4):
+        """
+        :param capacity: Free buffers kept for reuse, further released buffers are left to the garbage collector
+        :param channels: Channels of a buffer, 4 for BGRA
+        """
+        self._capacity = max(capacity, 1)
+        self._channels = channels
+        self._shape = None
+        self._free = []
+        self._lock = Lock()
+
+        self.allocations = 0
+
+    def acquire(self, width, height):
+        """ Returns a buffer of (height, width, channels), its contents are undefined """
+        shape = (height, width, self._channels)
+
+        with self._lock:
+            if shape != self._shape:
+                self._shape = shape
+                self._free = []
+            elif self._free:
+                return self._free.pop()
+
+            self.allocations += 1
+
+        return np.empty(shape, dtype=np.uint8)
+
+    def release(self, buffer):
+        """ Give a buffer back for reuse, buffers of another size and buffers already released are ignored """
+        with self._lock:
+            if buffer.shape != self._shape or len(self._free) >= self._capacity:
+                return
+            if any(free is buffer for free in self._free):
+                return
+
+            self._free.append(buffer)
+
+
+class CaptureSession(object):
+    """
+    Captures the frames of one window into pooled BGRA buffers. The source keeps whatever it needs to capture, e.g.
+    GDI objects, from one frame to the next and is only set up again when the window's size changes.
+
+    A source provides:
+
+    - get_size(): [width, height] of the window
+    - resize(width, height): prepare capturing frames of that size
+    - read(buffer): write the current frame into a C-contiguous (height, width, 4) BGRA buffer, False on failure
+    - close(): free anything the source holds
+    """
+
+    def __init__(self, source, buffers=4):
+        """
+        :param source: Frame source of the window
+        :param buffers: Frames kept for reuse, at least the frames that can be in use at once
+        """
+        self.source = source
+        self._pool = BufferPool(capacity=buffers)
+        self._size = None
+
+        self.frames = 0
+        self.resizes = 0
+
+    def grab(self):
+        """
+        Capture the current frame. The frame belongs to the session again once passed to release()
+        :return: BGRA Numpy Array or None if no frame is available, e.g. while the window is minimised
+        """
+        width, height = self.source.get_size()
+        if width <= 0 or height <= 0:
+            return None
+
+        if (width, height) != self._size:
+            self.source.resize(width, height)
+            self._size = (width, height)
+            self.resizes += 1
+
+        buffer = self._pool.acquire(width, height)
+        if not self.source.read(buffer):
+            self._pool.release(buffer)
+            return None
+
+        self.frames += 1
+        return buffer
+
+    def release(self, image):
+        self._pool.release(image)
+
+    def close(self):
+        self.source.close()
+
+    def get_stats(self):
+        return {"frames": self.frames, "resizes": self.resizes, "allocations": self._pool.allocations}
+
+
+class FakeSource(object):
+    """
+    Source of a CaptureSession serving frames held in memory, for using sessions without a window. The frames are
+    served in order and looped, the size of the window is the size of the next frame.
+    """
+
+    def __init__(self, frames):
+        """
+        :param frames: List of BGR or BGRA frames
+        """
+        self._frames = frames
+        self._index = 0
+        self._size = None
+
+        self.resized = 0
+        self.closed = False
+
+    def get_size(self):
+        frame = self._frames[self._index % len(self._frames)]
+        return [frame.shape[1], frame.shape[0]]
+
+    def resize(self, width, height):
+        self._size = (width, height)
+        self.resized += 1
+
+    def read(self, buffer):
+        frame = self._frames[self._index % len(self._frames)]
+        self._index += 1
+
+        if (frame.shape[1], frame.shape[0]) != self._size:
+            return False
+
+        if frame.shape[2] == 4:
+            np.copyto(buffer, frame)
+        else:
+            cv2.cvtColor(frame, cv2.COLOR_BGR2BGRA, dst=buffer)
+
+        return True
+
+    def close(self):
+        self.closed = True
@@ -0,0 +1,75 @@
+import sys
+import argparse
+
+from mm2 import benchmark
+
+
+def _resolution(value):
+    width, height = value.lower().split("x")
+    return [int(width), int(height)]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the stages of the clear counter's detection pipeline")
+    parser.add_argument("--corpus", help="Video file or image directory of recorded frames, synthetic if omitted")
+    parser.add_argument("--frames", type=int, default=120, help="Number of corpus frames to load")
+    parser.add_argument("--resolutions", default="1920x1080,1280x720,2560x1440",
+                        help="Comma separated list of WIDTHxHEIGHT")
+    parser.add_argument("--windows", default="1,2,6", help="Comma separated list of window counts")
+    parser.add_argument("--iterations", type=int, default=600, help="Frames processed per case")
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    parser.add_argument("--baseline", help="Compare results against this JSON file")
+    parser.add_argument("--save-baseline", help="Write results as the new baseline to this file")
+    parser.add_argument("--cascade-report", action="store_true",
+                        help="Report accuracy against speed of the coarse-to-fine cascade per subsampling factor")
+    parser.add_argument("--discovery", action="store_true",
+                        help="Time window discovery against a fake enumerator of a busy machine")
+    parser.add_argument("--capture-report", action="store_true",
+                        help="Compare a new BGR array per frame with capture sessions reusing BGRA buffers")
+    parser.add_argument("--tolerance", type=float, default=0.1,
+                        help="Allowed slowdown against the baseline before reporting a regression")
+    args = parser.parse_args()
+
+    if args.discovery:
+        report = benchmark.discovery_report()
+        print("{} processes, {} windows -- per process enumeration {:.3f} ms, single pass {:.3f} ms, "
+              "cached {:.3f} ms".format(report["processes"], report["windows"], report["legacy_ms"],
+                                        report["single_pass_ms"], report["cached_ms"]))
+        sys.exit(0)
+
+    corpus = benchmark.load_corpus(args.corpus, args.frames)
+
+    if args.capture_report:
+        report = benchmark.capture_report(corpus)
+        print("{} frames -- new array per frame {:.3f} ms, capture session {:.3f} ms, {} buffers allocated".format(
+            report["iterations"], report["legacy_ms"], report["session_ms"], report["allocations"]))
+        sys.exit(0)
+
+    if args.cascade_report:
+        benchmark.print_cascade_report(benchmark.cascade_report(corpus))
+        sys.exit(0)
+
+    results = benchmark.run(corpus=corpus,
+                            resolutions=[_resolution(r) for r in args.resolutions.split(",")],
+                            window_counts=[int(w) for w in args.windows.split(",")],
+                            iterations=args.iterations)
+
+    benchmark.print_results(results)
+
+    if args.output:
+        benchmark.save(args.output, results)
+
+    if args.save_baseline:
+        benchmark.save(args.save_baseline, results)
+
+    if args.baseline:
+        regressions = benchmark.compare(results, benchmark.load(args.baseline), args.tolerance)
+
+        for r in regressions:
+            print("REGRESSION {} x{} {} {}: {:.3f} ms -> {:.3f} ms".format(
+                r["resolution"], r["windows"], r["stage"], r["metric"], r["baseline"], r["current"]))
+
+        if regressions:
+            sys.exit(1)
+
+        print("No regressions against baseline.")
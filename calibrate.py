@@ -0,0 +1,33 @@
+import argparse
+
+from mm2 import calibration
+from mm2.registry import DetectorRegistry
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sweep detector bounds and thresholds against a labelled corpus")
+    parser.add_argument("corpus", help="Directory with one sub-directory of frames per rule or detector name, frames "
+                                       "in any other sub-directory (e.g. 'none') are negatives")
+    parser.add_argument("--stride", type=int, default=4,
+                        help="Only every Nth row and column of the detector regions is used")
+    parser.add_argument("--deltas", default=",".join(str(d) for d in calibration.DELTAS),
+                        help="Comma separated offsets added to each channel of the configured bounds, which are "
+                             "always swept as well")
+    parser.add_argument("--output", help="Write the recommended [thresholds] section to this file")
+    args = parser.parse_args()
+
+    registry = DetectorRegistry.compile()
+    corpus = calibration.load_labelled_corpus(args.corpus, registry, args.stride)
+
+    results = calibration.calibrate(corpus, registry, deltas=[int(d) for d in args.deltas.split(",")])
+    if not results:
+        print("No labelled positives found in '{}'".format(args.corpus))
+    else:
+        calibration.print_report(results)
+
+        section = calibration.format_thresholds(results)
+        print(section)
+
+        if args.output:
+            with open(args.output, 'w') as file:
+                file.write(section)
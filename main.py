@@ -1,8 +1,21 @@
+# Imported first, so that the startup timeline begins before the heavy imports
+from mm2 import startup
+
+# Only the counter needs numpy, OpenCV and pywin32, they are imported alongside starting the controller. as64.screen
+# has no imports of this package, so the two threads never wait on each other's modules
+startup.preload("numpy", "cv2", "as64.screen")
+
 import logging
+import multiprocessing
 
 from mm2.controller import Controller
 
+startup.mark("imports")
+
 if __name__ == "__main__":
+    # Detection processes of the sharded capture mode are started from the frozen executable too
+    multiprocessing.freeze_support()
+
     logging.basicConfig(filename='error.log',
                         level=logging.DEBUG,
                         format='(%(asctime)s %(levelname)s %(name)s %(message)s')
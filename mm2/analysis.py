@@ -0,0 +1,284 @@
+import time
+import multiprocessing
+from collections import namedtuple
+
+import cv2
+
+from as64 import config
+from mm2 import registry
+from mm2.counter import compile_detection, to_canvas
+from mm2.gamestate import GameStateMachine, GAMEPLAY, TIMED, observe
+
+
+# Result of analysing frames [start, stop) of a video:
+#   events: list of (frame, action)
+#   transitions: list of (frame, state, entered), the game state after every frame that changed it
+#   final: (state, entered) after the last frame
+#   converged: frame after which a run given a reference agreed with it, None if it never did
+Segment = namedtuple("Segment", ["path", "start", "stop", "step", "events", "transitions", "final", "converged"])
+
+Event = namedtuple("Event", ["player", "frame", "time", "action", "score", "skips"])
+
+# Detection of the process, compiled once by _init
+_detection = None
+
+
+def _init(settings):
+    """ Compile detection in a worker process from the analysing process's config """
+    global _detection
+
+    config.load(settings)
+
+    # Without gating every frame's result only depends on the frame itself, so a segment gives the same results
+    # whichever frame it is analysed from
+    _detection = compile_detection(gating=False)
+
+
+def _key(state, entered):
+    """ The part of a game state that decides how later frames are handled, only waiting and black states time out """
+    return state, entered if state in TIMED else None
+
+
+def analyze_segment(path, start, stop, step=1, state=GAMEPLAY, entered=float("-inf"), reference=None):
+    """
+    Run the counter's detection over frames [start, stop) of a video
+    :param path: Video file
+    :param step: Only every Nth frame is checked, frames are counted from the start of the video
+    :param state: Game state before the first frame
+    :param entered: Frame time that state was entered
+    :param reference: Transitions of an earlier run of the segment from another state. The run stops at the first
+                      frame after which its state agrees with the reference, the reference holds from there on
+    :return: Segment
+    """
+    detection = _detection
+    capture = cv2.VideoCapture(path)
+    fps = capture.get(cv2.CAP_PROP_FPS) or 30
+    capture.set(cv2.CAP_PROP_POS_FRAMES, start)
+
+    machine = GameStateMachine(windows=1, black=detection.black, timeout=detection.timeout)
+    machine.set_state(0, state, entered)
+    last = _key(state, entered)
+
+    events = []
+    transitions = []
+    converged = None
+    frame = start
+    canvas = None
+
+    # State of the reference run after the current frame, reference runs start from gameplay
+    reference_key = _key(GAMEPLAY, float("-inf"))
+    upcoming = iter(reference or [])
+    pending = next(upcoming, None)
+
+    try:
+        while frame < stop:
+            # Skipped frames are only grabbed, not decoded into an image
+            if frame % step:
+                if not capture.grab():
+                    break
+                frame += 1
+                continue
+
+            success, image = capture.read()
+            if not success:
+                break
+
+            frame_time = frame / fps
+            screen = machine.current(0, frame_time)
+
+            captured = (image.shape[1], image.shape[0])
+            if detection.canvas:
+                image = canvas = to_canvas(image, canvas, detection)
+
+            action, near, screen = observe(detection.engine, detection.registry, 0, image, screen,
+                                           detection.near_fraction, detection.black, captured)
+            if action:
+                events.append((frame, action))
+
+            machine.advance(0, screen, frame_time, near)
+
+            state, entered = machine.get_state(0), machine.get_entered(0)
+            if _key(state, entered) != last:
+                transitions.append((frame, state, entered))
+                last = _key(state, entered)
+
+            if reference is not None:
+                while pending is not None and pending[0] <= frame:
+                    reference_key = _key(pending[1], pending[2])
+                    pending = next(upcoming, None)
+
+                if last == reference_key:
+                    converged = frame
+                    break
+
+            frame += 1
+    finally:
+        capture.release()
+
+    return Segment(path, start, stop, step, events, transitions, (machine.get_state(0), machine.get_entered(0)),
+                   converged)
+
+
+def _analyze_segment(args):
+    return analyze_segment(*args)
+
+
+def split(path, segment_seconds, step):
+    """
+    Split a video into segments
+    :return: List of (path, start frame, stop frame, step), starts are multiples of the step
+    """
+    capture = cv2.VideoCapture(path)
+    frames = int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
+    fps = capture.get(cv2.CAP_PROP_FPS) or 30
+    capture.release()
+
+    if frames <= 0:
+        raise ValueError("Could not read the length of '{}'".format(path))
+
+    length = max(int(segment_seconds * fps) // step, 1) * step
+    return [(path, start, min(start + length, frames), step) for start in range(0, frames, length)]
+
+
+def merge(segments):
+    """
+    Join the segments of a video, analysed independently from gameplay, into one run. A segment that actually starts
+    in another state, e.g. just after a clear at the end of the previous segment, is analysed again from that state
+    until it agrees with its first run, so an event is neither counted twice nor missed at a boundary.
+    :param segments: Segments of one video, in order
+    :return: (List of (frame, action), number of segments analysed again)
+    """
+    events = []
+    repaired = 0
+    state, entered = GAMEPLAY, float("-inf")
+
+    for segment in segments:
+        final = segment.final
+
+        if _key(state, entered) == _key(GAMEPLAY, float("-inf")):
+            events += segment.events
+        else:
+            repaired += 1
+            rerun = analyze_segment(segment.path, segment.start, segment.stop, step=segment.step, state=state,
+                                    entered=entered, reference=segment.transitions)
+            events += rerun.events
+
+            if rerun.converged is None:
+                final = rerun.final
+            else:
+                events += [(frame, action) for frame, action in segment.events if frame > rerun.converged]
+
+        state, entered = final
+
+    return events, repaired
+
+
+def score(player, events, fps):
+    """
+    Apply events the way the counter does, with the free skips and penalties of [settings]
+    :param events: List of (frame, action)
+    :return: List of Event
+    """
+    free_skips = config.get("settings", "free_skips")
+    skip_penalty = config.get("settings", "skip_penalty")
+    game_over_penalty = config.get("settings", "game_over_penalty")
+
+    result = []
+    points, skips = 0, 0
+
+    for frame, action in events:
+        if action == registry.CLEAR:
+            points += 1
+        elif action == registry.SKIP:
+            skips += 1
+            if skips > free_skips:
+                points += skip_penalty
+        elif action == registry.GAME_OVER:
+            points += game_over_penalty
+
+        result.append(Event(player, frame, frame / fps, action, points, skips))
+
+    return result
+
+
+def analyze(paths, processes=None, segment_seconds=120, analysis_fps=30):
+    """
+    Recount a recorded race, one video per player. Every video is split into segments that are analysed in parallel
+    worker processes, then merged in order.
+    :param paths: List of video files, the index of a file is its player
+    :param processes: Worker processes, one per CPU core if None
+    :param segment_seconds: Length of a segment
+    :param analysis_fps: Frames checked per second of video, the counter checks 30
+    :return: Dictionary of "events" (list of Event in time order), "scores" (list of (score, skips) per player),
+             "video_seconds", "seconds" and "repaired"
+    """
+    settings = config.snapshot()
+    _init(settings)
+
+    tasks = []
+    rates = {}
+    for path in paths:
+        capture = cv2.VideoCapture(path)
+        rates[path] = capture.get(cv2.CAP_PROP_FPS) or 30
+        capture.release()
+
+        tasks += split(path, segment_seconds, max(int(round(rates[path] / analysis_fps)), 1))
+
+    start = time.perf_counter()
+    processes = processes or multiprocessing.cpu_count()
+
+    # Spawned, as with the sharded capture mode, and given the config as it is in this process
+    context = multiprocessing.get_context("spawn")
+    with context.Pool(min(processes, len(tasks)), initializer=_init, initargs=(settings,)) as pool:
+        segments = []
+        for i, segment in enumerate(pool.imap(_analyze_segment, tasks)):
+            segments.append(segment)
+            print("\rAnalysed {}/{} segments".format(i + 1, len(tasks)), end="", flush=True)
+        print()
+
+    events = []
+    scores = []
+    repaired = 0
+    video_seconds = 0.0
+
+    for player, path in enumerate(paths):
+        merged, count = merge([s for s in segments if s.path == path])
+        repaired += count
+
+        player_events = score(player, merged, rates[path])
+        events += player_events
+        scores.append((player_events[-1].score, player_events[-1].skips) if player_events else (0, 0))
+
+        frames = max(stop for p, _, stop, _ in tasks if p == path)
+        video_seconds = max(video_seconds, frames / rates[path])
+
+    events.sort(key=lambda e: (e.time, e.player))
+
+    return {
+        "events": events,
+        "scores": scores,
+        "video_seconds": video_seconds,
+        "seconds": time.perf_counter() - start,
+        "repaired": repaired,
+    }
+
+
+def format_time(seconds):
+    """ Returns H:MM:SS.mmm """
+    minutes, seconds = divmod(seconds, 60)
+    hours, minutes = divmod(int(minutes), 60)
+    return "{}:{:02d}:{:06.3f}".format(hours, minutes, seconds)
+
+
+def print_report(result):
+    for event in result["events"]:
+        print("{:>14}  Player {}  {:<10} score {:>4}  skips {:>3}".format(
+            format_time(event.time), event.player, event.action, event.score, event.skips))
+
+    print()
+    for player, (points, skips) in enumerate(result["scores"]):
+        print("Player {}: score {}, skips {}".format(player, points, skips))
+
+    print("Analysed {} of video in {:.1f} s, {:.1f}x real time, {} segment boundaries repaired".format(
+        format_time(result["video_seconds"]), result["seconds"],
+        result["video_seconds"] / max(result["seconds"], 1e-9), result["repaired"]))
@@ -0,0 +1,399 @@
+import json
+import time
+import tempfile
+
+import numpy as np
+import cv2
+
+from as64 import config, capture, discovery
+from as64.session import CaptureSession, FakeSource
+from mm2 import detection
+from mm2.registry import DetectorRegistry
+from mm2.engine import CascadeEngine
+from mm2.counter import compile_detection, to_canvas
+from mm2.gamestate import GameStateMachine, observe
+from mm2.writer import ScoreWriter
+
+
+# Stages of a counted frame that are timed individually, in pipeline order. "in_range" and "count" are the colour
+# matches within "detect"
+STAGES = ["capture", "canvas", "detect", "in_range", "count", "write"]
+
+# Time available per frame at the counter's default rate
+FRAME_BUDGET = 1 / 30
+
+
+class _CorpusBackend(capture.CaptureBackend):
+    """
+    Serves a corpus of frames held in memory. Each window starts at a different offset into the corpus. Frames are
+    copied on grab to model the new image a capture allocates every frame.
+    """
+
+    throttled = False
+
+    def __init__(self, frames):
+        self._frames = frames
+        self._index = {}
+
+    def get_handles(self, count):
+        handles = ["corpus:{}".format(i) for i in range(count)]
+        for i, handle in enumerate(handles):
+            self._index[handle] = i * len(self._frames) // count
+        return handles
+
+    def grab(self, handle):
+        i = self._index[handle]
+        self._index[handle] = i + 1
+        return self._frames[i % len(self._frames)].copy()
+
+    def get_size(self, handle):
+        return [self._frames[0].shape[1], self._frames[0].shape[0]]
+
+
+def load_corpus(source=None, frames=120):
+    """
+    Load frames into memory from a video file or image directory, or generate them if no source is given
+    :param source: Path to a video file or image directory
+    :param frames: Maximum number of frames to load
+    :return: List of Numpy Arrays
+    """
+    if source:
+        backend = capture.ReplayBackend(sources=[source], loop=False, realtime=False)
+    else:
+        # Inject events often enough that the full resolution checks are part of the measurement
+        backend = capture.SyntheticBackend(event_interval=max(frames // 8, 2), realtime=False)
+
+    handle = backend.get_handles(1)[0]
+    corpus = []
+    for _ in range(frames):
+        image = backend.grab(handle)
+        if image is None:
+            break
+        corpus.append(image)
+    backend.close()
+
+    if not corpus:
+        raise ValueError("No frames could be read from '{}'".format(source))
+
+    return corpus
+
+
+class _Pipeline(object):
+    """
+    The steps the counter takes for a frame, run with the counter's own detection (engine, gating, game states and
+    canvas as configured) and every stage timed
+    """
+
+    def __init__(self, windows):
+        self.detection = compile_detection()
+        self.machine = GameStateMachine(windows=windows, black=self.detection.black, timeout=self.detection.timeout)
+        self.canvases = [None] * windows
+
+        self.timings = {stage: 0.0 for stage in STAGES}
+
+    def time_stage(self, stage, seconds):
+        self.timings[stage] += seconds
+
+    def run_frame(self, backend, index, handle, writer, output_file):
+        """
+        :return: (dictionary of stage -> seconds, seconds of the whole frame)
+        """
+        for stage in STAGES:
+            self.timings[stage] = 0.0
+
+        detection = self.detection
+        frame_start = start = time.perf_counter()
+        image = backend.grab(handle)
+        frame_time = backend.get_time(handle)
+        self.timings["capture"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        canvas = image
+        if detection.canvas:
+            canvas = self.canvases[index] = to_canvas(image, self.canvases[index], detection)
+        self.timings["canvas"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        screen = self.machine.current(index, frame_time)
+        _, near, screen = observe(detection.engine, detection.registry, index, canvas, screen,
+                                  detection.near_fraction, detection.black, (image.shape[1], image.shape[0]))
+        self.machine.advance(index, screen, frame_time, near)
+        self.timings["detect"] = time.perf_counter() - start
+
+        backend.release(handle, image)
+
+        # Score files are only written on events, time a write every frame to know its worst case cost. Only queuing
+        # the update is on the capture loop, the file is written by the writer's thread
+        start = time.perf_counter()
+        writer.write(output_file, 0)
+        self.timings["write"] = time.perf_counter() - start
+
+        return dict(self.timings), time.perf_counter() - frame_start
+
+
+def _summarise(samples):
+    samples = np.array(samples) * 1000
+    mean = float(samples.mean())
+    return {
+        "mean_ms": mean,
+        "p50_ms": float(np.percentile(samples, 50)),
+        "p99_ms": float(np.percentile(samples, 99)),
+        "ops_per_sec": 1000 / mean if mean else float("inf"),
+    }
+
+
+def run_case(corpus, resolution, windows, iterations):
+    """
+    Drive the pipeline round-robin over a number of windows at a given resolution
+    :param corpus: List of frames
+    :param resolution: [width, height] frames are resized to
+    :param windows: Number of windows
+    :param iterations: Number of frames to process
+    :return: Dictionary of results
+    """
+    width, height = resolution
+    frames = [cv2.resize(frame, (width, height)) if frame.shape[:2] != (height, width) else frame
+              for frame in corpus]
+
+    backend = _CorpusBackend(frames)
+    handles = backend.get_handles(windows)
+    pipeline = _Pipeline(windows)
+
+    samples = {stage: [] for stage in STAGES}
+    totals = []
+
+    with tempfile.TemporaryDirectory() as directory:
+        writer = ScoreWriter(directory=directory)
+        writer.start()
+        output_files = ["player_{}".format(i) for i in range(windows)]
+
+        # The colour matches of the real detection path report their own stages
+        detection.set_stage_hook(pipeline.time_stage)
+        try:
+            for i in range(iterations):
+                timings, total = pipeline.run_frame(backend, i % windows, handles[i % windows], writer,
+                                                    output_files[i % windows])
+                for stage in STAGES:
+                    samples[stage].append(timings[stage])
+                totals.append(total)
+        finally:
+            detection.set_stage_hook(None)
+
+        writer.stop()
+        write_latency = writer.get_stats()
+
+    total = _summarise(totals)
+    frames_per_sec = total["ops_per_sec"]
+
+    return {
+        "resolution": "{}x{}".format(width, height),
+        "windows": windows,
+        "iterations": iterations,
+        "stages": {stage: _summarise(samples[stage]) for stage in STAGES},
+        "total": total,
+        "budget_used": total["mean_ms"] / (FRAME_BUDGET * 1000),
+        # Round-robin visits one window per frame so every window shares the achievable rate
+        "per_window_hz": min(frames_per_sec, 1 / FRAME_BUDGET) / windows,
+        "write_latency_ms": write_latency["mean_latency"] * 1000,
+    }
+
+
+def run(corpus, resolutions, window_counts, iterations):
+    results = []
+    for resolution in resolutions:
+        for windows in window_counts:
+            results.append(run_case(corpus, resolution, windows, iterations))
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """
+    Compare results against a baseline, returning a list of regressions. A stage regresses when its p50 or p99
+    latency exceeds the baseline by more than the tolerance.
+    """
+    previous = {(r["resolution"], r["windows"]): r for r in baseline}
+    regressions = []
+
+    for result in results:
+        old = previous.get((result["resolution"], result["windows"]))
+        if not old:
+            continue
+
+        stages = dict(result["stages"], total=result["total"])
+        old_stages = dict(old["stages"], total=old["total"])
+
+        for stage, summary in stages.items():
+            if stage not in old_stages:
+                continue
+            for key in ("p50_ms", "p99_ms"):
+                before = old_stages[stage][key]
+                after = summary[key]
+                # Ignore sub-microsecond stages, their percentiles are timer noise
+                if after > before * (1 + tolerance) and after - before > 0.001:
+                    regressions.append({
+                        "resolution": result["resolution"],
+                        "windows": result["windows"],
+                        "stage": stage,
+                        "metric": key,
+                        "baseline": before,
+                        "current": after,
+                    })
+
+    return regressions
+
+
+def cascade_report(corpus, strides=(1, 2, 4, 8, 16)):
+    """
+    Measure accuracy against speed of the coarse-to-fine cascade for every detector and subsampling factor. Decisions
+    are compared to the full resolution check on the same frames.
+    :param corpus: List of frames
+    :param strides: Subsampling factors to evaluate
+    :return: List of dictionaries, one per detector and stride
+    """
+    registry = DetectorRegistry.compile()
+    margin = config.get("thresholds", "cascade_margin")
+    report = []
+
+    for name in registry.detectors:
+        sized = [registry.for_size(frame.shape[1], frame.shape[0]).detectors[name] for frame in corpus]
+        lower, upper, threshold = sized[0].lower, sized[0].upper, sized[0].threshold
+        crops = [detector.crop(frame) for detector, frame in zip(sized, corpus)]
+
+        reference = [detection.image_in_range(crop, lower, upper, threshold) for crop in crops]
+
+        for stride in strides:
+            decisions = []
+            start = time.perf_counter()
+            for crop in crops:
+                decisions.append(detection.cascade_in_range(crop, lower, upper, threshold, stride, margin))
+            elapsed = time.perf_counter() - start
+
+            # Frames whose coarse estimate was too close to call and needed the full resolution check
+            fallbacks = sum(1 for crop in crops
+                            if stride > 1 and abs(detection.match_fraction(detection.subsample(crop, stride),
+                                                                           lower, upper) - threshold)
+                            <= margin * threshold)
+
+            report.append({
+                "detector": name,
+                "stride": stride,
+                "mean_ms": elapsed / len(crops) * 1000,
+                "accuracy": sum(1 for a, b in zip(decisions, reference) if a == b) / len(crops),
+                "false_positives": sum(1 for a, b in zip(decisions, reference) if a and not b),
+                "false_negatives": sum(1 for a, b in zip(decisions, reference) if b and not a),
+                "positives": sum(reference),
+                "full_checks": fallbacks / len(crops),
+            })
+
+    return report
+
+
+def print_cascade_report(report):
+    print("  {:<14}{:>8}{:>10}{:>10}{:>6}{:>6}{:>6}{:>12}".format(
+        "detector", "stride", "mean ms", "accuracy", "pos", "fp", "fn", "full checks"))
+    for r in report:
+        print("  {:<14}{:>8}{:>10.3f}{:>10.2%}{:>6}{:>6}{:>6}{:>12.1%}".format(
+            r["detector"], r["stride"], r["mean_ms"], r["accuracy"], r["positives"], r["false_positives"],
+            r["false_negatives"], r["full_checks"]))
+    print()
+
+
+def capture_report(corpus, iterations=300):
+    """
+    Compare capturing and checking frames the way bit_blit did, a new bitmap copied into a new array and sliced to
+    BGR, with a CaptureSession reusing BGRA buffers. Windows are faked by a FakeSource serving the corpus.
+    :return: Dictionary of mean times in milliseconds and the session's buffer allocations
+    """
+    registry = DetectorRegistry.compile()
+    engine = CascadeEngine(config.get("thresholds", "cascade_margin"))
+    frames = [cv2.cvtColor(frame, cv2.COLOR_BGR2BGRA) for frame in corpus]
+
+    def check(image):
+        results = engine.frame(0, image)
+        for rule in registry.for_size(image.shape[1], image.shape[0]).rules:
+            if all(results.match(d)[0] for d in rule.detectors):
+                break
+
+    start = time.perf_counter()
+    for i in range(iterations):
+        frame = frames[i % len(frames)]
+        bits = frame.tobytes()
+        check(np.frombuffer(bits, np.uint8).reshape(frame.shape)[:, :, :3])
+    legacy = (time.perf_counter() - start) / iterations * 1000
+
+    session = CaptureSession(FakeSource(frames))
+    start = time.perf_counter()
+    for i in range(iterations):
+        image = session.grab()
+        check(image)
+        session.release(image)
+    pooled = (time.perf_counter() - start) / iterations * 1000
+
+    return {"iterations": iterations, "legacy_ms": legacy, "session_ms": pooled,
+            "allocations": session.get_stats()["allocations"]}
+
+
+def _legacy_find(enumerator, process_name):
+    """ Window discovery as it was before WindowDiscovery, one window enumeration per process """
+    hwnds = []
+    for pid, name in enumerator.processes():
+        for hwnd, p in enumerator.windows():
+            if p == pid:
+                if name == process_name:
+                    hwnds.append(hwnd)
+                break
+    return hwnds
+
+
+def discovery_report(processes=300, windows=600, players=6, iterations=20):
+    """
+    Time window discovery against a fake enumerator of a busy machine
+    :return: Dictionary of mean times in milliseconds
+    """
+    process_list = [(pid, "vlc.exe" if pid < players else "process{}.exe".format(pid)) for pid in range(processes)]
+    window_list = [(hwnd, hwnd % processes) for hwnd in range(1, windows + 1)]
+    enumerator = discovery.StaticEnumerator(process_list, window_list)
+    window_discovery = discovery.WindowDiscovery(enumerator)
+
+    def mean_ms(function):
+        start = time.perf_counter()
+        for _ in range(iterations):
+            function()
+        return (time.perf_counter() - start) / iterations * 1000
+
+    legacy = mean_ms(lambda: _legacy_find(enumerator, "vlc.exe"))
+
+    def cold():
+        window_discovery.invalidate()
+        window_discovery.find("vlc.exe")
+
+    return {
+        "processes": processes,
+        "windows": windows,
+        "legacy_ms": legacy,
+        "single_pass_ms": mean_ms(cold),
+        "cached_ms": mean_ms(lambda: window_discovery.find("vlc.exe")),
+    }
+
+
+def print_results(results):
+    for result in results:
+        print("{} x{} windows ({} frames) -- {:.1f} fps, {:.0%} of frame budget, {:.1f} Hz per window, "
+              "{:.1f} ms write latency".format(
+                  result["resolution"], result["windows"], result["iterations"], result["total"]["ops_per_sec"],
+                  result["budget_used"], result["per_window_hz"], result.get("write_latency_ms", 0.0)))
+        print("  {:<10}{:>12}{:>10}{:>10}{:>10}".format("stage", "ops/sec", "mean ms", "p50 ms", "p99 ms"))
+        for stage, summary in dict(result["stages"], total=result["total"]).items():
+            print("  {:<10}{:>12.0f}{:>10.3f}{:>10.3f}{:>10.3f}".format(
+                stage, summary["ops_per_sec"], summary["mean_ms"], summary["p50_ms"], summary["p99_ms"]))
+        print()
+
+
+def save(path, results):
+    with open(path, 'w') as file:
+        json.dump({"created": time.time(), "results": results}, file, indent=2)
+
+
+def load(path):
+    with open(path) as file:
+        return json.load(file)["results"]
@@ -0,0 +1,269 @@
+import os
+import time
+from collections import namedtuple
+
+import numpy as np
+import cv2
+
+from as64 import config, capture
+
+
+# Offsets added to every channel of a detector's configured bounds to get the candidate bounds
+DELTAS = (-20, -10, 0, 10, 20)
+
+# Candidate match fraction thresholds
+THRESHOLDS = tuple(np.round(np.arange(0.05, 1.0, 0.05), 2))
+
+Candidates = namedtuple("Candidates", ["lower", "upper"])
+
+
+def load_labelled_corpus(path, registry, stride=4):
+    """
+    Load a labelled corpus, a directory with one sub-directory of frames per label. A label is the name of a rule,
+    whose frames are positives for all of the rule's detectors, or of a single detector. Frames of any other label,
+    e.g. 'none', are negatives for every detector.
+
+    Only the detector regions of a frame are kept, subsampled to every Nth row and column.
+
+    :param path: Corpus directory
+    :param registry: DetectorRegistry
+    :param stride: Subsampling factor
+    :return: Dictionary of detector name -> (crops, Numpy Array of booleans, True where a crop is a positive)
+    """
+    rules = {rule.name: [d.name for d in rule.detectors] for rule in registry.rules}
+    crops = {name: [] for name in registry.detectors}
+    labels = {name: [] for name in registry.detectors}
+
+    for label in sorted(os.listdir(path)):
+        directory = os.path.join(path, label)
+        if not os.path.isdir(directory):
+            continue
+
+        positives = rules.get(label, [label] if label in registry.detectors else [])
+
+        for file in sorted(os.listdir(directory)):
+            if not file.lower().endswith(capture.IMAGE_EXTENSIONS):
+                continue
+
+            frame = cv2.imread(os.path.join(directory, file))
+            if frame is None:
+                continue
+
+            # Copies, so that the full frame is not kept alive by views of it
+            sized = registry.for_size(frame.shape[1], frame.shape[0])
+            for name, detector in sized.detectors.items():
+                crops[name].append(detector.crop(frame)[::stride, ::stride].copy())
+                labels[name].append(name in positives)
+
+    return {name: (crops[name], np.array(labels[name], dtype=bool)) for name in registry.detectors}
+
+
+def candidate_bounds(lower, upper, deltas=DELTAS):
+    """
+    :return: Candidates of sorted, unique lower and upper values per channel around the given bounds, which are always
+             among them whether or not the deltas include 0
+    """
+    deltas = np.union1d(deltas, [0]).astype(int)
+
+    def values(bound):
+        return [np.unique(np.clip(int(b) + deltas, 0, 255)) for b in bound]
+
+    return Candidates(values(lower), values(upper))
+
+
+def sweep(crops, candidates):
+    """
+    Compute the match fraction of every crop for every combination of candidate bounds.
+
+    A pixel value v passes the lower candidates below or equal to it and the upper candidates above or equal to it,
+    so per channel it is described by (a, b): the number of lower candidates <= v and of upper candidates < v. Each
+    crop is reduced to a histogram over the (a, b) pairs of its three channels. Summing the histogram over a > i and
+    b <= j, with cumulative sums along each axis, gives the number of pixels within lower candidate i and upper
+    candidate j of every channel at once.
+
+    :param crops: List of BGR crops of one detector
+    :param candidates: Candidates as returned by candidate_bounds
+    :return: Numpy Array of shape (crops, lower B, upper B, lower G, upper G, lower R, upper R)
+    """
+    values = np.arange(256)
+    sizes = []
+    luts = []
+
+    for lower, upper in zip(candidates.lower, candidates.upper):
+        a = np.searchsorted(lower, values, side='right')
+        b = np.searchsorted(upper, values, side='left')
+        sizes += [len(lower) + 1, len(upper) + 1]
+        luts.append(a * (len(upper) + 1) + b)
+
+    # Combined (a, b) code of all three channels as a single index into the flattened histogram
+    bins = int(np.prod(sizes))
+    channel_bins = [sizes[0] * sizes[1], sizes[2] * sizes[3], sizes[4] * sizes[5]]
+    luts[0] = (luts[0] * channel_bins[1] * channel_bins[2]).astype(np.uint32)
+    luts[1] = (luts[1] * channel_bins[2]).astype(np.uint32)
+    luts[2] = luts[2].astype(np.uint32)
+
+    fractions = np.empty([len(crops)] + [s - 1 for s in sizes])
+
+    # Histograms of a batch of crops are computed with a single bincount, batches keep memory bounded
+    batch = max(1, (1 << 22) // bins)
+    for start in range(0, len(crops), batch):
+        chunk = crops[start:start + batch]
+        codes = []
+        pixels = []
+        for i, crop in enumerate(chunk):
+            code = luts[0][crop[..., 0]] + luts[1][crop[..., 1]] + luts[2][crop[..., 2]]
+            codes.append(code.ravel() + i * bins)
+            pixels.append(max(code.size, 1))
+
+        histogram = np.bincount(np.concatenate(codes), minlength=len(chunk) * bins)
+        histogram = histogram.reshape([len(chunk)] + sizes)
+
+        for axis in range(1, 7, 2):
+            # Lower axis: pixels with a > i, a reversed cumulative sum without its first entry
+            histogram = np.flip(np.cumsum(np.flip(histogram, axis), axis), axis)
+            histogram = np.delete(histogram, 0, axis)
+            # Upper axis: pixels with b <= j, a cumulative sum without its last entry
+            histogram = np.cumsum(histogram, axis + 1)
+            histogram = np.delete(histogram, -1, axis + 1)
+
+        fractions[start:start + len(chunk)] = histogram / np.array(pixels).reshape([-1] + [1] * 6)
+
+    return fractions
+
+
+def evaluate(fractions, labels, thresholds=THRESHOLDS):
+    """
+    Score every combination of candidate bounds
+    :param fractions: Match fractions as returned by sweep
+    :param labels: Boolean Numpy Array, True for positive crops
+    :return: Dictionary of Numpy Arrays over the bound combinations: "threshold" with the best F1 score, its
+             "precision", "recall" and "f1", and the "margin" between the lowest positive and highest negative fraction
+    """
+    shape = fractions.shape[1:]
+    flat = fractions.reshape(len(fractions), -1)
+    positive = flat[labels]
+    negative = flat[~labels]
+
+    best = {key: np.zeros(flat.shape[1]) for key in ("threshold", "precision", "recall", "f1")}
+    best["f1"] -= 1
+
+    for threshold in thresholds:
+        true_positives = np.count_nonzero(positive > threshold, axis=0)
+        false_positives = np.count_nonzero(negative > threshold, axis=0)
+
+        precision = true_positives / np.maximum(true_positives + false_positives, 1)
+        recall = true_positives / max(len(positive), 1)
+        f1 = 2 * precision * recall / np.maximum(precision + recall, 1e-9)
+
+        better = f1 > best["f1"]
+        for key, value in (("threshold", threshold), ("precision", precision), ("recall", recall), ("f1", f1)):
+            best[key] = np.where(better, value, best[key])
+
+    lowest_positive = positive.min(axis=0) if len(positive) else np.ones(flat.shape[1])
+    highest_negative = negative.max(axis=0) if len(negative) else np.zeros(flat.shape[1])
+    best["margin"] = lowest_positive - highest_negative
+
+    return {key: value.reshape(shape) for key, value in best.items()}
+
+
+def _bounds(candidates, index):
+    lower = [int(candidates.lower[c][index[2 * c]]) for c in range(3)]
+    upper = [int(candidates.upper[c][index[2 * c + 1]]) for c in range(3)]
+    return lower, upper
+
+
+def _score(fractions, labels, lower, upper, threshold):
+    """ Metrics of one setting, given the match fractions of every crop under its bounds """
+    scores = evaluate(fractions.reshape(-1, 1), labels, [threshold])
+    return {
+        "lower": lower,
+        "upper": upper,
+        "threshold": threshold,
+        "precision": float(scores["precision"][0]),
+        "recall": float(scores["recall"][0]),
+        "margin": float(scores["margin"][0]),
+    }
+
+
+def calibrate(corpus, registry, deltas=DELTAS, thresholds=THRESHOLDS):
+    """
+    Sweep the bounds and thresholds of every detector with labelled positives
+    :param corpus: Labelled corpus as returned by load_labelled_corpus
+    :param registry: DetectorRegistry whose detectors' bounds are the centre of the sweep
+    :return: List of dictionaries, one per detector, with the metrics of the configured and the recommended settings
+    """
+    results = []
+
+    for name, (crops, labels) in corpus.items():
+        if not labels.any() or not len(crops):
+            continue
+
+        detector = registry.detectors[name]
+        candidates = candidate_bounds(detector.lower, detector.upper, deltas)
+
+        start = time.perf_counter()
+        fractions = sweep(crops, candidates)
+        scores = evaluate(fractions, labels, thresholds)
+        elapsed = time.perf_counter() - start
+
+        # Best F1, ties are broken by the widest margin
+        order = np.lexsort((scores["margin"].ravel(), scores["f1"].ravel()))
+        index = np.unravel_index(order[-1], scores["f1"].shape)
+        lower, upper = _bounds(candidates, index)
+
+        threshold = float(scores["threshold"][index])
+        best = fractions[(slice(None),) + index]
+        if scores["margin"][index] > 0 and (~labels).any():
+            # Fully separated, put the threshold in the middle of the gap
+            threshold = round(float(best[labels].min() + best[~labels].max()) / 2, 3)
+
+        # The configured bounds are always among the candidates, see candidate_bounds
+        current = []
+        for c in range(3):
+            current.append(int(np.flatnonzero(candidates.lower[c] == detector.lower[c])[0]))
+            current.append(int(np.flatnonzero(candidates.upper[c] == detector.upper[c])[0]))
+
+        results.append({
+            "detector": name,
+            "frames": len(crops),
+            "positives": int(labels.sum()),
+            "combinations": int(np.prod(scores["f1"].shape)) * len(thresholds),
+            "seconds": elapsed,
+            "current": _score(fractions[(slice(None),) + tuple(current)], labels, detector.lower.tolist(),
+                              detector.upper.tolist(), detector.threshold),
+            "recommended": _score(best, labels, lower, upper, threshold),
+        })
+
+    return results
+
+
+def print_report(results):
+    print("  {:<14}{:>8}{:>6}{:>14}{:>12}{:>10}{:>10}{:>10}".format(
+        "detector", "frames", "pos", "combinations", "seconds", "precision", "recall", "margin"))
+    for r in results:
+        for setting in ("current", "recommended"):
+            scores = r[setting]
+            print("  {:<14}{:>8}{:>6}{:>14}{:>12.2f}{:>10.2%}{:>10.2%}{:>10.3f}  {} {} > {}".format(
+                r["detector"] if setting == "current" else "", r["frames"], r["positives"], r["combinations"],
+                r["seconds"], scores["precision"], scores["recall"], scores["margin"], scores["lower"],
+                scores["upper"], scores["threshold"]))
+    print()
+
+
+def format_thresholds(results):
+    """
+    Format the recommended settings as a [thresholds] section, keyed by each detector's colour prefix
+    :param results: List returned by calibrate
+    :return: String
+    """
+    definitions = config.get("detectors")
+    lines = ["[thresholds]"]
+
+    for r in results:
+        prefix = definitions.get(r["detector"], {}).get("colour", r["detector"])
+        recommended = r["recommended"]
+        lines.append("{}_lower_bound = {}".format(prefix, recommended["lower"]))
+        lines.append("{}_upper_bound = {}".format(prefix, recommended["upper"]))
+        lines.append("{}_threshold = {}".format(prefix, recommended["threshold"]))
+
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,107 @@
+import os
+import json
+import socket
+import logging
+import socketserver
+from threading import Thread
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    """
+    One request per line, either JSON or plain commands:
+
+        {"commands": [["set", 0, 3], ["skip", 1, 2], ["status"]]}
+        set 0 3; skip 1 2; status
+
+    Every request is answered with one line of JSON, {"results": [...], "status": {...}}, holding a result per command
+    in order and the status after the whole batch.
+    """
+
+    def handle(self):
+        for line in self.rfile:
+            line = line.decode("utf-8", "replace").strip()
+            if not line:
+                continue
+
+            try:
+                response = self.server.execute(_parse(line))
+            except ValueError as e:
+                response = {"error": str(e)}
+            except Exception as e:
+                logging.getLogger(__name__).exception('')
+                response = {"error": repr(e)}
+
+            try:
+                self.wfile.write(json.dumps(response).encode("utf-8") + b"\n")
+                self.wfile.flush()
+            except OSError:
+                return
+
+
+def _parse(line):
+    """ Returns a list of commands, each a list of the command name followed by its arguments """
+    if line.startswith("{"):
+        try:
+            commands = json.loads(line)["commands"]
+        except (ValueError, KeyError, TypeError):
+            raise ValueError("Expected {\"commands\": [[name, args...], ...]}")
+    else:
+        commands = [command.split() for command in line.split(";")]
+
+    commands = [command for command in commands if command]
+    if not all(isinstance(command, list) and isinstance(command[0], str) for command in commands):
+        raise ValueError("Every command must be a list starting with the command name")
+
+    return commands
+
+
+class _TCPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+if hasattr(socket, "AF_UNIX"):
+    class _UnixServer(socketserver.ThreadingUnixStreamServer):
+        daemon_threads = True
+else:
+    _UnixServer = None
+
+
+class ControlServer(object):
+    """
+    Local control endpoint for scripting the counter, on a TCP port or a Unix socket. Batches of commands are passed
+    to 'execute', which returns the JSON response.
+    """
+
+    def __init__(self, execute, host="127.0.0.1", port=8766, path=None):
+        """
+        :param execute: Function taking a list of commands and returning a JSON serialisable dictionary
+        :param host: Address to listen on
+        :param port: TCP port
+        :param path: Listen on this Unix socket instead of a TCP port, where supported
+        """
+        if path and _UnixServer:
+            if os.path.exists(path):
+                os.remove(path)
+            self._server = _UnixServer(path, _Handler)
+        else:
+            self._server = _TCPServer((host, port), _Handler)
+
+        self._server.execute = execute
+        self._path = path if path and _UnixServer else None
+
+        self._thread = Thread(target=self._server.serve_forever, name="ControlServer", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+        if self._path and os.path.exists(self._path):
+            os.remove(self._path)
+
+    @property
+    def address(self):
+        return self._server.server_address
@@ -1,9 +1,15 @@
 import sys
 import time
+import threading
+from concurrent.futures import TimeoutError
 
-from as64.screen import get_title
+from as64 import config
+from as64.paths import base_path
 
-from mm2.counter import Counter
+from mm2 import startup
+from mm2.journal import ScoreJournal
+from mm2.server import ScoreBroadcaster, ScoreServer
+from mm2.writer import ScoreWriter
 from mm2.command import register_command, execute_command
 
 
@@ -12,11 +18,52 @@ class Controller(object):
     Count course completions for two instances of SMM2 and handle commands for use by re-streamer
     """
 
+    # Seconds to wait for the counter to apply a command before reporting it as pending
+    COMMAND_TIMEOUT = 2.0
+
     def __init__(self):
         self._running = False
 
         self.counter = None
 
+        # Scores pushed to overlays, kept by the controller so connected clients survive counter restarts
+        self._broadcaster = ScoreBroadcaster()
+        self._server = None
+
+        if config.get("server", "enabled"):
+            self._server = ScoreServer(broadcaster=self._broadcaster,
+                                       host=config.get("server", "host"),
+                                       port=config.get("server", "port"))
+            self._server.start()
+
+        # Writes the score files of every counter, a single writer so that a stopped counter's writes can never land
+        # after those of the counter replacing it
+        self._writer = ScoreWriter(directory=config.get("output", "directory"),
+                                   coalesce=config.get("output", "coalesce_ms") / 1000)
+        self._writer.start()
+
+        # States of the last counter, a restarted counter continues from them instead of from 0
+        self._last_states = {}
+        self._journal = None
+
+        if config.get("journal", "enabled"):
+            self._journal = ScoreJournal(path=base_path(config.get("journal", "file")),
+                                         compact_after=config.get("journal", "compact_after"))
+            self._last_states = self._journal.load()
+            self._journal.start()
+
+        # Scriptable endpoint taking batches of commands, answering with JSON
+        self._control = None
+
+        if config.get("control", "enabled"):
+            from mm2.control import ControlServer
+
+            self._control = ControlServer(execute=self.execute_control,
+                                          host=config.get("control", "host"),
+                                          port=config.get("control", "port"),
+                                          path=config.get("control", "socket") or None)
+            self._control.start()
+
         register_command(self.start)
         register_command(self.stop)
         register_command(self.reset)
@@ -25,8 +72,13 @@ class Controller(object):
         register_command(self.skip)
         register_command(self.swap)
         register_command(self.status)
+        register_command(self.stats)
+        register_command(self.dump)
+        register_command(self.reload)
         register_command(self.quit)
 
+        startup.mark("controller")
+
         # Print start-up message
         print("Super Mario Maker 2 Completion Counter")
         print("--------------------------------------")
@@ -80,6 +132,14 @@ class Controller(object):
         """Reset number of course completions to 0 and restart counting process"""
         self._stop_counter()
 
+        # Keep the windows, only the scores start over
+        self._last_states = {player: {"handle": state.get("handle")} for player, state in self._last_states.items()}
+
+        # Otherwise the next launch would restore the scores from before the reset
+        if self._journal:
+            for player in self._last_states:
+                self._journal.record(player, 0, 0, float("-inf"))
+
         self._start_counter()
 
         if self._is_running():
@@ -91,9 +151,12 @@ class Controller(object):
     def refresh(self):
         """Attempt to replace broken handles with new windows"""
         
-        self.counter.refresh_handles()
-        
-        Controller.output("Handles refreshed.")
+        if not self._is_running():
+            Controller.output("Counter not running.")
+            return
+
+        if self._wait(self.counter.refresh_handles()):
+            Controller.output("Handles refreshed.")
 
     def set(self, player, score):
         """Set a player's score to a given amount i.e. set 0 3 will set player 0's score to 3"""
@@ -115,10 +178,8 @@ class Controller(object):
                 Controller.output("Could not set player. Value must be a number!")
                 return False
 
-        self.counter.set_score(player=player,
-                               score=score)
-
-        Controller.output("Player score set.")
+        if self._wait(self.counter.set_score(player=player, score=score)):
+            Controller.output("Player score set.")
 
     def skip(self, player, skips):
         """Set a player's skip count to a given amount i.e. set 0 2 will set player 0's skip count to 2 (does not change score)"""
@@ -140,10 +201,8 @@ class Controller(object):
                 Controller.output("Could not set player. Value must be a number!")
                 return False
 
-        self.counter.set_skip_count(player=player,
-                                    skips=skips)
-
-        Controller.output("Player skip count set.")
+        if self._wait(self.counter.set_skip_count(player=player, skips=skips)):
+            Controller.output("Player skip count set.")
 
     def status(self):
         """Print running status and which VLC window is assigned to each player in order"""
@@ -154,7 +213,7 @@ class Controller(object):
             i = 0
             handle = self.counter.get_handle(index=i)
             while handle:
-                print("Player VLC: {}".format(get_title(handle)))
+                print("Player VLC: {}".format(self.counter.get_title(index=i)))
                 
                 i += 1
                 handle = self.counter.get_handle(i)
@@ -165,6 +224,71 @@ class Controller(object):
             print("Counter stopped.")
             print()
 
+    def stats(self):
+        """Print capture/detection timings, frame rates, missed deadlines and output latency for each player"""
+        if not self._is_running():
+            Controller.output("Counter not running.")
+            return
+
+        from mm2.stats import format_stats
+
+        print("Stats -----------------")
+        print(format_stats(self.counter.get_stats()))
+        print()
+
+    def reload(self):
+        """Re-read config and apply new detector regions, bounds and thresholds without restarting"""
+        try:
+            self._reload()
+        except ValueError as e:
+            Controller.output("Config not reloaded: {}".format(e))
+            return
+
+        Controller.output("Config reloaded. Settings other than detection apply on reset.")
+
+    def _reload(self):
+        """
+        Re-read the config and swap the recompiled detection into the running counter, rolling back to the previous
+        config if it is invalid
+        :raises ValueError: If the config is invalid
+        """
+        try:
+            config.reload()
+
+            if self._is_running():
+                self.counter.reload().result(timeout=Controller.COMMAND_TIMEOUT)
+            else:
+                from mm2.counter import compile_detection
+
+                compile_detection()
+        except TimeoutError:
+            # Queued, the counter swaps it in with its next frame
+            return
+        except Exception as e:
+            # Whatever failed, the counter keeps running on the previous config and so must everything started later
+            config.rollback()
+            raise ValueError(str(e) or type(e).__name__)
+
+    def dump(self, player=None):
+        """Write the recently captured frames of every player, or of one player i.e. dump 1, to disk"""
+        if not self._is_running():
+            Controller.output("Counter must be started before dumping frames.")
+            return False
+
+        if player is not None and not isinstance(player, int):
+            try:
+                player = int(player)
+            except ValueError:
+                Controller.output("Could not set player. Value must be a number!")
+                return False
+
+        queued = self.counter.dump_frames(index=player)
+
+        if queued is None:
+            Controller.output("Frame recording is disabled, enable it in the [recorder] section of the config.")
+        else:
+            Controller.output("Writing frames of {} player(s).".format(queued))
+
     def swap(self, left, right):
         if not self._is_running():
             Controller.output("Counter must be started before swapping windows.")
@@ -184,23 +308,125 @@ class Controller(object):
                 Controller.output("Could not set right window. Value must be a number!")
                 return False
             
-        self.counter.swap_windows(left=left,
-                                  right=right)
-
-        Controller.output("Windows swapped")
+        if self._wait(self.counter.swap_windows(left=left, right=right)):
+            Controller.output("Windows swapped")
 
     def quit(self):
         """Close application"""
         self._stop_counter()
 
+        if self._server:
+            self._server.stop()
+
+        if self._control:
+            self._control.stop()
+
+        if self._journal:
+            self._journal.stop()
+
+        self._writer.stop()
+
         sys.exit(0)
 
     @staticmethod
     def output(text):
         print("{}\n".format(text))
 
+    def _wait(self, future):
+        """
+        Wait for the counter to apply a queued command
+        :return: False if the command failed
+        """
+        try:
+            future.result(timeout=Controller.COMMAND_TIMEOUT)
+        except TimeoutError:
+            Controller.output("Counter is busy, the command will be applied with its next frame.")
+        except IndexError:
+            Controller.output("No such player.")
+            return False
+
+        return True
+
+    def execute_control(self, commands):
+        """
+        Execute a batch of commands from the control endpoint
+        :param commands: List of commands, each a list of the command name followed by its arguments
+        :return: Dictionary of a result per command and the status after the batch
+        """
+        results = []
+
+        for command in commands:
+            name, args = command[0].lower(), command[1:]
+            try:
+                result = {"command": name, "ok": True}
+                result.update(self._control_command(name, args) or {})
+            except IndexError:
+                result = {"command": name, "ok": False, "error": "Missing argument or no such player"}
+            except TimeoutError:
+                result = {"command": name, "ok": False, "error": "Counter busy, command still pending"}
+            except (ValueError, TypeError) as e:
+                result = {"command": name, "ok": False, "error": str(e)}
+            results.append(result)
+
+        return {"results": results, "status": self.get_status()}
+
+    def _control_command(self, name, args):
+        if name == "status":
+            return None
+        if name in ("start", "stop", "reset"):
+            getattr(self, name)()
+            return {"running": self._is_running()}
+        if name == "reload":
+            return self._reload()
+        if name == "stats":
+            return {"stats": self.counter.get_stats() if self._is_running() else None}
+
+        if not self._is_running():
+            raise ValueError("Counter not running")
+
+        if name == "set":
+            future = self.counter.set_score(player=int(args[0]), score=int(args[1]))
+        elif name == "skip":
+            future = self.counter.set_skip_count(player=int(args[0]), skips=int(args[1]))
+        elif name == "swap":
+            future = self.counter.swap_windows(left=int(args[0]), right=int(args[1]))
+        elif name == "refresh":
+            future = self.counter.refresh_handles()
+        elif name == "dump":
+            return {"dumped": self.counter.dump_frames(index=int(args[0]) if args else None)}
+        else:
+            raise ValueError("Unknown command '{}'".format(name))
+
+        future.result(timeout=Controller.COMMAND_TIMEOUT)
+
+    def get_status(self):
+        """
+        Returns a JSON serialisable dictionary of the running status and each player's scores and window
+        """
+        counter = self.counter
+        if not self._is_running():
+            return {"running": False, "players": []}
+
+        # One snapshot, so the scores of all players are from the same moment
+        snapshot = counter.snapshot()
+        players = []
+
+        for state in snapshot.players:
+            try:
+                title = counter.get_title(index=state.player)
+            except Exception:
+                title = None
+
+            players.append({"player": state.player, "score": state.score, "skips": state.skips, "window": title})
+
+        return {"running": True, "version": snapshot.version, "players": players}
+
     def _start_counter(self):
-        self.counter = Counter(listener=self)
+        # Imported with the first counter, numpy and OpenCV are preloaded by main.py in the meantime
+        from mm2.counter import Counter
+
+        self.counter = Counter(listener=self, broadcaster=self._broadcaster, journal=self._journal,
+                               restore=self._last_states, writer=self._writer)
 
         self.counter.start()
 
@@ -208,6 +434,13 @@ class Controller(object):
         try:
             if self.counter:
                 self.counter.stop()
+
+                # Wait for the frame in progress, its score change must be part of the states the next counter gets.
+                # A counter reporting its own failure has already stopped
+                if self.counter is not threading.current_thread() and self.counter.is_alive():
+                    self.counter.join()
+
+                self._last_states = self.counter.get_states()
                 self.counter = None
         except AttributeError:
             pass
@@ -227,8 +460,9 @@ class Controller(object):
 
     def counter_error(self):
         """
-        Callback used by a Counter when an error occurs. tion will attempt to restart the
-        counter after 1 seconds.
+        Callback used by a Counter when its capture loop fails. A single failing window never gets here, the counter
+        replaces its window and its worker carries on. The counter is restarted after 1 second, continuing from its
+        scores and windows.
         """
         Controller.output("Counter error, attempting to restart in 1 second...")
 
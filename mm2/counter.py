@@ -1,21 +1,116 @@
 import time
 import logging
-from threading import Thread, Lock
+import multiprocessing
 
 import numpy as np
 import cv2
+from threading import Thread, Lock
+from collections import namedtuple
+from queue import Queue, Empty
+from concurrent.futures import ThreadPoolExecutor, Future
 
-from as64 import screen, config
+from as64 import config, capture
 from as64.paths import base_path
+from mm2 import registry, startup
+from mm2.registry import DetectorRegistry, check_number, check_pair, check_positive
+from mm2.engine import create_engine
+from mm2.scheduler import FrameScheduler, IDLE
+from mm2.writer import ScoreWriter
+from mm2.pipeline import FrameQueue, BLOCK
+from mm2.stats import WindowStats, StatsDumper
+from mm2.state import PlayerState, StateSnapshot
+from mm2.gamestate import GameStateMachine, COOLDOWN_STATE, observe
+
+
+# Seconds a window whose capture keeps failing waits before looking for a replacement again when none was found,
+# doubled with every further attempt up to the maximum
+RECOVER_DELAY = 1.0
+MAX_RECOVER_DELAY = 30.0
+
+# [detection] canvas_interpolation -> OpenCV interpolation of the canvas
+INTERPOLATIONS = {"nearest": cv2.INTER_NEAREST, "area": cv2.INTER_AREA}
+
+# Everything frames are checked with, compiled from the config and replaced as a whole when the config is reloaded
+Detection = namedtuple("Detection", ["registry", "engine", "near_fraction", "black", "timeout", "canvas",
+                                     "interpolation"])
+
+
+def compile_detection(gating=True):
+    """
+    Compile the detectors, rules and detection settings from the config
+    :param gating: Passed on to create_engine
+    :return: Detection
+    :raises ValueError: If the config is invalid
+    """
+    # Detectors (regions, colour bounds and thresholds) and the rules combining them into clears/skips/game overs
+    detectors = DetectorRegistry.compile()
+
+    # Runs the detectors with the coarse-to-fine cascade, reusing results of unchanged regions if [gating] is enabled
+    engine = create_engine(gating)
+
+    # The black screen between courses, see [states]
+    black = config.get("states", "black_detector") or None
+    if black and (not isinstance(black, str) or black not in detectors.detectors):
+        raise ValueError("Unknown black detector '{}'".format(black))
+
+    # Frames are scaled down to a small fixed canvas before detection, so its cost no longer depends on the size
+    # of the window
+    canvas = check_pair(config.get("detection", "canvas"), "[detection] canvas",
+                        off="[0, 0] to detect on the frame as captured")
+
+    interpolation = config.get("detection", "canvas_interpolation")
+    if not isinstance(interpolation, str) or interpolation not in INTERPOLATIONS:
+        raise ValueError("Unknown canvas interpolation '{}'".format(interpolation))
+
+    # Only used once the scheduler is created on reset, checked here so that a reload is rolled back instead
+    check_positive(config.get("scheduler", "near_fps"), "[scheduler] near_fps")
+    check_positive(config.get("scheduler", "cooldown_fps"), "[scheduler] cooldown_fps")
+
+    return Detection(registry=detectors,
+                     engine=engine,
+                     near_fraction=check_number(config.get("scheduler", "near_fraction"), "[scheduler] near_fraction",
+                                                maximum=1),
+                     black=black,
+                     timeout=check_number(config.get("states", "timeout"), "[states] timeout"),
+                     canvas=canvas,
+                     interpolation=INTERPOLATIONS[interpolation])
+
+
+def to_canvas(image, buffer, detection):
+    """
+    Scale a frame down to the detection canvas
+    :param buffer: Scaled frame returned for the previous frame, reused if the canvas size did not change
+    :return: The scaled frame, pass it as the buffer of the next frame
+    """
+    width, height = detection.canvas
+
+    # A reload may have changed the canvas size
+    if buffer is None or buffer.shape != (height, width, image.shape[2]):
+        buffer = np.empty((height, width, image.shape[2]), dtype=image.dtype)
+
+    return cv2.resize(image, (width, height), dst=buffer, interpolation=detection.interpolation)
 
 
 class Counter(Thread):
     PLAYER_FILE_NAME_PREFIX = "player_"
     SKIP_FILE_NAME_PREFIX = "skip_"
 
-    def __init__(self, listener=None):
+    def __init__(self, listener=None, backend=None, broadcaster=None, journal=None, restore=None, writer=None):
+        """
+        :param listener: Notified through counter_error() when the capture loop fails
+        :param backend: CaptureBackend, created from the config if omitted
+        :param broadcaster: ScoreBroadcaster score changes are published to
+        :param journal: ScoreJournal score changes are recorded to
+        :param restore: Dictionary of player -> state ("score", "skips", "last_update" and optionally "handle") to
+                        continue from, e.g. the states of a previous counter
+        :param writer: Started ScoreWriter score files are written by, shared with the counters started after this
+                       one. A writer of its own is created and stopped with the counter if omitted
+        """
         super().__init__()
 
+        # Phases of starting up until the first detection, including the process's start up for the first counter
+        self._timeline = startup.begin()
+
         # Tracks thread running status, when this is set to False after the thread has started, the loop will exit and
         # the thread will be able to terminate
         self._running = False
@@ -23,51 +118,100 @@ class Counter(Thread):
         # How often to check for course clears/game overs per second
         self._fps = 30
 
-        # Regions [x, y, width, height] of screen capture to check for course clears/skips/game overs
-        self._course_clear_region = config.get("region", "course_clear")
-        self._pause_menu_region = config.get("region", "pause_menu")
-        self._exit_course_region = config.get("region", "exit_course")
+        # Windows that look close to an event (a partially matched pause menu or clear banner) are polled at near_fps,
+        # windows in the fixed cooldown after an event at cooldown_fps
+        self._near_fps = config.get("scheduler", "near_fps")
+        self._cooldown_fps = config.get("scheduler", "cooldown_fps")
+        self._scheduler = None
 
-        # Percentage of pixels that must meet our colour thresholds to count as a course clear/skip/game over
-        self._course_clear_threshold = config.get("thresholds", "course_clear_threshold")
-        self._pause_menu_threshold = config.get("thresholds", "pause_menu_threshold")
-        self._exit_course_threshold = config.get("thresholds", "exit_course_threshold")
+        # "round_robin" checks one window per tick, "concurrent" gives every window its own worker, "sharded" also
+        # moves detection into worker processes
+        self._capture_mode = config.get("settings", "capture_mode")
+        self._shards = None
 
-        # set bounds for masks in order to properly match pixels for clears or game overs
-        self._course_clear_lower_bound = np.array(config.get("thresholds", "course_clear_lower_bound"), dtype='uint8')
-        self._course_clear_upper_bound = np.array(config.get("thresholds", "course_clear_upper_bound"), dtype='uint8')
-        self._pause_menu_lower_bound = np.array(config.get("thresholds", "pause_menu_lower_bound"), dtype='uint8')
-        self._pause_menu_upper_bound = np.array(config.get("thresholds", "pause_menu_upper_bound"), dtype='uint8')
-        self._exit_course_lower_bound = np.array(config.get("thresholds", "exit_course_lower_bound"), dtype='uint8')
-        self._exit_course_upper_bound = np.array(config.get("thresholds", "exit_course_upper_bound"), dtype='uint8')
+        # Detectors, rules, engine and canvas, read once per frame so that a reload never mixes old and new settings,
+        # and the config they were compiled from. Sharded frames are checked, and gated, by the worker processes
+        self._gating = self._capture_mode != "sharded"
+        self._detection = compile_detection(self._gating)
+        self._settings = config.snapshot()
+        self._timeline.mark("registry")
 
         # General settings like the number of "free" skips
         self._free_skips = config.get("settings", "free_skips")
         self._skip_penalty = config.get("settings", "skip_penalty")
+        self._game_over_penalty = config.get("settings", "game_over_penalty")
         self._num_windows = config.get("settings", "num_windows")
 
-        # Get window handles
-        window_handles = screen.get_window_handles()
-        self._handles = []
-        for i in range(self._num_windows):
-            try:
-                self._handles.append(screen.get_hwnd("vlc.exe", window_handles)[i])
-            except IndexError:
-                self._handles.append(None)
+        # What every window is showing, deciding which detectors its frames are checked with, see [states]
+        self._machine = GameStateMachine(windows=self._num_windows,
+                                         black=self._detection.black,
+                                         timeout=self._detection.timeout)
+
+        # Source of frames, BitBlt of VLC windows unless another backend is configured
+        self._capture = backend if backend else capture.create_backend()
+        self._timeline.mark("capture")
+
+        # Pipelined windows capture and detect on separate threads, connected by a bounded frame queue
+        self._queues = None
+        self._hints = [(IDLE, None)] * self._num_windows
+
+        if config.get("pipeline", "enabled") and self._capture_mode != "round_robin":
+            # Unthrottled sources produce frames on demand, dropping them would skip parts of a replay
+            policy = config.get("pipeline", "overflow") if self._capture.throttled else BLOCK
+            self._queues = [FrameQueue(size=config.get("pipeline", "queue_size"), policy=policy,
+                                       on_drop=self._release_frame) for _ in range(self._num_windows)]
+
+        restore = restore if restore else {}
+
+        # Get window handles, handles restored from a previous counter or the last run are kept while their windows
+        # still exist
+        self._assignment_file = config.get("startup", "assignment_file")
+        self._assignment_file = base_path(self._assignment_file) if self._assignment_file else None
+        self._handles = self._restore_handles(restore)
+        self._timeline.mark("windows")
 
         # Create states
         self._states = []
         
         for i in range(self._num_windows):
-            self._states.append({
-                "handle": self._handles[i],
-                "score": 0,
-                "skips": 0,
-                "last_update": 0,
-                "valid": False,
-                "score_file_name": Counter.PLAYER_FILE_NAME_PREFIX + str(i),
-                "skip_file_name": Counter.SKIP_FILE_NAME_PREFIX + str(i),
-            })
+            previous = restore.get(i, {})
+            self._states.append(PlayerState(player=i,
+                                            handle=self._handles[i],
+                                            score=previous.get("score", 0),
+                                            skips=previous.get("skips", 0),
+                                            last_update=previous.get("last_update", float("-inf")),
+                                            score_file_name=Counter.PLAYER_FILE_NAME_PREFIX + str(i),
+                                            skip_file_name=Counter.SKIP_FILE_NAME_PREFIX + str(i)))
+
+            # A restored window may still show the event it last counted, it waits for the next course as after any
+            # event until the timeout from [states] has passed since then
+            if self._states[i].last_update != float("-inf"):
+                self._machine.set_state(i, COOLDOWN_STATE, self._states[i].last_update)
+
+        # Latest published copy of the states, replaced as a whole after every change
+        self._snapshot = StateSnapshot.of(0, self._states)
+
+        # Consecutive frames each window failed to capture, the window is replaced after max_capture_failures
+        self._failures = [0] * self._num_windows
+
+        self._max_failures = config.get("settings", "max_capture_failures")
+
+        # Seconds each window waits before looking for a replacement again, doubled while none is found, and the time
+        # it may look again
+        self._recover_delays = [0.0] * self._num_windows
+        self._recover_at = [0.0] * self._num_windows
+
+        # Canvas buffer of every window, reused by every resize
+        self._canvases = [None] * self._num_windows
+
+        # Rolling timings and counters per window, optionally dumped to a metrics file
+        self._stats = [WindowStats() for _ in range(self._num_windows)]
+        self._start_time = time.perf_counter()
+        self._dumper = None
+        if config.get("stats", "dump_interval"):
+            self._dumper = StatsDumper(source=self.get_stats,
+                                       path=base_path(config.get("stats", "dump_file")),
+                                       interval=config.get("stats", "dump_interval"))
 
         # Get logger instance
         self._logger = logging.getLogger(__name__)
@@ -79,10 +223,73 @@ class Counter(Thread):
         # Mutex
         self._mutex = Lock()
 
-        # Write the initial counts and skips as 0
+        # Commands from the controller, applied by the counter between frames
+        self._commands = Queue()
+
+        # Score files are written on a background thread, off the capture loop and outside the mutex
+        self._own_writer = writer is None
+        self._writer = writer
+        if self._own_writer:
+            self._writer = ScoreWriter(directory=config.get("output", "directory"),
+                                       coalesce=config.get("output", "coalesce_ms") / 1000)
+            self._writer.start()
+
+        # Pushes score changes to overlays connected to the score server
+        self._broadcaster = broadcaster
+
+        # Records score changes so that they survive a crash or relaunch
+        self._journal = journal
+
+        # Keeps the latest frames of every window so that miscounts can be looked at
+        self._recorder = None
+        self._dump_on_detection = False
+
+        if config.get("recorder", "enabled"):
+            from mm2.recorder import FrameRecorder
+
+            self._recorder = FrameRecorder(windows=self._num_windows,
+                                           capacity=config.get("recorder", "frames"),
+                                           regions=config.get("recorder", "regions_only"),
+                                           stride=config.get("recorder", "stride"),
+                                           directory=config.get("recorder", "directory"),
+                                           level=config.get("recorder", "level"),
+                                           max_pending=config.get("recorder", "max_pending"))
+            self._dump_on_detection = config.get("recorder", "dump_on_detection")
+
+        # Write the initial counts and skips, 0 unless restored
         for state in self._states:
-            self._write_file(state["score"], state["score_file_name"])
-            self._write_file(state["skips"], state["skip_file_name"])
+            self._write_file(state.score, state.score_file_name)
+            self._write_file(state.skips, state.skip_file_name)
+            self._state_changed(state)
+
+        self._save_assignment()
+        self._timeline.mark("counter")
+
+    def _restore_handles(self, restore):
+        """
+        Reuse still valid handles of restored states, or else the handles of the last run, only looking for windows
+        when some are missing
+        """
+        saved = {}
+        if self._assignment_file:
+            saved = startup.load_assignment(self._assignment_file, type(self._capture).__name__)
+
+        handles = []
+        for i in range(self._num_windows):
+            handle = restore.get(i, {}).get("handle")
+            if handle and self._capture.is_valid(handle):
+                handles.append(handle)
+            elif saved.get(i) and saved[i] not in handles and self._capture.is_source(saved[i]):
+                handles.append(saved[i])
+            else:
+                handles.append(None)
+
+        if None in handles:
+            for handle in self._capture.get_handles(self._num_windows):
+                if handle and handle not in handles and None in handles:
+                    handles[handles.index(None)] = handle
+
+        return handles
 
     def run(self):
         """
@@ -91,68 +298,347 @@ class Counter(Thread):
         """
         # Keep track of our current running status.
         self._running = True
-        
-        # Start with the first state
-        curState = 0
 
         # If a window handle wasn't found, immediately set running to false as we don't have a window to process
         if None in self._handles:
             self._running = False
 
+        self._start_time = time.perf_counter()
+        if self._dumper:
+            self._dumper.start()
+
+        if self._recorder:
+            self._recorder.start()
+
+        failed = False
+        try:
+            if self._capture_mode == "sharded":
+                self._run_sharded()
+            elif self._capture_mode == "concurrent":
+                self._run_concurrent()
+            else:
+                self._run_round_robin()
+        except Exception:
+            print("Counter failed. Check Log.")
+            self._logger.exception('')
+            failed = self._running
+            self._running = False
+
+        # Commands queued while the loop was stopping
+        self._apply_commands()
+
+        if self._dumper:
+            self._dumper.stop()
+
+        self._capture.close()
+
+        # A shared writer keeps running for the next counter, only this counter's last scores must be written
+        if self._own_writer:
+            self._writer.stop()
+        else:
+            self._writer.flush()
+
+        if self._recorder:
+            self._recorder.stop()
+
+        # Let the listener restart counting from the last states once this counter has released everything
+        if failed and self._listener:
+            self._listener.counter_error()
+
+    def _run_round_robin(self):
+        """ Process one window at a time, always the one whose deadline is the earliest """
+        scheduler = self._create_scheduler(idle_fps=self._fps / self._num_windows)
+
         while self._running:
-            current_time = time.time()
-            self._mutex.acquire()
+            index = scheduler.next()
+            scheduler.wait(index)
+
+            if not self._running:
+                break
+
+            scheduler.done(index, *self._process_window(index))
+            self._apply_commands()
+
+    def _run_concurrent(self):
+        """
+        Give every window its own worker so that each one is checked at the full fps. Capturing and colour matching
+        release the GIL, so the workers run in parallel.
+        """
+        scheduler = self._create_scheduler(idle_fps=self._fps)
+
+        with ThreadPoolExecutor(max_workers=self._num_windows * 2, thread_name_prefix="CounterWorker") as executor:
+            if self._queues:
+                workers = [executor.submit(self._capture_worker, scheduler, i) for i in range(self._num_windows)]
+                workers += [executor.submit(self._detect_worker, i) for i in range(self._num_windows)]
+            else:
+                workers = [executor.submit(self._window_worker, scheduler, i) for i in range(self._num_windows)]
+
+            for worker in workers:
+                try:
+                    worker.result()
+                except Exception:
+                    self._logger.exception('')
 
-            self._current_state = self._states[curState]
-            
+    def _run_sharded(self):
+        """
+        Run the concurrent workers with detection spread over worker processes, for more windows than one process
+        can check at the full fps
+        """
+        # No worker processes for a counter that is missing a window
+        if not self._running:
+            return
+
+        from mm2.sharding import ShardPool
+
+        processes = config.get("sharding", "processes") or multiprocessing.cpu_count()
+        self._shards = ShardPool(windows=self._num_windows,
+                                 processes=processes,
+                                 settings=self._shard_settings(self._settings),
+                                 timeout=config.get("sharding", "timeout"))
+        self._shards.start()
+
+        try:
+            self._run_concurrent()
+        finally:
+            self._shards.close()
+
+    def _window_worker(self, scheduler, index):
+        while self._running:
             try:
-                # Capture image of current VLC instance
-                image = screen.bit_blit(self._current_state["handle"])
-
-                # Crop image to relevant areas
-                course_clear_crop = screen.crop(image, *self._course_clear_region)
-                pause_menu_crop = screen.crop(image, *self._pause_menu_region)
-                exit_course_crop = screen.crop(image, *self._exit_course_region)
-                
-                # Check for course clears/game overs
-                if current_time - self._current_state["last_update"] > 10:
-                    if self._image_in_range(course_clear_crop, self._course_clear_lower_bound,
-                                            self._course_clear_upper_bound, self._course_clear_threshold / 2):
-                        if self._image_in_range(course_clear_crop, self._course_clear_lower_bound,
-                                                self._course_clear_upper_bound, self._course_clear_threshold):
-
-                            print("Player " + str(curState) + " cleared course",)
-                            self._offset_current_score(offset=1)
-                        
-                    elif self._image_in_range(pause_menu_crop, self._pause_menu_lower_bound,
-                                              self._pause_menu_upper_bound, self._pause_menu_threshold):
-
-                        if self._image_in_range(exit_course_crop, self._exit_course_lower_bound,
-                                                self._exit_course_upper_bound, self._exit_course_threshold):
-
-                            print("Player " + str(curState) + " skipped course")
-                            self._offset_current_skip()
-                        
-                  
+                scheduler.wait(index)
 
+                if not self._running:
+                    break
+
+                scheduler.done(index, *self._process_window(index))
+                self._apply_commands()
             except Exception:
-                print("Exception occurred. Check Log.")
+                # Only this window's worker is affected, failed captures have already been counted towards
+                # replacing its window
                 self._logger.exception('')
 
-                
+    def _capture_worker(self, scheduler, index):
+        """ Capture stage of a pipelined window, queues frames at the pace of the detection stage's latest hint """
+        queue = self._queues[index]
+
+        try:
+            while self._running:
+                try:
+                    scheduler.wait(index)
+
+                    if not self._running:
+                        break
+
+                    frame = self._capture_frame(index)
+                    if frame is not None:
+                        queue.put(frame)
+
+                    hint, resume_at = self._hints[index]
+                    scheduler.done(index, hint, max(resume_at - time.perf_counter(), 0) if resume_at else None)
+                    self._apply_commands()
+                except Exception:
+                    self._logger.exception('')
+        finally:
+            queue.close()
+
+    def _detect_worker(self, index):
+        """ Detection stage of a pipelined window, checks queued frames until the capture stage stops """
+        queue = self._queues[index]
 
-            # Swap states for next iteration
-            curState += 1
-            if curState >= self._num_windows:
-                curState = 0
-                    
-            self._mutex.release()
+        while True:
+            frame = queue.get()
+            if frame is None:
+                break
 
             try:
-                execution_time = time.time() - current_time
-                time.sleep(1 / self._fps - execution_time)
-            except ValueError:
-                pass
+                hint, resume_in = self._detect_frame(index, *frame)
+                self._hints[index] = (hint, time.perf_counter() + resume_in if resume_in else None)
+            except Exception:
+                print("Exception occurred. Check Log.")
+                self._logger.exception('')
+
+    def _create_scheduler(self, idle_fps):
+        # Unthrottled backends (replays, synthetic streams) run as fast as frames can be processed
+        self._scheduler = FrameScheduler(windows=self._num_windows,
+                                         idle_fps=idle_fps,
+                                         near_fps=max(self._near_fps, idle_fps),
+                                         cooldown_fps=min(self._cooldown_fps, idle_fps),
+                                         throttled=self._capture.throttled)
+        return self._scheduler
+
+    def _process_window(self, index):
+        """
+        Capture a frame of a window and check it for course clears/skips. Capturing and matching happen outside the
+        mutex, which is only held while the window's state is read or updated.
+
+        :return: (scheduler hint, seconds until the window's cooldown ends or None)
+        """
+        try:
+            frame = self._capture_frame(index)
+            if frame is not None:
+                return self._detect_frame(index, *frame)
+
+        except Exception:
+            print("Exception occurred. Check Log.")
+            self._logger.exception('')
+
+        return IDLE, None
+
+    def _capture_frame(self, index):
+        """
+        Capture the current frame of a window
+        :return: (state, handle, image, frame time), None if no frame could be captured. The image belongs to the
+                 backend again once the frame is passed to _detect_frame or _release_frame
+        """
+        # Handles only change between frames, the published snapshot is read without taking the mutex
+        state = self._states[index]
+        handle = self._snapshot.players[index].handle
+
+        stats = self._stats[index]
+
+        # Capture image of current VLC instance
+        start = time.perf_counter()
+        try:
+            image = self._capture.grab(handle)
+        except Exception:
+            stats.capture_failures += 1
+            self._capture_failed(index)
+            raise
+        stats.capture.record(time.perf_counter() - start)
+
+        frame_time = self._capture.get_time(handle)
+
+        if image is None:
+            stats.capture_failures += 1
+            self._capture_failed(index)
+            return None
+
+        stats.frames += 1
+        self._failures[index] = 0
+        self._recover_delays[index] = 0.0
+
+        if not self._timeline.finished:
+            self._timeline.mark("first frame")
+
+        if self._recorder:
+            detection = self._detection
+            registry = detection.registry.for_size(image.shape[1], image.shape[0])
+            detectors = registry.used_detectors()
+
+            # The black detector is checked in every frame after an event, without being part of a rule
+            black = registry.detectors.get(detection.black) if detection.black else None
+            if black is not None and black not in detectors:
+                detectors = detectors + [black]
+
+            self._recorder.record(index, image, frame_time, detectors)
+
+        return state, handle, image, frame_time
+
+    def _release_frame(self, frame):
+        """ Hand the image of a captured frame back to the backend, e.g. a frame dropped by the pipeline """
+        self._capture.release(frame[1], frame[2])
+
+    def _detect_frame(self, index, state, handle, image, frame_time):
+        """
+        Check a captured frame of a window for course clears/skips
+        :return: (scheduler hint, seconds until the window's cooldown ends or None)
+        """
+        screen = self._machine.current(index, frame_time)
+        detection = self._detection
+
+        start = time.perf_counter()
+        try:
+            canvas = image
+            if detection.canvas:
+                canvas = self._canvases[index] = to_canvas(image, self._canvases[index], detection)
+            result = self._check_rules(index, state, screen, canvas, frame_time, detection,
+                                       (image.shape[1], image.shape[0]))
+        finally:
+            self._capture.release(handle, image)
+        self._stats[index].detect.record(time.perf_counter() - start)
+
+        if not self._timeline.finished:
+            self._timeline.finish("first detection")
+
+        return result
+
+    def _capture_failed(self, index):
+        self._failures[index] += 1
+
+        if self._max_failures and self._failures[index] >= self._max_failures and \
+                time.perf_counter() >= self._recover_at[index]:
+            self._recover_window(index)
+
+    def _recover_window(self, index):
+        """
+        Look for a new window for a window whose capture keeps failing. As with refresh_handles the slow window
+        enumeration happens without the mutex, only assigning the handles is queued for the counter. Scores are
+        untouched and only players whose window is gone get a new one.
+        """
+        self._failures[index] = 0
+
+        handle = self._snapshot.players[index].handle
+        if not self._capture.is_valid(handle):
+            self._capture.invalidate()
+            handles = self._capture.get_handles(self._num_windows)
+
+            in_use = [player.handle for player in self._snapshot.players]
+            if any(h and h not in in_use for h in handles):
+                print("Player " + str(index) + " window replaced")
+                self._recover_delays[index] = 0.0
+                self._submit(self._assign_handles, handles)
+                return
+
+        # Nothing to replace the window with, wait twice as long as last time before looking again
+        self._recover_delays[index] = min(max(self._recover_delays[index] * 2, RECOVER_DELAY), MAX_RECOVER_DELAY)
+        self._recover_at[index] = time.perf_counter() + self._recover_delays[index]
+
+    def _check_rules(self, index, state, screen, image, frame_time, detection, captured):
+        """
+        Check a frame with the detectors of the window's game state and fire the rule that matches, if any
+        :param screen: Game state of the window
+        :param detection: Detection the frame is checked with
+        :param captured: (width, height) of the frame as captured, before it was scaled down to the canvas
+        :return: (scheduler hint, seconds until the window's cooldown ends or None)
+        """
+        if self._shards:
+            action, near, screen = self._shards.check(index, image, screen, captured)
+        else:
+            action, near, screen = observe(detection.engine, detection.registry, index, image, screen,
+                                           detection.near_fraction, detection.black, captured)
+
+        if action:
+            with self._mutex:
+                self._fire(action, index, state, frame_time)
+
+            self._stats[index].detections += 1
+
+        return self._machine.advance(index, screen, frame_time, near)
+
+    def _fire(self, action, index, state, frame_time):
+        """ Apply the action of a rule that matched, the mutex must be held """
+        if action == registry.CLEAR:
+            print("Player " + str(index) + " cleared course",)
+            self._offset_current_score(state, offset=1, frame_time=frame_time)
+        elif action == registry.SKIP:
+            print("Player " + str(index) + " skipped course")
+            self._offset_current_skip(state, frame_time=frame_time)
+        elif action == registry.GAME_OVER:
+            print("Player " + str(index) + " game over")
+            self._offset_current_score(state, offset=self._game_over_penalty, frame_time=frame_time)
+
+        if self._dump_on_detection:
+            self._recorder.dump(index, reason=action)
+
+    def dump_frames(self, index=None):
+        """
+        Write the recorded frames of a window, or of every window
+        :return: Number of windows whose frames are being written, None if recording is disabled
+        """
+        if not self._recorder:
+            return None
+
+        return self._recorder.dump(index)
 
     def stop(self):
         self._running = False
@@ -164,125 +650,231 @@ class Counter(Thread):
         if index >= self._num_windows:
             return None
     
-        return self._states[index]["handle"]
-        
+        return self._snapshot.players[index].handle
+
+    def get_title(self, index):
+        return self._capture.get_title(self.get_handle(index))
+
+    def get_states(self):
+        """
+        Returns a dictionary of player -> state that a new counter can be restored from
+        """
+        return self._snapshot.to_dict()
+
+    def snapshot(self):
+        """
+        Returns the latest StateSnapshot, without waiting for the counter
+        """
+        return self._snapshot
+
+    def get_stats(self):
+        """
+        Returns a dictionary of timings and counters per window, output write latency and change gate hits
+        """
+        uptime = time.perf_counter() - self._start_time
+
+        # Hits are detector runs that were skipped because their region had not changed
+        if self._shards:
+            gating = self._shards.get_gating_stats()
+        else:
+            gating = self._detection.engine.gate.get_stats() if self._detection.engine.gate else {}
+
+        missed = self._scheduler.get_missed() if self._scheduler else [0] * self._num_windows
+
+        windows = []
+        for i, stats in enumerate(self._stats):
+            summary = stats.summary()
+            summary["fps"] = stats.frames / uptime if uptime else 0.0
+            summary["missed_deadlines"] = missed[i]
+            summary["queue"] = self._queues[i].get_stats() if self._queues else None
+            summary["state"] = self._machine.get_state(i)
+            windows.append(summary)
+
+        return {
+            "uptime": uptime,
+            "windows": windows,
+            "output": self._writer.get_stats(),
+            "gating": gating,
+            "recorder": self._recorder.get_stats() if self._recorder else None,
+            "sharding": self._shards.get_stats() if self._shards else None,
+            # Frames checked in every game state
+            "states": self._machine.get_stats(),
+            "startup": self._timeline.get_stats(),
+        }
+
     def refresh_handles(self):
-        self._mutex.acquire()
+        """
+        Look for windows again and give new ones to players whose window is gone. The slow window enumeration happens
+        on the calling thread, only assigning the handles is queued for the counter.
+        :return: Future resolved once the handles have been assigned
+        """
+        # Get window handles, looking for windows again rather than reusing cached ones
+        self._capture.invalidate()
+        handles = self._capture.get_handles(self._num_windows)
 
-        try:
-            # Get window handles
-            window_handles = screen.get_window_handles()
-            self._handles = []
-            for i in range(self._num_windows):
-                try:
-                    self._handles.append(screen.get_hwnd("vlc.exe", window_handles)[i])
-                except IndexError:
-                    self._handles.append(None)
-                    
-            for state in self._states:
-                state["valid"] = False
-            
-            new_handles = []
-            
-            # Identify all new handles
-            for handle in self._handles:
-            
-                found = False
-                for state in self._states:
-                    if handle == state["handle"]:
-                        found = True
-                        state["valid"] = True
-                        break
-                        
-                if not found:
-                    new_handles.append(handle)
-            
-            # Give the new handles to any state that doesn't have a valid handle
-            for handle in new_handles:
-                for state in self._states:
-                    if not state["valid"]:
-                        state["handle"] = handle
-                        state["valid"] = True
-                        break
-            
-        finally:
-            self._mutex.release()
+        return self._submit(self._assign_handles, handles)
+
+    def reload(self):
+        """
+        Recompile detection from the config, which must have been reloaded already. Compiling happens on the calling
+        thread, the counter only swaps the result in between frames.
+        :return: Future resolved once the new detection is in use
+        :raises ValueError: If the config is invalid
+        """
+        return self._submit(self._set_detection, compile_detection(self._gating), config.snapshot())
 
     def set_score(self, player, score):
-        self._mutex.acquire()
-        
-        try:
-            state = self._states[player]
-            
-            state["score"] = score
-            self._write_file(state["score"], state["score_file_name"])
-        finally:
-            self._mutex.release()
+        """ :return: Future resolved once the score has been set """
+        return self._submit(self._set_score, player, score)
 
     def set_skip_count(self, player, skips):
-        self._mutex.acquire()
-        
-        try:
-            state = self._states[player]
-            
-            state["skips"] = skips
-            self._write_file(state["skips"], state["skip_file_name"])
-        finally:
-            self._mutex.release()
+        """ :return: Future resolved once the skip count has been set """
+        return self._submit(self._set_skip_count, player, skips)
 
     def swap_windows(self, left, right):
-        self._mutex.acquire()
-        
-        try:
-            leftHandle = self._states[left]["handle"]
-            rightHandle = self._states[right]["handle"]
-            
-            self._states[left]["handle"] = rightHandle
-            self._states[right]["handle"] = leftHandle
-        finally:
-            self._mutex.release()
+        """ :return: Future resolved once the windows have been swapped """
+        return self._submit(self._swap_windows, left, right)
 
-    def get_right_count(self):
-        return self._right_state["score"]
+    def _submit(self, command, *args):
+        """
+        Queue a change to the players' states. Commands are applied by the counter between frames, so the thread
+        issuing them never contends with detection for the mutex.
+        :return: Future of the command's result
+        """
+        future = Future()
+        self._commands.put((future, command, args))
 
-    def _offset_current_score(self, offset):
-        self._current_state["score"] += offset
-        self._current_state["last_update"] = time.time()
-        self._write_file(self._current_state["score"], self._current_state["score_file_name"])
+        # Nothing applies commands while the counter is not running
+        if not self._running:
+            self._apply_commands()
 
-    def _offset_current_skip(self):
-        self._current_state["skips"] += 1
-        self._current_state["last_update"] = time.time()
-        self._write_file(self._current_state["skips"], self._current_state["skip_file_name"])
+        return future
+
+    def _apply_commands(self):
+        """ Apply every queued command, called by the counter's threads between frames """
+        while True:
+            try:
+                future, command, args = self._commands.get_nowait()
+            except Empty:
+                return
+
+            if not future.set_running_or_notify_cancel():
+                continue
+
+            try:
+                with self._mutex:
+                    future.set_result(command(*args))
+            except Exception as e:
+                future.set_exception(e)
+
+    def _assign_handles(self, handles):
+        self._handles = handles
+
+        for state in self._states:
+            state.valid = False
+
+        new_handles = []
+
+        # Identify all new handles
+        for handle in self._handles:
+
+            found = False
+            for state in self._states:
+                if handle == state.handle:
+                    found = True
+                    state.valid = True
+                    break
+
+            if not found:
+                new_handles.append(handle)
+
+        # Give the new handles to any state that doesn't have a valid handle
+        for handle in new_handles:
+            for state in self._states:
+                if not state.valid:
+                    state.handle = handle
+                    state.valid = True
+                    break
+
+        self._publish()
+        self._save_assignment()
+
+    def _set_detection(self, detection, settings):
+        self._detection = detection
+        self._settings = settings
+        self._machine.configure(detection.black, detection.timeout)
+
+        # Worker processes recompile from the same config with their next frame
+        if self._shards:
+            self._shards.reload(self._shard_settings(settings))
+
+    def _shard_settings(self, settings):
+        """ Returns the settings of the ShardPool workers, the config and what the counter compiled from it """
+        return settings, self._detection.near_fraction, self._detection.black
+
+    def _set_score(self, player, score):
+        state = self._states[player]
+
+        state.score = score
+        self._write_file(state.score, state.score_file_name)
+        self._state_changed(state)
+
+    def _set_skip_count(self, player, skips):
+        state = self._states[player]
+
+        state.skips = skips
+        self._write_file(state.skips, state.skip_file_name)
+        self._state_changed(state)
+
+    def _swap_windows(self, left, right):
+        leftHandle = self._states[left].handle
+        rightHandle = self._states[right].handle
+
+        self._states[left].handle = rightHandle
+        self._states[right].handle = leftHandle
+        self._publish()
+        self._save_assignment()
+
+    def get_right_count(self):
+        return self._right_state.score
+
+    def _offset_current_score(self, state, offset, frame_time):
+        state.score += offset
+        state.last_update = frame_time
+        self._write_file(state.score, state.score_file_name)
+        self._state_changed(state)
+
+    def _offset_current_skip(self, state, frame_time):
+        state.skips += 1
+        state.last_update = frame_time
+        self._write_file(state.skips, state.skip_file_name)
+        self._state_changed(state)
         
-        if self._current_state["skips"] > self._free_skips:
-            self._offset_current_score(offset=self._skip_penalty)
+        if state.skips > self._free_skips:
+            self._offset_current_score(state, offset=self._skip_penalty, frame_time=frame_time)
 
-    @staticmethod
-    def _write_file(value, file):
-        """
-        Writes the current value to text file
-        """
-        with open(base_path("{}.txt".format(file)), 'w') as file:
-            file.write(str(value))
+    def _state_changed(self, state):
+        """ Publish a changed score to overlays and record it in the journal """
+        self._publish()
 
-    @staticmethod
-    def _image_in_range(image, lower, upper, threshold):
-        """
-        Returns True or False depending if a given percentage of pixels fall within a specified colour range.
+        if self._broadcaster:
+            self._broadcaster.publish(state.player, state.score, state.skips)
 
-        :param image: Numpy Image to test
-        :param lower: Minimum BGR colour threshold
-        :param upper: Maximum BGR colour threshold
-        :param threshold: Percentage of pixels that must match
-        :return: Boolean
-        """
-        # If an invalid image is passed into the function, return false
-        if image is None:
-            return False
+        if self._journal:
+            self._journal.record(state.player, state.score, state.skips, state.last_update)
+
+    def _publish(self):
+        """ Replace the published snapshot by a copy of the current states, the mutex must be held """
+        self._snapshot = StateSnapshot.of(self._snapshot.version + 1, self._states)
 
-        # Create a mask of all pixels whose RGB value falls within the specified range
-        result = cv2.inRange(image, lower, upper)
-        percent = np.count_nonzero(result) / result.size
+    def _save_assignment(self):
+        """ Keep the window of every player for the next run """
+        if self._assignment_file:
+            startup.save_assignment(self._assignment_file, type(self._capture).__name__,
+                                    [state.handle for state in self._states])
 
-        return percent > threshold
+    def _write_file(self, value, file):
+        """
+        Queues the current value to be written to text file
+        """
+        self._writer.write(file, value)
@@ -0,0 +1,174 @@
+from time import perf_counter
+
+import numpy as np
+import cv2
+
+
+# Called with (stage, seconds) for every colour match while set, see set_stage_hook
+_stage_hook = None
+
+
+def set_stage_hook(hook):
+    """
+    Time the "in_range" and "count" stages of every colour match, e.g. for the benchmark
+    :param hook: Function called with (stage, seconds), None to stop timing
+    """
+    global _stage_hook
+    _stage_hook = hook
+
+
+def match_fraction(image, lower, upper):
+    """
+    Returns the fraction of pixels whose colour falls within a specified range.
+
+    :param image: Numpy Image to test
+    :param lower: Minimum BGR colour threshold
+    :param upper: Maximum BGR colour threshold
+    :return: Float between 0 and 1
+    """
+    hook = _stage_hook
+    if hook is None:
+        # Create a mask of all pixels whose RGB value falls within the specified range
+        result = cv2.inRange(image, lower, upper)
+        return np.count_nonzero(result) / result.size
+
+    start = perf_counter()
+    result = cv2.inRange(image, lower, upper)
+    middle = perf_counter()
+    fraction = np.count_nonzero(result) / result.size
+    hook("in_range", middle - start)
+    hook("count", perf_counter() - middle)
+
+    return fraction
+
+
+def image_in_range(image, lower, upper, threshold):
+    """
+    Returns True or False depending if a given percentage of pixels fall within a specified colour range.
+
+    :param image: Numpy Image to test
+    :param lower: Minimum BGR colour threshold
+    :param upper: Maximum BGR colour threshold
+    :param threshold: Percentage of pixels that must match
+    :return: Boolean
+    """
+    # If an invalid image is passed into the function, return false
+    if image is None or image.size == 0:
+        return False
+
+    return match_fraction(image, lower, upper) > threshold
+
+
+def subsample(image, stride):
+    """
+    Returns every 'stride'th row of an image. Only rows are skipped so the result is a view OpenCV can use without
+    copying, skipping columns as well would force a copy of the whole view.
+    """
+    return image[::stride]
+
+
+def cascade_match(image, lower, upper, threshold, stride, margin):
+    """
+    Coarse-to-fine version of image_in_range. The match fraction is first estimated on a subsampled view of the
+    image, the full resolution check is only run when the estimate is within 'margin' of the threshold. The margin is
+    relative to the threshold, so that the coarse check can still reject frames for low thresholds.
+
+    :param image: Numpy Image to test
+    :param lower: Minimum BGR colour threshold
+    :param upper: Maximum BGR colour threshold
+    :param threshold: Percentage of pixels that must match
+    :param stride: Subsampling factor of the coarse check, 1 disables the cascade
+    :param margin: Fraction of the threshold within which the coarse estimate is not trusted
+    :return: (Boolean, best known match fraction)
+    """
+    if image is None or image.size == 0:
+        return False, 0.0
+
+    if stride > 1:
+        estimate = match_fraction(subsample(image, stride), lower, upper)
+        margin *= threshold
+
+        if estimate < threshold - margin:
+            return False, estimate
+        if estimate > threshold + margin:
+            return True, estimate
+
+    fraction = match_fraction(image, lower, upper)
+    return fraction > threshold, fraction
+
+
+def cascade_in_range(image, lower, upper, threshold, stride, margin):
+    """
+    Returns the result of cascade_match without the match fraction
+    """
+    return cascade_match(image, lower, upper, threshold, stride, margin)[0]
+
+
+class ChangeGate(object):
+    """
+    Skips detectors on regions that have not changed since they were last checked. A tiny signature, a grid of
+    sampled pixels, is kept per key (window and region) along with the detector's result. While the region's
+    signature stays within 'tolerance' of the stored one the stored result is reused.
+    """
+
+    def __init__(self, grid=(16, 16), tolerance=2.0):
+        """
+        :param grid: [columns, rows] of pixels sampled for a signature
+        :param tolerance: Mean absolute difference per sampled channel below which a region is unchanged
+        """
+        self._grid = grid
+        self._tolerance = tolerance
+
+        # key -> (shape of the region, signature, result)
+        self._entries = {}
+
+        # key -> [hits, misses], every key is only used by one worker so these need no locking
+        self._counts = {}
+
+    def signature(self, image):
+        height, width = image.shape[:2]
+        columns, rows = self._grid
+        return image[::max(height // rows, 1), ::max(width // columns, 1)].astype(np.int16)
+
+    def check(self, key, image, detector, *args):
+        """
+        Returns detector(image, *args), reusing the previous result for this key when the image is unchanged
+        """
+        if image is None or image.size == 0:
+            return detector(image, *args)
+
+        signature = self.signature(image)
+        counts = self._counts.setdefault(key, [0, 0])
+        entry = self._entries.get(key)
+
+        # A resized region samples other pixels, even where its signature keeps its shape
+        if entry is not None and entry[0] == image.shape and np.abs(signature - entry[1]).mean() <= self._tolerance:
+            counts[0] += 1
+            return entry[2]
+
+        result = detector(image, *args)
+
+        # Only refresh the signature when the detector runs, so slow drift still accumulates into a change
+        self._entries[key] = (image.shape, signature, result)
+        counts[1] += 1
+
+        return result
+
+    def reset(self, key=None):
+        if key is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(key, None)
+
+    def get_stats(self, window=None):
+        """
+        Returns {region: (hits, misses)} summed over windows, keys are expected to be (window, region) pairs
+        :param window: Only count the regions of this window
+        """
+        stats = {}
+        for (key, region), (hits, misses) in list(self._counts.items()):
+            if window is not None and key != window:
+                continue
+            total = stats.get(region, (0, 0))
+            stats[region] = (total[0] + hits, total[1] + misses)
+        return stats
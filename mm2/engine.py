@@ -0,0 +1,57 @@
+from as64 import config
+from mm2 import detection
+from mm2.registry import check_number, check_pair
+
+
+class CascadeEngine(object):
+    """ Checks every detector on its own region with the coarse-to-fine cascade, only when a rule asks for it """
+
+    def __init__(self, margin, gate=None):
+        """
+        :param margin: Fraction of a threshold within which coarse estimates are confirmed at full resolution
+        :param gate: Optional ChangeGate reusing results of unchanged regions
+        """
+        self.margin = margin
+        self.gate = gate
+
+    def frame(self, index, image):
+        """ Returns the detector results of one frame of a window, computed on demand """
+        return _CascadeFrame(self, index, image)
+
+
+class _CascadeFrame(object):
+    __slots__ = ("_engine", "_index", "_image")
+
+    def __init__(self, engine, index, image):
+        self._engine = engine
+        self._index = index
+        self._image = image
+
+    def match(self, detector):
+        """
+        :return: (Boolean, match fraction)
+        """
+        engine = self._engine
+        crop = detector.crop(self._image)
+        lower, upper = detector.bounds(self._image)
+
+        if engine.gate:
+            return engine.gate.check((self._index, detector.name), crop, detection.cascade_match, lower, upper,
+                                     detector.threshold, detector.stride, engine.margin)
+
+        return detection.cascade_match(crop, lower, upper, detector.threshold, detector.stride, engine.margin)
+
+
+def create_engine(gating=True):
+    """
+    Create the detection engine from the config
+    :param gating: Reuse results of unchanged regions if [gating] is enabled. Results then depend on earlier frames
+    :return: CascadeEngine
+    """
+    gate = None
+    if gating and config.get("gating", "enabled"):
+        gate = detection.ChangeGate(grid=check_pair(config.get("gating", "grid"), "[gating] grid"),
+                                    tolerance=check_number(config.get("gating", "tolerance"), "[gating] tolerance"))
+
+    margin = check_number(config.get("thresholds", "cascade_margin"), "[thresholds] cascade_margin", maximum=1)
+    return CascadeEngine(margin, gate)
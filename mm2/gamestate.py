@@ -0,0 +1,158 @@
+from mm2.registry import CLEAR
+from mm2.scheduler import IDLE, NEAR, COOLDOWN
+
+
+# What a window is showing, as far as counting is concerned
+GAMEPLAY = "gameplay"
+PAUSE_MENU = "pause_menu"
+CLEAR_BANNER = "clear_banner"
+COOLDOWN_STATE = "cooldown"
+BLACK = "black"
+
+STATES = (GAMEPLAY, PAUSE_MENU, CLEAR_BANNER, COOLDOWN_STATE, BLACK)
+
+# States waiting for the black screen that follows a counted clear, skip or game over
+WAITING = (CLEAR_BANNER, COOLDOWN_STATE)
+
+# States a window leaves for gameplay after 'timeout' seconds, black included so that a screen that keeps matching the
+# black detector cannot stop a window from counting
+TIMED = WAITING + (BLACK,)
+
+
+def observe(engine, registry, index, image, state, near_fraction, black=None, captured=None):
+    """
+    Run only the detectors that can move a window out of its current state:
+
+    - gameplay: every rule. A rule that fires moves to clear_banner (clears) or cooldown (skips, game overs), the first
+      detector of a rule with several detectors matching on its own (the pause menu without exit course) to pause_menu
+    - pause_menu: only the rules with several detectors, back to gameplay once their first detector no longer matches
+    - clear_banner, cooldown: only the black detector, to black once the screen goes black
+    - black: only the black detector, to gameplay once the next course appears or the window timed out
+
+    :param engine: Detection engine
+    :param registry: DetectorRegistry, its regions are scaled to the frame's size
+    :param index: Window index
+    :param image: BGR or BGRA frame
+    :param state: Current state of the window
+    :param near_fraction: Fraction of a detector's threshold from which a frame looks close to an event
+    :param black: Name of the detector matching the black screen between courses, None if there is none
+    :param captured: (width, height) of the captured frame if the image was scaled down from it to the detection canvas
+    :return: (Action of the rule that fired or None, Boolean whether a detector came near its threshold, next state)
+    """
+    registry = registry.for_size(image.shape[1], image.shape[0], captured)
+    frame = engine.frame(index, image)
+
+    black = registry.detectors.get(black) if black else None
+
+    if state in WAITING:
+        if black is not None and frame.match(black)[0]:
+            return None, False, BLACK
+        return None, False, state
+
+    if state == BLACK:
+        if black is not None and frame.match(black)[0]:
+            return None, False, BLACK
+        return None, False, GAMEPLAY
+
+    near = False
+    partial = False
+    rules = registry.rules if state == GAMEPLAY else [rule for rule in registry.rules if len(rule.detectors) > 1]
+
+    for rule in rules:
+        for i, detector in enumerate(rule.detectors):
+            matched, estimate = frame.match(detector)
+
+            # A clear banner or pause menu starting to appear
+            near = near or estimate >= detector.threshold * near_fraction
+
+            if not matched:
+                partial = partial or i > 0
+                break
+        else:
+            return rule.action, near, CLEAR_BANNER if rule.action == CLEAR else COOLDOWN_STATE
+
+    return None, near, PAUSE_MENU if partial else GAMEPLAY
+
+
+class GameStateMachine(object):
+    """
+    State of every window between counted events. After a clear, skip or game over a window only counts again once
+    it has gone through the black screen to the next course, so back-to-back events are counted as soon as the next
+    course starts instead of after a fixed cooldown. Without a black detector, or if no black screen shows up within
+    'timeout' seconds, the window goes back to gameplay after 'timeout' seconds. A window that stays black for
+    'timeout' seconds goes back to gameplay as well, e.g. when the black detector also matches a dark course.
+
+    Each window's state is only changed by the thread detecting that window.
+    """
+
+    def __init__(self, windows, black=None, timeout=10.0):
+        """
+        :param windows: Number of windows
+        :param black: Name of the detector matching the black screen between courses, None for the fixed cooldown
+        :param timeout: Seconds a window waits for the black screen after an event, and stays on the black screen
+        """
+        self.black = black
+        self._timeout = timeout
+        self._states = [GAMEPLAY] * windows
+        self._entered = [float("-inf")] * windows
+
+        # Frames checked in every state, per window
+        self._frames = [{state: 0 for state in STATES} for _ in range(windows)]
+
+    def current(self, index, frame_time):
+        """
+        Returns the state of a window at the time of a frame, leaving the wait after an event or the black screen once
+        it has timed out
+        """
+        state = self._states[index]
+
+        if state in TIMED:
+            # Replays may loop back to an earlier time
+            elapsed = frame_time - self._entered[index]
+            if elapsed < 0 or elapsed >= self._timeout:
+                state = self._enter(index, GAMEPLAY, frame_time)
+
+        self._frames[index][state] += 1
+        return state
+
+    def advance(self, index, state, frame_time, near=False):
+        """
+        Move a window to the state observed in a frame
+        :param near: Whether a detector came near its threshold in the frame
+        :return: (scheduler hint, seconds until the window's cooldown ends or None)
+        """
+        if state != self._states[index]:
+            self._enter(index, state, frame_time)
+
+        if state == PAUSE_MENU or near:
+            return NEAR, None
+
+        if state in WAITING and not self.black:
+            return COOLDOWN, max(self._timeout - (frame_time - self._entered[index]), 0)
+
+        return IDLE, None
+
+    def configure(self, black, timeout):
+        """ Change the black detector and timeout, e.g. after the config was reloaded """
+        self.black = black
+        self._timeout = timeout
+
+    def _enter(self, index, state, frame_time):
+        self._states[index] = state
+        self._entered[index] = frame_time
+        return state
+
+    def get_state(self, index):
+        return self._states[index]
+
+    def get_entered(self, index):
+        """ Returns the frame time the window entered its current state """
+        return self._entered[index]
+
+    def set_state(self, index, state, entered=float("-inf")):
+        """ Put a window into a state, e.g. the state a previous part of a video ended in """
+        self._enter(index, state, entered)
+
+    def get_stats(self):
+        """ Returns a dictionary of state -> frames checked in that state, over all windows """
+        return {state: sum(frames[state] for frames in self._frames) for state in STATES}
@@ -0,0 +1,94 @@
+import os
+import logging
+from queue import Queue
+from threading import Thread
+
+
+class ScoreJournal(Thread):
+    """
+    Append-only log of player scores, so that a crashed or relaunched counter can restore them. Every change appends
+    one line 'player score skips last_update', the last line of a player wins. Appends happen on the journal's own
+    thread; once the file holds more than 'compact_after' lines it is rewritten with only the latest line per player.
+    """
+
+    def __init__(self, path, compact_after=1000):
+        super().__init__(name="ScoreJournal", daemon=True)
+
+        self._path = path
+        self._compact_after = compact_after
+        self._queue = Queue()
+        self._latest = {}
+        self._lines = 0
+
+        self._logger = logging.getLogger(__name__)
+
+    def load(self):
+        """
+        Read the journal
+        :return: Dictionary of player -> {"score", "skips", "last_update"}
+        """
+        self._latest = {}
+        self._lines = 0
+
+        try:
+            with open(self._path) as file:
+                for line in file:
+                    self._lines += 1
+                    try:
+                        player, score, skips, last_update = line.split()
+                        self._latest[int(player)] = (int(score), int(skips), float(last_update))
+                    except ValueError:
+                        # A line cut short by a crash
+                        continue
+        except FileNotFoundError:
+            pass
+
+        return {player: {"score": score, "skips": skips, "last_update": last_update}
+                for player, (score, skips, last_update) in self._latest.items()}
+
+    def record(self, player, score, skips, last_update):
+        """ Queue a player's state to be appended """
+        self._queue.put((player, score, skips, last_update))
+
+    def run(self):
+        while True:
+            entry = self._queue.get()
+            if entry is None:
+                return
+
+            entries = [entry]
+            while not self._queue.empty():
+                entry = self._queue.get()
+                if entry is None:
+                    self._append(entries)
+                    return
+                entries.append(entry)
+
+            self._append(entries)
+
+    def _append(self, entries):
+        try:
+            with open(self._path, 'a') as file:
+                for player, score, skips, last_update in entries:
+                    file.write("{} {} {} {!r}\n".format(player, score, skips, last_update))
+                    self._latest[player] = (score, skips, last_update)
+                    self._lines += 1
+
+            if self._lines > self._compact_after:
+                self._compact()
+        except OSError:
+            self._logger.exception('')
+
+    def _compact(self):
+        temp = self._path + ".tmp"
+        with open(temp, 'w') as file:
+            for player, (score, skips, last_update) in sorted(self._latest.items()):
+                file.write("{} {} {} {!r}\n".format(player, score, skips, last_update))
+        os.replace(temp, self._path)
+        self._lines = len(self._latest)
+
+    def stop(self):
+        """ Append anything queued and stop the thread """
+        self._queue.put(None)
+        if self.is_alive():
+            self.join()
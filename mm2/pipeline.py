@@ -0,0 +1,100 @@
+from collections import deque
+from threading import Condition
+
+
+# What a full FrameQueue does with a new frame
+DROP_OLDEST = "drop_oldest"
+BLOCK = "block"
+
+POLICIES = (DROP_OLDEST, BLOCK)
+
+
+class FrameQueue(object):
+    """
+    Bounded queue of captured frames between the capture and the detection stage of a window.
+
+    When the detection stage falls behind, 'drop_oldest' discards the oldest queued frame so that detection always
+    works on the freshest frames, 'block' makes the capture stage wait for room instead.
+    """
+
+    def __init__(self, size=1, policy=DROP_OLDEST, on_drop=None):
+        """
+        :param size: Maximum number of queued frames
+        :param policy: DROP_OLDEST or BLOCK
+        :param on_drop: Called with every frame the queue discards, dropped or put after the queue was closed
+        """
+        if policy not in POLICIES:
+            raise ValueError("Unknown queue overflow policy '{}'".format(policy))
+
+        self._size = max(size, 1)
+        self._policy = policy
+        self._on_drop = on_drop
+        self._frames = deque()
+        self._condition = Condition()
+        self._closed = False
+
+        self._queued = 0
+        self._dropped = 0
+        self._max_depth = 0
+
+    def put(self, frame):
+        """
+        Queue a frame, dropping the oldest frame or waiting for room when the queue is full
+        :return: False if the queue was closed
+        """
+        with self._condition:
+            if self._policy == BLOCK:
+                while len(self._frames) >= self._size and not self._closed:
+                    self._condition.wait()
+
+            # Frames queued before the queue was closed can still be taken
+            if self._closed:
+                self._discard(frame)
+                return False
+
+            if len(self._frames) >= self._size:
+                self._discard(self._frames.popleft())
+                self._dropped += 1
+
+            self._frames.append(frame)
+            self._queued += 1
+            self._max_depth = max(self._max_depth, len(self._frames))
+            self._condition.notify_all()
+
+            return True
+
+    def _discard(self, frame):
+        if self._on_drop:
+            self._on_drop(frame)
+
+    def get(self):
+        """
+        Take the oldest queued frame, waiting for one if the queue is empty
+        :return: The frame, None once the queue is closed and empty
+        """
+        with self._condition:
+            while not self._frames and not self._closed:
+                self._condition.wait()
+
+            if not self._frames:
+                return None
+
+            frame = self._frames.popleft()
+            self._condition.notify_all()
+
+            return frame
+
+    def close(self):
+        """ Stop accepting frames, frames already queued can still be taken """
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+    def get_stats(self):
+        with self._condition:
+            return {
+                "depth": len(self._frames),
+                "max_depth": self._max_depth,
+                "queued": self._queued,
+                "dropped": self._dropped,
+            }
@@ -0,0 +1,157 @@
+import io
+import os
+import time
+import logging
+from collections import deque
+from queue import Queue, Full
+from threading import Thread, Lock
+
+import numpy as np
+import zstandard
+
+from as64.paths import base_path
+
+
+class FrameRecorder(Thread):
+    """
+    Keeps the most recent frames of every window in a ring buffer so that a miscounted clear or skip can be looked at
+    afterwards. Recording only copies a frame, or just the detector regions of it, into the window's buffer. Dumping
+    takes a snapshot of the buffer and hands it to the recorder's own thread, which compresses it with zstd and writes
+    it to disk. At most 'max_pending' dumps wait for that thread, further dumps are dropped, so memory stays bounded
+    by the buffers plus those snapshots.
+    """
+
+    def __init__(self, windows, capacity=90, regions=True, stride=2, directory="recordings", level=3, max_pending=4):
+        """
+        :param windows: Number of windows
+        :param capacity: Frames kept per window
+        :param regions: Only record the regions of the detectors passed to record(), not whole frames
+        :param stride: Only every Nth row and column of a frame is kept
+        :param directory: Directory dumps are written to, relative paths are relative to the application's directory
+        :param level: zstd compression level
+        :param max_pending: Dumps that can wait to be written before further dumps are dropped
+        """
+        super().__init__(name="FrameRecorder", daemon=True)
+
+        self._buffers = [deque(maxlen=capacity) for _ in range(windows)]
+        self._regions = regions
+        self._stride = max(stride, 1)
+        self._directory = base_path(directory)
+        self._level = level
+        self._queue = Queue(maxsize=max_pending)
+        self._lock = Lock()
+
+        self._dumps = 0
+        self._dropped = 0
+
+        self._logger = logging.getLogger(__name__)
+
+    def record(self, index, image, frame_time, detectors):
+        """
+        Add a frame of a window to its buffer, replacing the oldest frame once the buffer is full
+        :param index: Window index
+        :param image: BGR or BGRA frame
+        :param frame_time: Time of the frame
+        :param detectors: Detectors, with regions for the frame's size, whose regions are recorded
+        """
+        stride = self._stride
+
+        # Backends may reuse their frame arrays, so the buffer needs its own copy
+        if not self._regions:
+            names = ("frame",)
+            frame = (image[::stride, ::stride].copy(),)
+        else:
+            # Kept with every frame, a reload may change the detectors
+            names = tuple(detector.name for detector in detectors)
+            frame = tuple(detector.crop(image)[::stride, ::stride].copy() for detector in detectors)
+
+        with self._lock:
+            self._buffers[index].append((frame_time, names, frame))
+
+    def dump(self, index=None, reason="manual"):
+        """
+        Queue the buffered frames of a window, or of every window, to be written
+        :param index: Window index, None for every window
+        :param reason: Written into the file name, e.g. the action that fired
+        :return: Number of windows queued
+        """
+        indices = range(len(self._buffers)) if index is None else [index]
+        queued = 0
+
+        for i in indices:
+            with self._lock:
+                frames = list(self._buffers[i])
+
+            if not frames:
+                continue
+
+            try:
+                self._queue.put_nowait((i, reason, time.time(), frames))
+                queued += 1
+            except Full:
+                self._dropped += 1
+                self._logger.warning("Frame dump of player %s dropped, %s dumps are still being written",
+                                     i, self._queue.maxsize)
+
+        return queued
+
+    def run(self):
+        os.makedirs(self._directory, exist_ok=True)
+
+        while True:
+            entry = self._queue.get()
+            if entry is None:
+                return
+
+            try:
+                self._write(*entry)
+            except Exception:
+                self._logger.exception('')
+
+    def _write(self, index, reason, dump_time, frames):
+        # Frames from before the window was last resized or the detectors last changed can not be stacked with the
+        # others
+        _, names, last = frames[-1]
+        shapes = [image.shape for image in last]
+        frames = [(frame_time, images) for frame_time, frame_names, images in frames
+                  if frame_names == names and [image.shape for image in images] == shapes]
+
+        times = np.array([frame_time for frame_time, _ in frames])
+        arrays = {name: np.stack([images[i] for _, images in frames]) for i, name in enumerate(names)}
+
+        buffer = io.BytesIO()
+        np.savez(buffer, times=times, **arrays)
+
+        stamp = time.strftime("%Y%m%d-%H%M%S", time.localtime(dump_time)) + "-{:03d}".format(int(dump_time % 1 * 1000))
+        name = "player{}_{}_{}.npz.zst".format(index, stamp, reason)
+        path = os.path.join(self._directory, name)
+        temp = path + ".tmp"
+
+        with open(temp, 'wb') as file:
+            file.write(zstandard.ZstdCompressor(level=self._level).compress(buffer.getbuffer()))
+        os.replace(temp, path)
+
+        self._dumps += 1
+        print("Frames of player {} written to {}".format(index, path))
+
+    def get_stats(self):
+        return {"dumps": self._dumps, "dropped": self._dropped, "pending": self._queue.qsize()}
+
+    def stop(self):
+        """ Write the dumps still queued and stop the thread """
+        if self.is_alive():
+            self._queue.put(None)
+            self.join()
+
+
+def load_dump(path):
+    """
+    Read a dump written by a FrameRecorder
+    :param path: .npz.zst file
+    :return: Dictionary of "times" and "frame" or detector name -> Numpy Array of the frames, oldest first
+    """
+    with open(path, 'rb') as file:
+        data = zstandard.ZstdDecompressor().stream_reader(file).read()
+
+    with np.load(io.BytesIO(data)) as arrays:
+        return {name: arrays[name] for name in arrays.files}
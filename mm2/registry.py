@@ -0,0 +1,284 @@
+import numpy as np
+
+from as64 import config
+from mm2 import detection
+
+
+# Actions a rule can fire
+CLEAR = "clear"
+SKIP = "skip"
+GAME_OVER = "game_over"
+
+ACTIONS = (CLEAR, SKIP, GAME_OVER)
+
+
+class Detector(object):
+    """
+    A colour check of one screen region, compiled once: the region is turned into slices and the bounds into arrays
+    so that checking a frame costs no more than the slicing and the colour match itself.
+    """
+
+    __slots__ = ("name", "region", "rows", "columns", "lower", "upper", "bgra", "threshold", "stride")
+
+    def __init__(self, name, region, lower, upper, threshold, stride=1):
+        """
+        :param name: Detector name
+        :param region: [x, y, width, height] of the screen capture
+        :param lower: Minimum BGR colour
+        :param upper: Maximum BGR colour
+        :param threshold: Fraction of pixels that must match
+        :param stride: Subsampling factor of the coarse check
+        """
+        x, y, width, height = region
+
+        self.name = name
+        self.region = list(region)
+        self.rows = slice(y, y + height)
+        self.columns = slice(x, x + width)
+        self.lower = np.array(lower, dtype='uint8')
+        self.upper = np.array(upper, dtype='uint8')
+        # Bounds for BGRA frames, any alpha matches
+        self.bgra = (np.append(self.lower, 0).astype('uint8'), np.append(self.upper, 255).astype('uint8'))
+        self.threshold = threshold
+        self.stride = stride if stride else 1
+
+    def crop(self, image):
+        return image[self.rows, self.columns]
+
+    def bounds(self, image):
+        """ Returns the (lower, upper) bounds matching the channels of a BGR or BGRA image """
+        return self.bgra if image.shape[2] == 4 else (self.lower, self.upper)
+
+    def scaled(self, x_scale, y_scale):
+        """ Returns a copy of the detector with its region scaled, edges are rounded to the nearest pixel """
+        x, y, width, height = self.region
+        left, top = int(round(x * x_scale)), int(round(y * y_scale))
+        right, bottom = int(round((x + width) * x_scale)), int(round((y + height) * y_scale))
+
+        return Detector(self.name, [left, top, right - left, bottom - top], self.lower, self.upper, self.threshold,
+                        self.stride)
+
+    def match(self, image, margin):
+        """
+        Check the detector's region of a full frame
+        :return: (Boolean, match fraction)
+        """
+        return detection.cascade_match(image[self.rows, self.columns], *self.bounds(image), self.threshold,
+                                       self.stride, margin)
+
+
+class Rule(object):
+    """ Fires an action when all of its detectors match, detectors are checked in order and stop at the first miss """
+
+    __slots__ = ("name", "action", "detectors")
+
+    def __init__(self, name, action, detectors):
+        if action not in ACTIONS:
+            raise ValueError("Rule '{}' has unknown action '{}'".format(name, action))
+
+        self.name = name
+        self.action = action
+        self.detectors = tuple(detectors)
+
+
+class DetectorRegistry(object):
+    """
+    Detectors and the rules combining them, as defined in the [detectors] and [rules] sections of the config.
+
+    [detectors] maps a detector name to the key of its region in [region] and the prefix of its
+    '_lower_bound'/'_upper_bound'/'_threshold'/'_stride' keys in [thresholds], any of which can also be given inline.
+    [rules] maps a rule name to the detectors that must all match and the action fired, rules are checked in order.
+
+    Regions of fractions of the frame are scaled to the size of every frame. Pixel regions are used as they are,
+    unless [detection] reference_size gives the size of the frames they are for, then they are scaled from it. Without
+    a reference size, pixel regions of frames scaled down to the detection canvas are scaled from the captured size.
+    Frames are checked with the registry returned by for_size().
+    """
+
+    def __init__(self, detectors, rules, size=None, relative=()):
+        """
+        :param detectors: Dictionary of name -> Detector
+        :param rules: List of Rule
+        :param size: [width, height] of the frames the pixel regions are for, None if they are not scaled
+        :param relative: Names of the detectors whose regions are fractions of the frame
+        """
+        self.detectors = detectors
+        self.rules = tuple(rules)
+        self.size = tuple(size) if size else None
+        self.relative = frozenset(relative)
+
+        # (width, height) -> DetectorRegistry with regions scaled to that size
+        self._sized = {}
+        self._used = None
+
+        # (width, height) of a captured frame -> DetectorRegistry with pixel regions for frames of that size
+        self._captured = {}
+
+    def for_size(self, width, height, captured=None):
+        """
+        Returns the registry with every region scaled to frames of the given size. Scaled registries are cached, so the
+        geometry is only computed once per frame size.
+        :param captured: (width, height) of the captured frame if the frame was scaled down from it, e.g. to the
+                         detection canvas. Pixel regions without a reference size are for the captured frame
+        """
+        if captured and self.size is None and len(self.relative) < len(self.detectors) and \
+                tuple(captured) != (width, height):
+            registry = self._captured.get(tuple(captured))
+            if registry is None:
+                registry = self._captured[tuple(captured)] = DetectorRegistry(self.detectors, self.rules, captured,
+                                                                              self.relative)
+            return registry.for_size(width, height)
+
+        if not self.relative and (self.size is None or (width, height) == self.size):
+            return self
+
+        sized = self._sized.get((width, height))
+        if sized is None:
+            detectors = {}
+            for name, detector in self.detectors.items():
+                if name in self.relative:
+                    detector = detector.scaled(width, height)
+                elif self.size:
+                    detector = detector.scaled(width / self.size[0], height / self.size[1])
+                detectors[name] = detector
+
+            rules = [Rule(rule.name, rule.action, [detectors[d.name] for d in rule.detectors]) for rule in self.rules]
+
+            sized = DetectorRegistry(detectors, rules, (width, height))
+            self._sized[(width, height)] = sized
+
+        return sized
+
+    def used_detectors(self):
+        """ Returns the detectors used by at least one rule, in the order rules check them """
+        if self._used is None:
+            self._used = []
+            for rule in self.rules:
+                for detector in rule.detectors:
+                    if detector not in self._used:
+                        self._used.append(detector)
+
+        return self._used
+
+    @classmethod
+    def compile(cls):
+        """ Build the registry from the config """
+        size = check_pair(config.get("detection", "reference_size"), "[detection] reference_size",
+                          off="[] to use pixel regions as they are")
+
+        detectors = {}
+        for name, definition in check_table(config.get("detectors"), "[detectors]").items():
+            detectors[name] = cls._compile_detector(name, check_table(definition, "Detector '{}'".format(name)))
+
+        rules = []
+        for name, definition in check_table(config.get("rules"), "[rules]").items():
+            definition = check_table(definition, "Rule '{}'".format(name))
+            if not isinstance(definition.get("detectors"), list) or not definition["detectors"]:
+                raise ValueError("Rule '{}' must list its detectors".format(name))
+
+            for detector in definition["detectors"]:
+                if not isinstance(detector, str) or detector not in detectors:
+                    raise ValueError("Rule '{}' uses unknown detector {!r}".format(name, detector))
+            members = [detectors[d] for d in definition["detectors"]]
+
+            rules.append(Rule(name, definition.get("action"), members))
+
+        return cls(detectors, rules, size, [name for name, d in detectors.items() if is_relative(d.region)])
+
+    @staticmethod
+    def _compile_detector(name, definition):
+        def setting(key, suffix):
+            if key in definition:
+                return definition[key]
+            return config.get("thresholds", definition.get("colour", name) + suffix)
+
+        region = definition.get("region", name)
+        if not isinstance(region, list):
+            region = config.get("region", region)
+
+        lower = setting("lower", "_lower_bound")
+        upper = setting("upper", "_upper_bound")
+        threshold = setting("threshold", "_threshold")
+
+        if region is None or lower is None or upper is None or threshold is None:
+            raise ValueError("Detector '{}' is missing its region, bounds or threshold".format(name))
+
+        # Checked here rather than failing on the first frame, a config reloaded while counting may contain anything
+        # Pixels and fractions can not be told apart in a mixed region, e.g. [0.2, 10, 0.5, 0.3]
+        if not isinstance(region, list) or len(region) != 4 or \
+                not (all(_is_int(v) and v >= 0 for v in region) or is_relative(region)):
+            raise ValueError("Detector '{}' region must be [x, y, width, height] in whole pixels, or in fractions of "
+                             "the frame from 0.0 to 1.0".format(name))
+        if is_relative(region) and (region[0] + region[2] > 1 or region[1] + region[3] > 1):
+            raise ValueError("Detector '{}' region must lie within the frame, x + width and y + height can not be "
+                             "more than 1.0".format(name))
+        for bound in (lower, upper):
+            if not isinstance(bound, list) or len(bound) != 3 or not all(_is_int(v) and 0 <= v <= 255 for v in bound):
+                raise ValueError("Detector '{}' bounds must be three values from 0 to 255".format(name))
+        threshold = check_number(threshold, "Detector '{}' threshold".format(name), maximum=1)
+        stride = setting("stride", "_stride")
+        stride = 1 if stride is None else check_int(stride, "Detector '{}' stride".format(name))
+
+        # A region of fractions of the frame only becomes pixels once the registry is sized to a frame
+        return Detector(name=name,
+                        region=region,
+                        lower=lower,
+                        upper=upper,
+                        threshold=threshold,
+                        stride=stride)
+
+
+def is_relative(region):
+    """ Returns True if a region is given as fractions of the frame rather than in pixels """
+    return all(isinstance(v, float) and 0 <= v <= 1 for v in region)
+
+
+# Checks of config values, raising ValueError so that a config reloaded while counting is rolled back instead of
+# failing on every frame
+
+def _is_int(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def check_table(value, name):
+    """ Returns a table of the config """
+    if not isinstance(value, dict):
+        raise ValueError("{} must be a table".format(name))
+    return value
+
+
+def check_int(value, name, minimum=1):
+    """ Returns a whole number of at least 'minimum' """
+    if not _is_int(value) or value < minimum:
+        raise ValueError("{} must be a whole number of at least {}".format(name, minimum))
+    return value
+
+
+def check_number(value, name, minimum=0, maximum=None):
+    """ Returns a number from 'minimum' to 'maximum', inclusive """
+    if not (_is_int(value) or isinstance(value, float)) or value < minimum or \
+            (maximum is not None and value > maximum):
+        if maximum is None:
+            raise ValueError("{} must be a number of at least {}".format(name, minimum))
+        raise ValueError("{} must be a number from {} to {}".format(name, minimum, maximum))
+    return value
+
+
+def check_positive(value, name):
+    """ Returns a number above 0, e.g. a rate that is divided by """
+    if not (_is_int(value) or isinstance(value, float)) or value <= 0:
+        raise ValueError("{} must be a number above 0".format(name))
+    return value
+
+
+def check_pair(value, name, off=None):
+    """
+    Returns a pair of whole numbers above 0, e.g. [width, height], as a tuple
+    :param off: How to turn the setting off with [] or [0, 0], which returns None. None if it can not be turned off
+    """
+    if off and (value == [] or value == [0, 0]):
+        return None
+
+    if not isinstance(value, list) or len(value) != 2 or not all(_is_int(v) and v > 0 for v in value):
+        raise ValueError("{} must be two whole numbers above 0{}".format(name, ", or " + off if off else ""))
+    return tuple(value)
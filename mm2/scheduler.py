@@ -0,0 +1,101 @@
+import time
+from threading import Lock
+
+
+# Hints given by the counter after processing a window, deciding how soon it is polled again
+IDLE = "idle"
+NEAR = "near"
+COOLDOWN = "cooldown"
+
+
+class FrameScheduler(object):
+    """
+    Paces frame processing with absolute deadlines per window. Every window has its own deadline and interval, the
+    interval depends on what the window looked like the last time it was processed: windows close to an event are
+    polled faster, windows in the post-event cooldown slower.
+
+    When processing overruns a deadline the slots that were missed are counted and skipped instead of being caught up
+    in a burst, so the cadence stays aligned to the original schedule.
+    """
+
+    def __init__(self, windows, idle_fps, near_fps, cooldown_fps, throttled=True):
+        """
+        :param windows: Number of windows
+        :param idle_fps: Rate at which a window without anything happening is polled
+        :param near_fps: Rate at which a window that looks close to an event is polled
+        :param cooldown_fps: Rate at which a window is polled during the cooldown after an event
+        :param throttled: When False deadlines are ignored and windows are processed as fast as possible
+        """
+        for name, fps in (("idle_fps", idle_fps), ("near_fps", near_fps), ("cooldown_fps", cooldown_fps)):
+            if not fps > 0:
+                raise ValueError("{} must be above 0, got {!r}".format(name, fps))
+
+        self._intervals = {IDLE: 1 / idle_fps, NEAR: 1 / near_fps, COOLDOWN: 1 / cooldown_fps}
+        self._throttled = throttled
+
+        now = time.perf_counter()
+        self._deadlines = [now] * windows
+        self._hints = [IDLE] * windows
+        self._missed = [0] * windows
+
+        self._mutex = Lock()
+
+    def next(self):
+        """ Returns the index of the window with the earliest deadline """
+        with self._mutex:
+            return min(range(len(self._deadlines)), key=self._deadlines.__getitem__)
+
+    def wait(self, index):
+        """ Sleep until the deadline of a window """
+        if not self._throttled:
+            return
+
+        remaining = self._deadlines[index] - time.perf_counter()
+        if remaining > 0:
+            time.sleep(remaining)
+
+    def done(self, index, hint=IDLE, resume_in=None):
+        """
+        Schedule the next deadline of a window that has just been processed
+        :param index: Window index
+        :param hint: IDLE, NEAR or COOLDOWN
+        :param resume_in: Seconds until the cooldown of the window ends, the window is polled again by then
+        """
+        if not self._throttled:
+            # No pacing, but keep rotating through the windows in round-robin mode
+            with self._mutex:
+                self._deadlines[index] = time.perf_counter()
+            return
+
+        interval = self._intervals[hint]
+        now = time.perf_counter()
+
+        with self._mutex:
+            deadline = self._deadlines[index]
+
+            if hint != self._hints[index]:
+                # Rate changed, start the new cadence from the current deadline rather than the old grid
+                deadline = max(deadline, now - interval)
+                self._hints[index] = hint
+
+            deadline += interval
+
+            if deadline < now:
+                # Overran: count the slots that were missed and skip them
+                missed = int((now - deadline) / interval) + 1
+                self._missed[index] += missed
+                deadline += missed * interval
+
+            if resume_in is not None:
+                deadline = min(deadline, now + max(resume_in, 0))
+
+            self._deadlines[index] = deadline
+
+    def get_missed(self):
+        """ Returns the number of missed deadlines per window """
+        with self._mutex:
+            return list(self._missed)
+
+    def get_hints(self):
+        with self._mutex:
+            return list(self._hints)
@@ -0,0 +1,127 @@
+import json
+import logging
+from threading import Thread, Condition
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+class ScoreBroadcaster(object):
+    """
+    Latest scores of every player, with a version number that increases on every change. Publishing only updates
+    a dictionary and notifies waiting clients, so the counter never blocks on connected overlays.
+    """
+
+    def __init__(self):
+        self._players = {}
+        self._version = 0
+        self._condition = Condition()
+
+    def publish(self, player, score, skips):
+        with self._condition:
+            self._players[player] = {"player": player, "score": score, "skips": skips}
+            self._version += 1
+            self._condition.notify_all()
+
+    def snapshot(self):
+        """ Returns (version, list of players) """
+        with self._condition:
+            return self._version, [dict(self._players[p]) for p in sorted(self._players)]
+
+    def wait(self, version, timeout):
+        """
+        Block until the version is newer than a given one or the timeout expires
+        :return: (version, list of players)
+        """
+        with self._condition:
+            self._condition.wait_for(lambda: self._version > version, timeout)
+            return self._version, [dict(self._players[p]) for p in sorted(self._players)]
+
+
+class _Handler(BaseHTTPRequestHandler):
+    # Seconds between keep-alive comments on idle event streams
+    KEEP_ALIVE = 15
+
+    def do_GET(self):
+        path = self.path.split("?")[0]
+
+        if path == "/snapshot":
+            self._send_snapshot()
+        elif path == "/events":
+            self._send_events()
+        else:
+            self.send_error(404)
+
+    def _send_snapshot(self):
+        version, players = self.server.broadcaster.snapshot()
+        body = json.dumps({"version": version, "players": players}).encode()
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Access-Control-Allow-Origin", "*")
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_events(self):
+        """ Server-Sent Events stream, the current scores are sent on connect and again after every change """
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Access-Control-Allow-Origin", "*")
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+
+        broadcaster = self.server.broadcaster
+        version, players = broadcaster.snapshot()
+
+        try:
+            self._send_event(version, players)
+
+            while not self.server.stopping:
+                latest, players = broadcaster.wait(version, self.KEEP_ALIVE)
+
+                if latest == version:
+                    self.wfile.write(b": keep-alive\n\n")
+                    self.wfile.flush()
+                else:
+                    # Updates published while a client was busy are coalesced into the latest scores
+                    version = latest
+                    self._send_event(version, players)
+        except (BrokenPipeError, ConnectionResetError, ConnectionAbortedError):
+            pass
+
+    def _send_event(self, version, players):
+        data = json.dumps({"version": version, "players": players})
+        self.wfile.write("id: {}\nevent: scores\ndata: {}\n\n".format(version, data).encode())
+        self.wfile.flush()
+
+    def log_message(self, format, *args):
+        logging.getLogger(__name__).debug(format, *args)
+
+
+class ScoreServer(object):
+    """
+    Local HTTP server pushing score changes to overlays (e.g. OBS browser sources)
+
+    GET /snapshot   Current scores as JSON
+    GET /events     Server-Sent Events stream of scores, sent on connect and on every change
+    """
+
+    def __init__(self, broadcaster, host="127.0.0.1", port=8765):
+        self._server = ThreadingHTTPServer((host, port), _Handler)
+        self._server.daemon_threads = True
+        self._server.broadcaster = broadcaster
+        self._server.stopping = False
+
+        self._thread = Thread(target=self._server.serve_forever, name="ScoreServer", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._server.stopping = True
+        self._server.shutdown()
+        self._server.server_close()
+
+    @property
+    def address(self):
+        return self._server.server_address
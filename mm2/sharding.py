@@ -0,0 +1,288 @@
+import logging
+import multiprocessing
+from multiprocessing import connection, shared_memory
+from threading import Lock
+
+import numpy as np
+
+
+class ShardPool(object):
+    """
+    Runs the detectors of many windows in worker processes, so that detection is not limited to one core by the GIL.
+    Windows are spread over the workers, every worker checks the frames of its shard of windows.
+
+    The counter keeps capturing, scoring and writing output. A frame is handed to a worker by copying it into the
+    window's shared memory buffer and sending only its name and shape through the window's pipe, the worker answers
+    with the action that fired, if any, and the window's change gate counters. Every window has one frame in flight
+    at most, so a single buffer per window is enough.
+
+    A worker that dies or stops answering is replaced by a new one for the same shard, windows of other shards carry on
+    undisturbed.
+
+    Workers never read the config file, they compile their detectors from the config the counter compiled its own
+    from. A worker is started with the latest such config, and after reload() the next frame of every window carries
+    the new one, which the worker compiles before checking the frame.
+    """
+
+    def __init__(self, windows, processes, settings, timeout=10.0):
+        """
+        :param windows: Number of windows
+        :param processes: Number of worker processes
+        :param settings: (config as returned by as64.config.snapshot(), near_fraction, black detector name) of the
+                         counter's detection, see reload()
+        :param timeout: Seconds a worker may take to answer before it is replaced
+        """
+        self._processes = max(1, min(processes, windows))
+        self._timeout = timeout
+
+        # Windows are dealt out to the shards in turn
+        self._shard_of = [i % self._processes for i in range(windows)]
+
+        self._workers = [None] * self._processes
+        self._generations = [0] * self._processes
+        self._connections = [None] * windows
+        self._busy = [False] * windows
+        self._buffers = [None] * windows
+
+        # Change gate counters of every window, as last answered by its worker
+        self._gating = [{} for _ in range(windows)]
+        self._lock = Lock()
+
+        # Workers are always spawned, forking the counter's threads is unsafe and Windows can only spawn anyway
+        self._context = multiprocessing.get_context("spawn")
+
+        # Settings of the latest reload and their version, the version each window's worker was last sent
+        self._settings = settings
+        self._version = 0
+        self._sent = [0] * windows
+
+        self._restarts = 0
+        self._logger = logging.getLogger(__name__)
+
+    def start(self):
+        for shard in range(self._processes):
+            self._start_worker(shard)
+
+    def _start_worker(self, shard):
+        windows = [i for i, s in enumerate(self._shard_of) if s == shard]
+        ends = []
+
+        for index in windows:
+            parent, child = self._context.Pipe()
+            self._connections[index] = parent
+            self._sent[index] = self._version
+            ends.append((index, child))
+
+        # Started with the latest settings, a worker restarted after a reload was rolled back never sees the rejected
+        # config
+        worker = self._context.Process(target=_worker_main, args=(ends, self._settings, self._version),
+                                         name="ShardWorker-{}".format(shard), daemon=True)
+        worker.start()
+
+        # Only the worker may hold the child ends, so that its death shows up as EOF in the counter
+        for _, child in ends:
+            child.close()
+
+        self._workers[shard] = worker
+        self._generations[shard] += 1
+
+    def check(self, index, image, state, captured=None):
+        """
+        Check a frame of a window with the detectors of its game state in the window's worker
+        :param state: Game state of the window
+        :param captured: Passed on to observe
+        :return: (Action of the rule that matched or None, Boolean whether a detector came near its threshold,
+                  next game state)
+        """
+        shard = self._shard_of[index]
+
+        with self._lock:
+            generation = self._generations[shard]
+            pipe = self._connections[index]
+            self._busy[index] = True
+
+            version, settings = self._version, None
+            if self._sent[index] != version:
+                settings = self._settings
+                self._sent[index] = version
+
+        buffer = self._buffer(index, image.nbytes)
+        np.ndarray(image.shape, dtype=image.dtype, buffer=buffer.buf)[:] = image
+
+        try:
+            pipe.send((buffer.name, image.shape, state, captured, version, settings))
+            if pipe.poll(self._timeout):
+                result, self._gating[index] = pipe.recv()
+                return result
+
+            self._logger.warning("Shard %s did not answer within %s s", shard, self._timeout)
+        except (EOFError, OSError):
+            self._logger.warning("Shard %s worker died", shard)
+        finally:
+            with self._lock:
+                self._busy[index] = False
+
+                # The shard was restarted while the frame was in flight, the old pipe is this thread's to close
+                if self._connections[index] is not pipe:
+                    pipe.close()
+
+        self._restart(shard, generation)
+        return None, False, state
+
+    def _buffer(self, index, size):
+        """ Returns the shared memory buffer of a window, replaced by a larger one if a frame no longer fits """
+        buffer = self._buffers[index]
+
+        if buffer is None or buffer.size < size:
+            if buffer is not None:
+                buffer.close()
+                buffer.unlink()
+
+            buffer = shared_memory.SharedMemory(create=True, size=size)
+            self._buffers[index] = buffer
+
+        return buffer
+
+    def _restart(self, shard, generation):
+        with self._lock:
+            # Another window of the shard may have restarted it already
+            if self._generations[shard] != generation:
+                return
+
+            worker = self._workers[shard]
+            if worker.is_alive():
+                worker.terminate()
+            worker.join()
+
+            # Pipes with a frame in flight are closed by their window's thread, closing them here would leave that
+            # thread waiting on a closed pipe
+            for index, s in enumerate(self._shard_of):
+                if s == shard and not self._busy[index]:
+                    self._connections[index].close()
+
+            print("Restarting detection worker {}".format(shard))
+            self._restarts += 1
+            self._start_worker(shard)
+
+    def reload(self, settings):
+        """
+        Have the workers recompile their detectors from a reloaded config
+        :param settings: (config as returned by as64.config.snapshot(), near_fraction, black detector name), the config
+                         must have compiled in the counter
+        """
+        with self._lock:
+            self._settings = settings
+            self._version += 1
+
+    def get_stats(self):
+        return {"processes": self._processes, "restarts": self._restarts}
+
+    def get_gating_stats(self):
+        """ Returns {region: (hits, misses)} of the workers' change gates, summed over windows """
+        stats = {}
+        for gating in list(self._gating):
+            for region, (hits, misses) in gating.items():
+                total = stats.get(region, (0, 0))
+                stats[region] = (total[0] + hits, total[1] + misses)
+        return stats
+
+    def close(self):
+        """ Stop the workers and free the shared memory """
+        with self._lock:
+            for pipe in self._connections:
+                if pipe is not None:
+                    try:
+                        pipe.send(None)
+                    except OSError:
+                        pass
+                    pipe.close()
+
+            for worker in self._workers:
+                if worker is not None:
+                    worker.join(self._timeout)
+                    if worker.is_alive():
+                        worker.terminate()
+
+            for buffer in self._buffers:
+                if buffer is not None:
+                    buffer.close()
+                    buffer.unlink()
+
+            self._buffers = [None] * len(self._buffers)
+
+
+def _compile(settings):
+    """ Returns (registry, engine, near_fraction, black) compiled from the settings sent by the counter """
+    from as64 import config
+    from mm2.registry import DetectorRegistry
+    from mm2.engine import create_engine
+
+    settings, near_fraction, black = settings
+
+    config.load(settings)
+    registry = DetectorRegistry.compile()
+    return registry, create_engine(), near_fraction, black
+
+
+def _worker_main(ends, settings, version):
+    """
+    Entry point of a worker process: answer frame requests of its windows until all of their pipes are stopped
+    :param ends: List of (window index, Connection)
+    :param settings: Settings to start with, see ShardPool
+    :param version: Version of the settings
+    """
+    # Imported here so that the registry and engine are compiled inside the worker
+    from mm2.gamestate import observe
+
+    registry, engine, near_fraction, black = _compile(settings)
+
+    pipes = {pipe: index for index, pipe in ends}
+
+    # Window index -> SharedMemory of its latest frame
+    attached = {}
+
+    try:
+        while pipes:
+            for pipe in connection.wait(list(pipes)):
+                index = pipes[pipe]
+
+                try:
+                    request = pipe.recv()
+                except EOFError:
+                    request = None
+
+                if request is None:
+                    del pipes[pipe]
+                    continue
+
+                name, shape, state, captured, latest, settings = request
+
+                # The counter compiled the same config before sending it, a failure only keeps the old detectors
+                if settings is not None and latest > version:
+                    try:
+                        registry, engine, near_fraction, black = _compile(settings)
+                        version = latest
+                    except Exception:
+                        logging.getLogger(__name__).exception('')
+
+                buffer = attached.get(index)
+                if buffer is None or buffer.name != name:
+                    if buffer is not None:
+                        buffer.close()
+                    buffer = shared_memory.SharedMemory(name=name)
+                    attached[index] = buffer
+
+                image = np.ndarray(shape, dtype=np.uint8, buffer=buffer.buf)
+                try:
+                    result = observe(engine, registry, index, image, state, near_fraction, black, captured)
+                except Exception:
+                    logging.getLogger(__name__).exception('')
+                    result = None, False, state
+                del image
+
+                pipe.send((result, engine.gate.get_stats(index) if engine.gate else {}))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for buffer in attached.values():
+            buffer.close()
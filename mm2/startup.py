@@ -0,0 +1,123 @@
+import os
+import json
+import time
+import logging
+import importlib
+from threading import Thread, Lock
+
+
+class StartupTimeline(object):
+    """
+    Time spent in every phase of starting up, from the start of the process or of a restarted counter up to the first
+    frame checked by the detectors. A phase lasts from the previous mark to its own.
+    """
+
+    def __init__(self, start=None):
+        self._start = start if start is not None else time.perf_counter()
+        self._last = self._start
+        self._phases = []
+        self._lock = Lock()
+        self.finished = False
+
+    def mark(self, phase):
+        """ End a phase, unless it has already ended """
+        with self._lock:
+            self._mark(phase)
+
+    def finish(self, phase):
+        """ End the last phase, log the timeline and print the time to the first detection """
+        with self._lock:
+            if not self._mark(phase):
+                return
+            self.finished = True
+
+        text = format_timeline(self.get_stats())
+        logging.getLogger(__name__).info(text)
+        print(text)
+
+    def _mark(self, phase):
+        # Phases are only marked the first time, e.g. the first frame of any window
+        if self.finished or any(name == phase for name, _ in self._phases):
+            return False
+
+        now = time.perf_counter()
+        self._phases.append((phase, now - self._last))
+        self._last = now
+        return True
+
+    def get_stats(self):
+        """ Returns a dictionary of the "total" and every "phases" as a list of [name, seconds] """
+        with self._lock:
+            return {"total": self._last - self._start, "phases": [list(phase) for phase in self._phases]}
+
+
+def format_timeline(stats):
+    phases = ", ".join("{} {:.0f} ms".format(name, seconds * 1000) for name, seconds in stats["phases"])
+    return "Counting after {:.0f} ms ({})".format(stats["total"] * 1000, phases)
+
+
+# Timeline of the process, started when this module is first imported, main.py imports it before anything else
+_timeline = StartupTimeline()
+
+
+def mark(phase):
+    """ End a phase of the process's start up, before any counter exists """
+    if _timeline:
+        _timeline.mark(phase)
+
+
+def begin():
+    """
+    Returns the timeline of a counter starting up: the process's timeline for the first counter, so that it includes
+    the imports and loading the config, a new timeline for every counter started after it
+    """
+    global _timeline
+
+    timeline, _timeline = _timeline or StartupTimeline(), None
+    return timeline
+
+
+def preload(*modules):
+    """
+    Import modules on a background thread, e.g. numpy, OpenCV and pywin32 while the controller loads the config and
+    journal and starts its servers. The counter importing them later only waits for whatever is left of the import.
+    :param modules: Module names, modules that are not installed are skipped
+    """
+    def run():
+        for module in modules:
+            try:
+                importlib.import_module(module)
+            except ImportError:
+                pass
+
+    Thread(target=run, name="Preload", daemon=True).start()
+
+
+def load_assignment(path, backend):
+    """
+    Read the windows last assigned to the players
+    :param path: Assignment file
+    :param backend: Name of the capture backend, assignments of other backends are ignored
+    :return: Dictionary of player -> handle
+    """
+    try:
+        with open(path) as file:
+            assignment = json.load(file)
+    except (OSError, ValueError):
+        return {}
+
+    if not isinstance(assignment, dict) or assignment.get("backend") != backend:
+        return {}
+
+    return {player: handle for player, handle in enumerate(assignment.get("handles", [])) if handle is not None}
+
+
+def save_assignment(path, backend, handles):
+    """ Write the windows assigned to the players, so that a restarted counter can reuse them without discovery """
+    try:
+        temp = path + ".tmp"
+        with open(temp, 'w') as file:
+            json.dump({"backend": backend, "handles": list(handles)}, file)
+        os.replace(temp, path)
+    except (OSError, TypeError, ValueError):
+        logging.getLogger(__name__).exception('')
@@ -0,0 +1,44 @@
+from collections import namedtuple
+
+
+class PlayerState(object):
+    """
+    Mutable state of one player, only changed by the counter while it holds its mutex
+    """
+    __slots__ = ("player", "handle", "score", "skips", "last_update", "valid", "score_file_name", "skip_file_name")
+
+    def __init__(self, player, handle, score=0, skips=0, last_update=float("-inf"), score_file_name=None,
+                 skip_file_name=None):
+        self.player = player
+        self.handle = handle
+        self.score = score
+        self.skips = skips
+        # Time of the last clear/skip, the start of a replay may be at time 0 so never updated is -inf
+        self.last_update = last_update
+        self.valid = False
+        self.score_file_name = score_file_name
+        self.skip_file_name = skip_file_name
+
+    def freeze(self):
+        return PlayerSnapshot(self.player, self.handle, self.score, self.skips, self.last_update)
+
+
+PlayerSnapshot = namedtuple("PlayerSnapshot", ["player", "handle", "score", "skips", "last_update"])
+
+
+class StateSnapshot(namedtuple("StateSnapshot", ["version", "players"])):
+    """
+    Immutable copy of every player's state, published by the counter after each change. Readers take the latest
+    snapshot without a lock and always see the scores, skips and handles of one consistent moment. The version
+    increases with every published snapshot.
+    """
+    __slots__ = ()
+
+    @staticmethod
+    def of(version, states):
+        return StateSnapshot(version, tuple(state.freeze() for state in states))
+
+    def to_dict(self):
+        """ Returns a dictionary of player -> state that a new counter can be restored from """
+        return {p.player: {"score": p.score, "skips": p.skips, "last_update": p.last_update, "handle": p.handle}
+                for p in self.players}
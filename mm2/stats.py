@@ -0,0 +1,149 @@
+import json
+import time
+import logging
+from threading import Thread, Event
+
+import numpy as np
+
+from mm2.startup import format_timeline
+
+
+class RollingHistogram(object):
+    """
+    The most recent samples of a measurement in a fixed size ring buffer. Recording is a single array store, the
+    distribution is only computed when it is read.
+    """
+
+    def __init__(self, size=1024):
+        self._samples = np.zeros(size)
+        self._count = 0
+
+    def record(self, value):
+        self._samples[self._count % len(self._samples)] = value
+        self._count += 1
+
+    @property
+    def count(self):
+        return self._count
+
+    def summary(self):
+        """
+        Returns a dictionary of the mean, p50, p99 and max of the samples in the buffer, in milliseconds
+        """
+        samples = self._samples[:min(self._count, len(self._samples))] * 1000
+
+        if not len(samples):
+            return {"mean_ms": 0.0, "p50_ms": 0.0, "p99_ms": 0.0, "max_ms": 0.0}
+
+        p50, p99 = np.percentile(samples, [50, 99])
+        return {"mean_ms": float(samples.mean()), "p50_ms": float(p50), "p99_ms": float(p99),
+                "max_ms": float(samples.max())}
+
+
+class WindowStats(object):
+    """
+    Timers and counters of one window. Every window is processed by one thread at a time, so these are updated
+    without locking.
+    """
+
+    __slots__ = ("capture", "detect", "frames", "capture_failures", "detections")
+
+    def __init__(self, size=1024):
+        self.capture = RollingHistogram(size)
+        self.detect = RollingHistogram(size)
+        self.frames = 0
+        self.capture_failures = 0
+        self.detections = 0
+
+    def summary(self):
+        return {
+            "frames": self.frames,
+            "capture_failures": self.capture_failures,
+            "detections": self.detections,
+            "capture": self.capture.summary(),
+            "detect": self.detect.summary(),
+        }
+
+
+def format_stats(stats):
+    """ Format a stats dictionary, as returned by Counter.get_stats, for the console """
+    lines = ["Uptime: {:.0f} s".format(stats["uptime"])]
+
+    for i, window in enumerate(stats["windows"]):
+        capture = window["capture"]
+        detect = window["detect"]
+        lines.append("Player {}: {} frames ({:.1f} fps), {} detections, {} capture failures, "
+                     "{} missed deadlines, {}".format(i, window["frames"], window["fps"], window["detections"],
+                                                      window["capture_failures"], window["missed_deadlines"],
+                                                      window.get("state", "")))
+        lines.append("  capture  mean {:.2f} ms  p50 {:.2f} ms  p99 {:.2f} ms  max {:.2f} ms".format(
+            capture["mean_ms"], capture["p50_ms"], capture["p99_ms"], capture["max_ms"]))
+        lines.append("  detect   mean {:.2f} ms  p50 {:.2f} ms  p99 {:.2f} ms  max {:.2f} ms".format(
+            detect["mean_ms"], detect["p50_ms"], detect["p99_ms"], detect["max_ms"]))
+
+        queue = window.get("queue")
+        if queue:
+            lines.append("  queue    depth {}  max depth {}  {} queued  {} dropped".format(
+                queue["depth"], queue["max_depth"], queue["queued"], queue["dropped"]))
+
+    output = stats["output"]
+    lines.append("Output: {} writes, latency mean {:.1f} ms, max {:.1f} ms".format(
+        output["writes"], output["mean_latency"] * 1000, output["max_latency"] * 1000))
+
+    for region, (hits, misses) in stats["gating"].items():
+        lines.append("Unchanged {}: {:.0%} of checks skipped ({}/{})".format(
+            region, hits / max(hits + misses, 1), hits, hits + misses))
+
+    states = stats.get("states")
+    if states:
+        frames = max(sum(states.values()), 1)
+        lines.append("States: " + ", ".join("{} {:.0%}".format(state, count / frames)
+                                            for state, count in states.items()))
+
+    timeline = stats.get("startup")
+    if timeline:
+        lines.append(format_timeline(timeline))
+
+    sharding = stats.get("sharding")
+    if sharding:
+        lines.append("Sharding: {} detection processes, {} restarts".format(sharding["processes"],
+                                                                          sharding["restarts"]))
+
+    recorder = stats.get("recorder")
+    if recorder:
+        lines.append("Recorder: {} dumps written, {} pending, {} dropped".format(
+            recorder["dumps"], recorder["pending"], recorder["dropped"]))
+
+    return "\n".join(lines)
+
+
+class StatsDumper(Thread):
+    """ Periodically writes a stats dictionary as JSON to a metrics file """
+
+    def __init__(self, source, path, interval):
+        """
+        :param source: Function returning the stats dictionary
+        :param path: Metrics file
+        :param interval: Seconds between dumps
+        """
+        super().__init__(name="StatsDumper", daemon=True)
+
+        self._source = source
+        self._path = path
+        self._interval = interval
+        self._stopped = Event()
+
+    def run(self):
+        while not self._stopped.wait(self._interval):
+            self.dump()
+
+    def dump(self):
+        try:
+            stats = dict(self._source(), time=time.time())
+            with open(self._path, 'w') as file:
+                json.dump(stats, file)
+        except Exception:
+            logging.getLogger(__name__).exception('')
+
+    def stop(self):
+        self._stopped.set()
@@ -0,0 +1,139 @@
+import os
+import time
+import tempfile
+import logging
+from threading import Thread, Condition
+
+from as64.paths import base_path, copy_mode
+
+
+class ScoreWriter(Thread):
+    """
+    Writes score/skip files on a background thread so that slow disks never stall detection. Updates are queued
+    per file name, rapid updates to the same file (a skip and its score penalty) are coalesced into a single write of
+    the latest value. Files are written to a temporary file first and renamed into place, so readers such as OBS
+    never see a truncated file.
+    """
+
+    def __init__(self, directory="", coalesce=0.05):
+        """
+        :param directory: Output directory, relative paths are relative to the application's directory
+        :param coalesce: Seconds to wait for further updates before writing
+        """
+        super().__init__(name="ScoreWriter", daemon=True)
+
+        self._directory = base_path(directory) if directory else base_path()
+        self._coalesce = coalesce
+
+        # file name -> (value, time the value was queued)
+        self._pending = {}
+        self._condition = Condition()
+        self._running = True
+        self._busy = False
+
+        # Time from an update being queued until its file has been replaced
+        self._writes = 0
+        self._total_latency = 0.0
+        self._max_latency = 0.0
+        self._last_latency = 0.0
+
+        self._logger = logging.getLogger(__name__)
+
+        if self._directory:
+            os.makedirs(self._directory, exist_ok=True)
+
+    def write(self, file, value):
+        """
+        Queue a value to be written to '<file>.txt' in the output directory
+        """
+        with self._condition:
+            queued = self._pending[file][1] if file in self._pending else time.perf_counter()
+            self._pending[file] = (value, queued)
+            self._condition.notify()
+
+    def run(self):
+        while True:
+            with self._condition:
+                while self._running and not self._pending:
+                    self._condition.wait()
+
+                if not self._pending:
+                    return
+
+            # Give closely following updates the chance to replace the pending value
+            if self._running and self._coalesce:
+                time.sleep(self._coalesce)
+
+            with self._condition:
+                pending = self._pending
+                self._pending = {}
+                self._busy = True
+
+            for file, (value, queued) in pending.items():
+                try:
+                    self._replace(file, value)
+                except OSError:
+                    self._logger.exception('')
+                    continue
+
+                latency = time.perf_counter() - queued
+                self._writes += 1
+                self._total_latency += latency
+                self._last_latency = latency
+                self._max_latency = max(self._max_latency, latency)
+
+            with self._condition:
+                self._busy = False
+                self._condition.notify_all()
+
+    def _replace(self, file, value):
+        path = os.path.join(self._directory, "{}.txt".format(file)) if self._directory else "{}.txt".format(file)
+
+        # A temporary file of its own, no other writer can replace or rename it halfway
+        handle, temp = tempfile.mkstemp(prefix="{}.".format(file), suffix=".tmp", dir=os.path.dirname(path) or None)
+        try:
+            with os.fdopen(handle, 'w') as f:
+                f.write(str(value))
+            copy_mode(temp, path)
+
+            # The destination may be briefly locked by a reader on Windows
+            for attempt in range(5):
+                try:
+                    os.replace(temp, path)
+                    return
+                except PermissionError:
+                    if attempt == 4:
+                        raise
+                    time.sleep(0.01)
+        except OSError:
+            try:
+                os.remove(temp)
+            except OSError:
+                pass
+            raise
+
+    def flush(self, timeout=None):
+        """ Block until every queued update has been written """
+        with self._condition:
+            self._condition.notify()
+            return self._condition.wait_for(lambda: not self._pending and not self._busy, timeout)
+
+    def stop(self):
+        """ Write any pending updates and stop the thread """
+        with self._condition:
+            self._running = False
+            self._condition.notify_all()
+
+        if self.is_alive():
+            self.join()
+
+    def get_stats(self):
+        """
+        Returns a dictionary of the number of writes and their latency in seconds
+        """
+        return {
+            "writes": self._writes,
+            "mean_latency": self._total_latency / self._writes if self._writes else 0.0,
+            "max_latency": self._max_latency,
+            "last_latency": self._last_latency,
+        }
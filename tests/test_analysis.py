@@ -0,0 +1,80 @@
+import os
+import copy
+
+import numpy as np
+import cv2
+import pytest
+import toml
+
+from as64 import config
+from mm2 import analysis
+from mm2.registry import CLEAR
+
+FPS = 30
+SIZE = (192, 108)
+
+# Colours inside the default course clear and black bounds, and a grey matching no detector
+BANNER = (15, 210, 240)
+BLACK = (0, 0, 0)
+GREY = (128, 128, 128)
+
+# (colour, frames) of the clip: two courses cleared, with the banners and black screens between courses
+SCENES = [(GREY, 30), (BANNER, 30), (BLACK, 20), (GREY, 40), (BANNER, 20), (BLACK, 15), (GREY, 25)]
+
+
+@pytest.fixture(autouse=True)
+def settings(monkeypatch):
+    """ The default config, with its pixel regions scaled to the clip's small frames """
+    with open(os.path.join(os.path.dirname(__file__), "..", "defaults")) as file:
+        data = toml.load(file)
+    data["detection"]["reference_size"] = [1920, 1080]
+
+    # Restored after the test
+    monkeypatch.setattr(config, "_config", {})
+    monkeypatch.setattr(config, "_defaults", copy.deepcopy(data))
+
+    analysis._init(data)
+
+
+@pytest.fixture
+def clip(tmp_path):
+    path = str(tmp_path / "race.avi")
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"MJPG"), FPS, SIZE)
+
+    for colour, frames in SCENES:
+        image = np.full((SIZE[1], SIZE[0], 3), colour, dtype=np.uint8)
+        for _ in range(frames):
+            writer.write(image)
+    writer.release()
+
+    return path
+
+
+def run(path, segment_seconds, step=1):
+    segments = [analysis.analyze_segment(*task) for task in analysis.split(path, segment_seconds, step)]
+    return analysis.merge(segments)
+
+
+def test_single_segment_counts_every_clear(clip):
+    events, repaired = run(clip, 1000)
+
+    assert [action for _, action in events] == [CLEAR, CLEAR]
+    assert [frame for frame, _ in events] == [30, 120]
+    assert repaired == 0
+
+
+@pytest.mark.parametrize("segment_seconds", [2.2, 1.1, 0.7, 0.5])
+def test_segment_boundaries_give_the_single_segment_result(clip, segment_seconds):
+    expected, _ = run(clip, 1000)
+
+    events, repaired = run(clip, segment_seconds)
+
+    assert events == expected
+    # At least one boundary falls within a banner or black screen and was analysed again
+    assert repaired > 0
+
+
+def test_skipped_frames_give_the_single_segment_result(clip):
+    expected, _ = run(clip, 1000, step=2)
+
+    assert run(clip, 0.7, step=2)[0] == expected
@@ -0,0 +1,97 @@
+import itertools
+
+import numpy as np
+import cv2
+import pytest
+
+from mm2 import calibration
+from mm2.registry import Detector
+
+
+LOWER = [100, 110, 120]
+UPPER = [150, 160, 170]
+
+
+class FakeRegistry(object):
+    def __init__(self, *detectors):
+        self.detectors = {d.name: d for d in detectors}
+
+
+@pytest.fixture
+def corpus():
+    """ Crops of colours around the bounds, the first half mostly within them """
+    random = np.random.RandomState(3)
+    crops = []
+    for i in range(12):
+        low, high = (95, 165) if i < 6 else (60, 200)
+        crops.append(random.randint(low, high, size=(6, 5, 3)).astype(np.uint8))
+    labels = np.array([True] * 6 + [False] * 6)
+    return crops, labels
+
+
+def in_range(crop, lower, upper):
+    return np.count_nonzero(cv2.inRange(crop, np.array(lower, dtype=np.uint8), np.array(upper, dtype=np.uint8))) / \
+        (crop.shape[0] * crop.shape[1])
+
+
+def combinations(candidates):
+    """ Yields (index into the sweep, lower, upper) of every combination of candidate bounds """
+    axes = []
+    for c in range(3):
+        axes += [range(len(candidates.lower[c])), range(len(candidates.upper[c]))]
+
+    for index in itertools.product(*axes):
+        yield index, calibration._bounds(candidates, index)
+
+
+def test_sweep_matches_in_range(corpus):
+    crops, _ = corpus
+    candidates = calibration.candidate_bounds(LOWER, UPPER, deltas=(-10, 5))
+
+    fractions = calibration.sweep(crops, candidates)
+
+    for index, (lower, upper) in combinations(candidates):
+        expected = [in_range(crop, lower, upper) for crop in crops]
+        assert fractions[(slice(None),) + index] == pytest.approx(expected), (lower, upper)
+
+
+def test_evaluate_matches_thresholded_in_range(corpus):
+    crops, labels = corpus
+    candidates = calibration.candidate_bounds(LOWER, UPPER, deltas=(-10, 5))
+    thresholds = (0.3, 0.6)
+
+    scores = calibration.evaluate(calibration.sweep(crops, candidates), labels, thresholds)
+
+    for index, (lower, upper) in combinations(candidates):
+        fractions = np.array([in_range(crop, lower, upper) for crop in crops])
+        threshold = scores["threshold"][index]
+        assert threshold in thresholds
+
+        matched = fractions > threshold
+        true_positives = np.count_nonzero(matched & labels)
+        assert scores["precision"][index] == pytest.approx(true_positives / max(np.count_nonzero(matched), 1))
+        assert scores["recall"][index] == pytest.approx(true_positives / np.count_nonzero(labels))
+        assert scores["margin"][index] == pytest.approx(fractions[labels].min() - fractions[~labels].max())
+
+
+@pytest.mark.parametrize("deltas", [(-20, -10, 0, 10, 20), (2, 4), (-4,)])
+def test_configured_bounds_are_always_candidates(deltas):
+    candidates = calibration.candidate_bounds(LOWER, UPPER, deltas)
+
+    for c in range(3):
+        assert LOWER[c] in candidates.lower[c]
+        assert UPPER[c] in candidates.upper[c]
+
+
+@pytest.mark.parametrize("deltas", [(-20, -10, 0, 10, 20), (2, 4)])
+def test_current_row_scores_the_configured_bounds(corpus, deltas):
+    crops, labels = corpus
+    detector = Detector("colour", [0, 0, 5, 6], LOWER, UPPER, threshold=0.5)
+
+    result, = calibration.calibrate({"colour": corpus}, FakeRegistry(detector), deltas=deltas)
+
+    fractions = np.array([in_range(crop, LOWER, UPPER) for crop in crops])
+    current = result["current"]
+    assert current["lower"] == LOWER and current["upper"] == UPPER
+    assert current["margin"] == pytest.approx(fractions[labels].min() - fractions[~labels].max())
+    assert current["recall"] == pytest.approx(np.count_nonzero(fractions[labels] > 0.5) / np.count_nonzero(labels))
@@ -0,0 +1,75 @@
+import numpy as np
+import cv2
+import pytest
+
+from as64 import capture
+from as64.capture import CaptureBackend, ReplayBackend
+
+
+class FakeClock(object):
+    """ Stands in for the time module """
+
+    def __init__(self):
+        self.now = 0.0
+
+    def perf_counter(self):
+        return self.now
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(capture, "time", clock)
+    return clock
+
+
+@pytest.fixture
+def frames(tmp_path):
+    """ Image directory of 10 frames, the value of every pixel is the frame's number """
+    for i in range(10):
+        cv2.imwrite(str(tmp_path / "{:03d}.png".format(i)), np.full((8, 8, 3), i, dtype=np.uint8))
+    return str(tmp_path)
+
+
+def grab(backend, handle):
+    image = backend.grab(handle)
+    return None if image is None else int(image[0, 0, 0])
+
+
+def test_realtime_replay_plays_at_media_rate(clock, frames):
+    backend = ReplayBackend([frames], loop=False, realtime=True, fps=10)
+    handle, = backend.get_handles(1)
+
+    # Polled faster than the media rate, frames repeat until the next one is due
+    assert [grab(backend, handle) for _ in range(3)] == [0, 0, 0]
+    clock.now += 0.1
+    assert grab(backend, handle) == 1
+
+    # Polled slower, frames that fell due in between are skipped
+    clock.now += 0.35
+    assert grab(backend, handle) == 4
+    clock.now += 0.3
+    assert grab(backend, handle) == 7
+
+    clock.now += 1
+    assert grab(backend, handle) is None
+
+
+def test_unthrottled_replay_reads_every_frame(clock, frames):
+    backend = ReplayBackend([frames], loop=True, realtime=False, fps=10)
+    handle, = backend.get_handles(1)
+
+    assert [grab(backend, handle) for _ in range(12)] == list(range(10)) + [0, 1]
+    assert backend.get_time(handle) == pytest.approx(1.2)
+
+
+def test_backends_must_implement_grabbing():
+    class Incomplete(CaptureBackend):
+        def get_handles(self, count):
+            return [None] * count
+
+    with pytest.raises(TypeError):
+        Incomplete()
@@ -0,0 +1,50 @@
+import os
+import sys
+
+import pytest
+
+from as64 import config
+
+
+@pytest.fixture
+def files(monkeypatch, tmp_path):
+    path = tmp_path / "config"
+    path.write_text("[settings]\nnum_windows = 3\n")
+
+    monkeypatch.setattr(config, "_config", {})
+    monkeypatch.setattr(config, "_cache", None)
+    monkeypatch.setattr(config, "_CONFIG_FILE", str(path))
+    monkeypatch.setattr(config, "_CACHE_FILE", str(tmp_path / "config.cache"))
+    return tmp_path
+
+
+def test_parsed_config_is_cached(files, monkeypatch):
+    config.load()
+    assert config.get("settings", "num_windows") == 3
+    assert sorted(os.listdir(files)) == ["config", "config.cache"]
+
+    # Taken from the cache, the TOML parser can not be imported
+    monkeypatch.setattr(config, "_cache", None)
+    monkeypatch.setitem(sys.modules, "toml", None)
+    config.load()
+    assert config.get("settings", "num_windows") == 3
+
+
+@pytest.mark.skipif(os.name == "nt", reason="POSIX permissions")
+def test_cache_is_readable_like_any_new_file(files):
+    umask = os.umask(0o022)
+    os.umask(umask)
+
+    config.load()
+
+    assert os.stat(files / "config.cache").st_mode & 0o777 == 0o644 & ~umask
+
+
+@pytest.mark.skipif(os.name == "nt", reason="POSIX permissions")
+def test_cache_keeps_its_permissions(files):
+    (files / "config.cache").write_text("{}")
+    os.chmod(files / "config.cache", 0o664)
+
+    config.load()
+
+    assert os.stat(files / "config.cache").st_mode & 0o777 == 0o664
@@ -0,0 +1,149 @@
+import os
+import copy
+import json
+import socket
+import threading
+
+import numpy as np
+import pytest
+import toml
+
+from as64 import config
+from as64.capture import CaptureBackend
+from mm2.control import ControlServer, _parse
+from mm2.controller import Controller
+from mm2.counter import Counter
+from mm2.writer import ScoreWriter
+
+
+class FakeBackend(CaptureBackend):
+    def get_handles(self, count):
+        return ["vlc {}".format(i) for i in range(count)]
+
+    def grab(self, handle):
+        return np.zeros((1080, 1920, 3), dtype=np.uint8)
+
+    def get_size(self, handle):
+        return [1920, 1080]
+
+
+@pytest.fixture
+def counter(monkeypatch, tmp_path):
+    """ Counter of the default config, which reports itself running without capturing """
+    with open(os.path.join(os.path.dirname(__file__), "..", "defaults")) as file:
+        data = toml.load(file)
+    data["startup"]["assignment_file"] = ""
+
+    monkeypatch.setattr(config, "_config", copy.deepcopy(data))
+    monkeypatch.setattr(config, "_defaults", data)
+
+    writer = ScoreWriter(directory=str(tmp_path), coalesce=0.01)
+    writer.start()
+
+    counter = Counter(backend=FakeBackend(), writer=writer)
+    counter._running = True
+    yield counter
+    writer.stop()
+
+
+@pytest.fixture
+def controller(counter):
+    controller = Controller.__new__(Controller)
+    controller.counter = counter
+    return controller
+
+
+def applied(counter, function, *args):
+    """ Runs a function issuing commands, applying them as the counter's next frames would once they are queued """
+    result = []
+    thread = threading.Thread(target=lambda: result.append(function(*args)))
+    version = counter.snapshot().version
+    thread.start()
+
+    while thread.is_alive():
+        if counter._commands.empty():
+            thread.join(0.01)
+            continue
+
+        # Queued, but not applied before the counter's next frame
+        assert counter.snapshot().version == version
+        counter._apply_commands()
+        version = counter.snapshot().version
+
+    return result[0]
+
+
+def test_plain_commands_are_split_on_semicolons():
+    assert _parse("set 0 3; skip 1 2;; status") == [["set", "0", "3"], ["skip", "1", "2"], ["status"]]
+
+
+def test_json_commands():
+    assert _parse('{"commands": [["set", 0, 3], [], ["status"]]}') == [["set", 0, 3], ["status"]]
+
+
+@pytest.mark.parametrize("line", ['{"commands": 3', '{"cmds": []}', '{"commands": [[0, 1]]}', '{"commands": ["set"]}'])
+def test_malformed_json_is_rejected(line):
+    with pytest.raises(ValueError):
+        _parse(line)
+
+
+def test_commands_are_applied_between_frames(controller, counter):
+    response = applied(counter, controller.execute_control, [["set", "0", "3"], ["status"]])
+
+    assert response["results"] == [{"command": "set", "ok": True}, {"command": "status", "ok": True}]
+    assert response["status"]["version"] == counter.snapshot().version
+    assert [p["score"] for p in response["status"]["players"]] == [3, 0]
+    assert response["status"]["players"][0]["window"] == "vlc 0"
+
+
+@pytest.mark.parametrize("command, error", [
+    (["set", "0"], "Missing argument or no such player"),
+    (["SKIP"], "Missing argument or no such player"),
+    (["jump", "1"], "Unknown command 'jump'"),
+    (["set", "zero", "3"], "invalid literal for int() with base 10: 'zero'"),
+])
+def test_failed_commands_are_answered_with_their_error(controller, command, error):
+    result, = controller.execute_control([command])["results"]
+
+    assert result == {"command": command[0].lower(), "ok": False, "error": error}
+
+
+def test_commands_of_a_missing_player_fail_alone(controller, counter):
+    response = applied(counter, controller.execute_control, [["skip", "5", "1"], ["skip", "1", "2"]])
+
+    assert response["results"] == [
+        {"command": "skip", "ok": False, "error": "Missing argument or no such player"},
+        {"command": "skip", "ok": True},
+    ]
+    assert [p["skips"] for p in response["status"]["players"]] == [0, 2]
+
+
+def test_commands_need_a_running_counter(controller, counter):
+    counter._running = False
+
+    result, = controller.execute_control([["set", "0", "1"]])["results"]
+    assert result == {"command": "set", "ok": False, "error": "Counter not running"}
+
+
+def test_server_answers_every_line():
+    batches = []
+
+    def execute(commands):
+        batches.append(commands)
+        return {"results": len(commands)}
+
+    server = ControlServer(execute=execute, port=0)
+    server.start()
+    try:
+        with socket.create_connection(server.address, timeout=5) as client:
+            lines = client.makefile("rwb")
+            lines.write(b'status; set 0 1\n{"commands": [1]}\n')
+            lines.flush()
+
+            assert json.loads(lines.readline()) == {"results": 2}
+            error = json.loads(lines.readline())["error"]
+            assert error == "Every command must be a list starting with the command name"
+    finally:
+        server.stop()
+
+    assert batches == [[["status"], ["set", "0", "1"]]]
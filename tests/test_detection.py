@@ -0,0 +1,156 @@
+import numpy as np
+import cv2
+import pytest
+
+from mm2.detection import ChangeGate, cascade_match
+
+LOWER = np.array([0, 185, 225], dtype=np.uint8)
+UPPER = np.array([30, 235, 255], dtype=np.uint8)
+MARGIN = 0.15
+
+
+class CountingDetector(object):
+    """ Stands in for a detector, counting how often it runs """
+
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, image):
+        self.calls += 1
+        return self.calls
+
+
+def region():
+    # With a 4x4 grid every 8th row and column of the region is sampled
+    return np.full((32, 32, 3), 100, dtype=np.uint8)
+
+
+def test_unchanged_region_reuses_result():
+    gate = ChangeGate(grid=(4, 4), tolerance=2.0)
+    detector = CountingDetector()
+    image = region()
+
+    assert gate.check((0, "clear"), image, detector) == 1
+    assert gate.check((0, "clear"), image.copy(), detector) == 1
+    assert gate.get_stats() == {"clear": (1, 1)}
+
+
+def test_changed_grid_runs_detector():
+    gate = ChangeGate(grid=(4, 4), tolerance=2.0)
+    detector = CountingDetector()
+    image = region()
+    gate.check((0, "clear"), image, detector)
+
+    # Pixels between the sampled ones are not part of the signature
+    image[1:8, 1:8] = 255
+    assert gate.check((0, "clear"), image, detector) == 1
+
+    image[8, 8] = 255
+    assert gate.check((0, "clear"), image, detector) == 2
+    assert gate.get_stats() == {"clear": (1, 2)}
+
+
+def test_drift_accumulates_into_a_change():
+    gate = ChangeGate(grid=(4, 4), tolerance=2.0)
+    detector = CountingDetector()
+    image = region()
+    gate.check((0, "clear"), image, detector)
+
+    # The signature is only refreshed when the detector runs, so small steps add up
+    results = []
+    for _ in range(3):
+        image += 1
+        results.append(gate.check((0, "clear"), image, detector))
+
+    assert results == [1, 1, 2]
+
+
+def test_resized_region_runs_detector():
+    gate = ChangeGate(grid=(4, 4), tolerance=2.0)
+    detector = CountingDetector()
+    gate.check((0, "clear"), region(), detector)
+
+    assert gate.check((0, "clear"), np.full((64, 32, 3), 100, dtype=np.uint8), detector) == 2
+
+
+def test_keys_are_gated_apart():
+    gate = ChangeGate(grid=(4, 4), tolerance=2.0)
+    detector = CountingDetector()
+    image = region()
+
+    assert gate.check((0, "clear"), image, detector) == 1
+    assert gate.check((1, "clear"), image, detector) == 2
+    assert gate.check((0, "pause"), image, detector) == 3
+    assert gate.check((1, "clear"), image, detector) == 2
+
+    assert gate.get_stats() == {"clear": (1, 2), "pause": (0, 1)}
+    assert gate.get_stats(window=1) == {"clear": (1, 1)}
+
+    gate.reset((1, "clear"))
+    assert gate.check((1, "clear"), image, detector) == 4
+    assert gate.check((0, "clear"), image, detector) == 1
+
+
+def test_empty_region_is_never_gated():
+    gate = ChangeGate(grid=(4, 4), tolerance=2.0)
+    detector = CountingDetector()
+    empty = np.zeros((0, 32, 3), dtype=np.uint8)
+
+    gate.check((0, "clear"), empty, detector)
+    gate.check((0, "clear"), empty, detector)
+
+    assert detector.calls == 2
+    assert gate.get_stats() == {}
+
+
+def full_resolution(image):
+    return np.count_nonzero(cv2.inRange(image, LOWER, UPPER)) / (image.shape[0] * image.shape[1])
+
+
+def banners(seed, count=20):
+    """ Regions of bands of 8 identical rows, in and out of the bounds, so every stride samples the true fraction """
+    random = np.random.RandomState(seed)
+    for _ in range(count):
+        rows = np.where(random.rand(8, 40, 1) < random.rand(), [15, 210, 240], [128, 128, 128])
+        yield np.repeat(rows, 8, axis=0).astype(np.uint8)
+
+
+def noise(seed, count=20):
+    """ Regions of random pixels in and out of the bounds """
+    random = np.random.RandomState(seed)
+    for _ in range(count):
+        yield np.where(random.rand(48, 40, 1) < random.rand(), [15, 210, 240], [128, 128, 128]).astype(np.uint8)
+
+
+@pytest.mark.parametrize("stride", [2, 4, 8])
+def test_cascade_matches_full_resolution(stride):
+    for image in banners(stride):
+        fraction = full_resolution(image)
+
+        for threshold in np.arange(0.05, 1.0, 0.05):
+            assert cascade_match(image, LOWER, UPPER, threshold, stride, MARGIN) == (fraction > threshold, fraction)
+
+
+@pytest.mark.parametrize("stride", [1, 2, 4, 8])
+def test_cascade_falls_back_to_full_resolution_within_margin(stride):
+    for image in noise(stride):
+        fraction = full_resolution(image)
+        estimate = full_resolution(image[::stride])
+
+        for threshold in np.arange(0.05, 1.0, 0.05):
+            match = cascade_match(image, LOWER, UPPER, threshold, stride, MARGIN)
+
+            if stride == 1 or abs(estimate - threshold) <= MARGIN * threshold:
+                assert match == (fraction > threshold, fraction)
+            else:
+                assert match == (estimate > threshold, estimate)
+
+
+def test_low_thresholds_are_rejected_by_the_coarse_check(monkeypatch):
+    checked = []
+    monkeypatch.setattr(cv2, "inRange", lambda image, lower, upper: checked.append(image.shape[0]) or
+                        np.zeros(image.shape[:2], dtype=np.uint8))
+
+    # The margin is relative, a threshold of 0.1 is only confirmed at full resolution from 0.085 on
+    assert cascade_match(np.zeros((64, 8, 3), dtype=np.uint8), LOWER, UPPER, 0.1, 8, MARGIN) == (False, 0.0)
+    assert checked == [8]
@@ -0,0 +1,48 @@
+from as64.discovery import StaticEnumerator, WindowDiscovery
+
+
+def enumerator():
+    return StaticEnumerator(processes=[(10, "vlc.exe"), (11, "explorer.exe"), (12, "vlc.exe")],
+                            windows=[(100, 11), (101, 10), (102, 10), (103, 12)])
+
+
+def test_finds_first_window_of_every_process():
+    discovery = WindowDiscovery(enumerator())
+
+    assert discovery.find("vlc.exe") == [101, 103]
+    assert discovery.find("notepad.exe") == []
+
+
+def test_result_is_cached():
+    windows = enumerator()
+    discovery = WindowDiscovery(windows)
+
+    discovery.find("vlc.exe")
+    assert discovery.find("vlc.exe") == [101, 103]
+    assert windows.enumerations == 1
+
+
+def test_closed_window_invalidates_cache():
+    windows = enumerator()
+    discovery = WindowDiscovery(windows)
+    discovery.find("vlc.exe")
+
+    # The process's next window takes the place of the closed one
+    windows.close_window(101)
+    assert discovery.find("vlc.exe") == [102, 103]
+    assert windows.enumerations == 2
+
+
+def test_invalidate_and_expiry():
+    windows = enumerator()
+    discovery = WindowDiscovery(windows)
+    discovery.find("vlc.exe")
+
+    discovery.invalidate("vlc.exe")
+    discovery.find("vlc.exe")
+    assert windows.enumerations == 2
+
+    expired = WindowDiscovery(windows, ttl=0)
+    expired.find("vlc.exe")
+    expired.find("vlc.exe")
+    assert windows.enumerations == 4
@@ -0,0 +1,100 @@
+import pytest
+
+from mm2.gamestate import GameStateMachine, GAMEPLAY, PAUSE_MENU, CLEAR_BANNER, COOLDOWN_STATE, BLACK
+from mm2.scheduler import IDLE, NEAR, COOLDOWN
+
+
+# name: (black detector, [(frame time, state observed in the frame, state of the window before the frame)])
+CASES = {
+    "clear through the black screen": ("is_black", [
+        (0.0, GAMEPLAY, GAMEPLAY),
+        (1.0, CLEAR_BANNER, GAMEPLAY),
+        (2.0, CLEAR_BANNER, CLEAR_BANNER),
+        (3.0, BLACK, CLEAR_BANNER),
+        (4.0, GAMEPLAY, BLACK),
+        (5.0, CLEAR_BANNER, GAMEPLAY),
+        (6.0, CLEAR_BANNER, CLEAR_BANNER),
+    ]),
+    "skip through the pause menu": ("is_black", [
+        (0.0, PAUSE_MENU, GAMEPLAY),
+        (1.0, COOLDOWN_STATE, PAUSE_MENU),
+        (2.0, BLACK, COOLDOWN_STATE),
+        (3.0, GAMEPLAY, BLACK),
+    ]),
+    "cooldown times out without a black detector": (None, [
+        (1.0, COOLDOWN_STATE, GAMEPLAY),
+        (10.9, COOLDOWN_STATE, COOLDOWN_STATE),
+        (11.0, GAMEPLAY, GAMEPLAY),
+    ]),
+    "clear banner times out when the screen never goes black": ("is_black", [
+        (1.0, CLEAR_BANNER, GAMEPLAY),
+        (10.9, CLEAR_BANNER, CLEAR_BANNER),
+        (11.0, CLEAR_BANNER, GAMEPLAY),
+    ]),
+    "black times out on a dark course": ("is_black", [
+        (1.0, CLEAR_BANNER, GAMEPLAY),
+        (2.0, BLACK, CLEAR_BANNER),
+        (11.9, BLACK, BLACK),
+        (12.0, BLACK, GAMEPLAY),
+        (13.0, BLACK, BLACK),
+    ]),
+    "replay looping back to an earlier time": ("is_black", [
+        (5.0, CLEAR_BANNER, GAMEPLAY),
+        (0.0, GAMEPLAY, GAMEPLAY),
+    ]),
+}
+
+
+@pytest.mark.parametrize("black, steps", CASES.values(), ids=CASES.keys())
+def test_transitions(black, steps):
+    machine = GameStateMachine(windows=2, black=black, timeout=10.0)
+
+    for frame_time, observed, expected in steps:
+        assert machine.current(0, frame_time) == expected, frame_time
+        machine.advance(0, observed, frame_time)
+
+    # The other window is untouched
+    assert machine.get_state(1) == GAMEPLAY
+
+
+def test_state_entered_is_kept():
+    machine = GameStateMachine(windows=1, black="is_black", timeout=10.0)
+
+    machine.advance(0, CLEAR_BANNER, 1.0)
+    machine.advance(0, CLEAR_BANNER, 2.0)
+    assert machine.get_entered(0) == 1.0
+
+    machine.set_state(0, BLACK, 4.0)
+    assert machine.current(0, 13.9) == BLACK
+    assert machine.current(0, 14.0) == GAMEPLAY
+    assert machine.get_entered(0) == 14.0
+
+
+def test_hints():
+    machine = GameStateMachine(windows=1, black=None, timeout=10.0)
+
+    assert machine.advance(0, GAMEPLAY, 0.0) == (IDLE, None)
+    assert machine.advance(0, GAMEPLAY, 0.5, near=True) == (NEAR, None)
+    assert machine.advance(0, PAUSE_MENU, 1.0) == (NEAR, None)
+
+    # Without a black detector the window sleeps until its cooldown ends
+    assert machine.advance(0, COOLDOWN_STATE, 2.0) == (COOLDOWN, 10.0)
+    assert machine.advance(0, COOLDOWN_STATE, 5.0) == (COOLDOWN, 7.0)
+
+    # With one it keeps looking for the black screen
+    machine.configure("is_black", 10.0)
+    assert machine.advance(0, COOLDOWN_STATE, 6.0) == (IDLE, None)
+
+
+def test_frames_are_counted_per_state():
+    machine = GameStateMachine(windows=2, black="is_black", timeout=10.0)
+
+    machine.current(0, 0.0)
+    machine.advance(0, CLEAR_BANNER, 0.0)
+    machine.current(0, 1.0)
+    machine.current(1, 1.0)
+
+    stats = machine.get_stats()
+    assert stats[GAMEPLAY] == 2
+    assert stats[CLEAR_BANNER] == 1
+    assert stats[BLACK] == 0
@@ -0,0 +1,53 @@
+from mm2.journal import ScoreJournal
+
+
+def test_truncated_last_line_is_ignored(tmp_path):
+    path = tmp_path / "scores.journal"
+    path.write_text("0 3 1 12.5\n1 2 0 13.25\n0 4 1 20.0\n1 5")
+
+    assert ScoreJournal(str(path)).load() == {
+        0: {"score": 4, "skips": 1, "last_update": 20.0},
+        1: {"score": 2, "skips": 0, "last_update": 13.25},
+    }
+
+
+def test_missing_journal_restores_nothing(tmp_path):
+    assert ScoreJournal(str(tmp_path / "scores.journal")).load() == {}
+
+
+def test_recorded_states_are_restored(tmp_path):
+    path = str(tmp_path / "scores.journal")
+
+    journal = ScoreJournal(path)
+    journal.load()
+    journal.start()
+    journal.record(0, 1, 0, 1.5)
+    journal.record(1, -1, 1, 2.0)
+    journal.record(0, 2, 0, 3.5)
+    journal.stop()
+
+    assert ScoreJournal(path).load() == {
+        0: {"score": 2, "skips": 0, "last_update": 3.5},
+        1: {"score": -1, "skips": 1, "last_update": 2.0},
+    }
+
+
+def test_compaction_keeps_latest_state_per_player(tmp_path):
+    path = tmp_path / "scores.journal"
+    path.write_text("0 1 0 1.0\n1 1 0 2.0\n")
+
+    journal = ScoreJournal(str(path), compact_after=4)
+    journal.load()
+
+    # Queued before the thread starts, so they are appended as one batch which then goes over compact_after
+    for score in range(2, 6):
+        journal.record(0, score, 0, float(score))
+    journal.record(1, 7, 2, 9.0)
+    journal.start()
+    journal.stop()
+
+    assert path.read_text().splitlines() == ["0 5 0 5.0", "1 7 2 9.0"]
+    assert ScoreJournal(str(path)).load() == {
+        0: {"score": 5, "skips": 0, "last_update": 5.0},
+        1: {"score": 7, "skips": 2, "last_update": 9.0},
+    }
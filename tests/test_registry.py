@@ -0,0 +1,187 @@
+import os
+import copy
+
+import pytest
+import toml
+
+from as64 import config
+from mm2.registry import DetectorRegistry, CLEAR, SKIP
+
+
+@pytest.fixture
+def defaults(monkeypatch):
+    with open(os.path.join(os.path.dirname(__file__), "..", "defaults")) as file:
+        data = toml.load(file)
+
+    monkeypatch.setattr(config, "_config", data)
+    monkeypatch.setattr(config, "_defaults", copy.deepcopy(data))
+    return data
+
+
+def inline(**settings):
+    """ Definition of a detector with every setting inline """
+    definition = {"region": [0.25, 0.25, 0.5, 0.5], "lower": [0, 185, 225], "upper": [30, 235, 255], "threshold": 0.75}
+    definition.update(settings)
+    return definition
+
+
+def test_default_config_compiles(defaults):
+    registry = DetectorRegistry.compile()
+
+    assert [(rule.name, rule.action) for rule in registry.rules] == [("clear", CLEAR), ("skip", SKIP)]
+    assert [d.name for d in registry.used_detectors()] == ["course_clear", "pause_menu", "exit_course"]
+
+    detector = registry.detectors["pause_menu"]
+    assert detector.region == [1238, 667, 514, 23]
+    assert detector.lower.tolist() == [0, 185, 225]
+    assert detector.threshold == 0.75
+    assert detector.stride == 2
+
+    # No stride configured
+    assert registry.detectors["game_over"].stride == 1
+
+
+def test_inline_settings_override_thresholds(defaults):
+    defaults["detectors"]["course_clear"] = inline(threshold=0.5, stride=4)
+
+    registry = DetectorRegistry.compile()
+    detector = registry.detectors["course_clear"]
+
+    assert detector.threshold == 0.5
+    assert detector.stride == 4
+    assert registry.relative == {"course_clear"}
+
+
+@pytest.mark.parametrize("region", [
+    [0.0, 0.0, 1.0, 1.0],
+    [0.5, 0.25, 0.5, 0.75],
+    [0, 0, 1920, 1080],
+])
+def test_valid_regions(defaults, region):
+    defaults["detectors"]["course_clear"] = inline(region=region)
+
+    assert DetectorRegistry.compile().detectors["course_clear"].region == region
+
+
+@pytest.mark.parametrize("settings", [
+    # Regions
+    {"region": [0.5, 0.5, 0.9, 0.9]},
+    {"region": [0.2, 0.9, 0.5, 0.2]},
+    {"region": [0.2, 10, 0.5, 0.3]},
+    {"region": [-1, 0, 10, 10]},
+    {"region": [0, 0, 10]},
+    {"region": [True, 0, 10, 10]},
+    {"region": "course_clear_region"},
+    # Bounds
+    {"lower": [True, 0, 0]},
+    {"upper": [0, 0, 256]},
+    {"lower": [0, 0, 1.5]},
+    {"lower": [0, 0]},
+    # Threshold and stride
+    {"threshold": 1.5},
+    {"threshold": "0.5"},
+    {"stride": 0},
+    {"stride": 2.0},
+    {"stride": False},
+])
+def test_invalid_detectors_are_rejected(defaults, settings):
+    defaults["detectors"]["course_clear"] = inline(**settings)
+
+    with pytest.raises(ValueError, match="course_clear"):
+        DetectorRegistry.compile()
+
+
+def test_missing_settings_are_rejected(defaults):
+    defaults["detectors"]["course_clear"] = {"region": [0, 0, 10, 10], "colour": "no_such_colour"}
+
+    with pytest.raises(ValueError, match="missing"):
+        DetectorRegistry.compile()
+
+
+@pytest.mark.parametrize("rule, error", [
+    ({"detectors": ["course_clear", "no_such_detector"], "action": "clear"}, "unknown detector"),
+    ({"detectors": [], "action": "clear"}, "must list its detectors"),
+    ({"detectors": "course_clear", "action": "clear"}, "must list its detectors"),
+    ({"detectors": ["course_clear"], "action": "explode"}, "unknown action"),
+    ("course_clear", "must be a table"),
+])
+def test_invalid_rules_are_rejected(defaults, rule, error):
+    defaults["rules"]["clear"] = rule
+
+    with pytest.raises(ValueError, match=error):
+        DetectorRegistry.compile()
+
+
+@pytest.mark.parametrize("size", [[1920], [0, 1080], [1920.0, 1080], "1920x1080"])
+def test_invalid_reference_size_is_rejected(defaults, size):
+    defaults["detection"]["reference_size"] = size
+
+    with pytest.raises(ValueError, match="reference_size"):
+        DetectorRegistry.compile()
+
+
+def sized(registry, name, *size, captured=None):
+    return registry.for_size(*size, captured=captured).detectors[name].region
+
+
+def test_pixel_regions_without_reference_size_are_used_as_they_are(defaults):
+    registry = DetectorRegistry.compile()
+
+    assert registry.for_size(1280, 720) is registry
+    assert sized(registry, "pause_menu", 1280, 720) == [1238, 667, 514, 23]
+
+
+def test_pixel_regions_are_scaled_from_the_reference_size(defaults):
+    defaults["detection"]["reference_size"] = [1920, 1080]
+    registry = DetectorRegistry.compile()
+
+    assert registry.for_size(1920, 1080) is registry
+    assert sized(registry, "pause_menu", 960, 540) == [619, 334, 257, 11]
+
+    # Edges are rounded, not the width and height
+    assert sized(registry, "pause_menu", 1280, 720) == [825, 445, 343, 15]
+
+
+def test_fraction_regions_are_scaled_to_every_size(defaults):
+    defaults["detectors"]["course_clear"] = inline(region=[0.25, 0.5, 0.5, 0.25])
+    registry = DetectorRegistry.compile()
+
+    assert sized(registry, "course_clear", 200, 100) == [50, 50, 100, 25]
+    assert sized(registry, "course_clear", 1920, 1080) == [480, 540, 960, 270]
+
+    # Pixel regions next to them are still used as they are
+    assert sized(registry, "pause_menu", 200, 100) == [1238, 667, 514, 23]
+
+
+def test_canvas_regions_are_scaled_from_the_captured_size(defaults):
+    defaults["detectors"]["course_clear"] = inline(region=[0.25, 0.5, 0.5, 0.25])
+    registry = DetectorRegistry.compile()
+
+    # Pixel regions are for the captured frame, fractions for whatever frame is checked
+    assert sized(registry, "pause_menu", 480, 270, captured=(1920, 1080)) == [310, 167, 128, 5]
+    assert sized(registry, "course_clear", 480, 270, captured=(1920, 1080)) == [120, 135, 240, 67]
+
+    # A frame checked as captured is not scaled
+    assert sized(registry, "pause_menu", 1920, 1080, captured=(1920, 1080)) == [1238, 667, 514, 23]
+
+
+def test_reference_size_wins_over_the_captured_size(defaults):
+    defaults["detection"]["reference_size"] = [1920, 1080]
+    registry = DetectorRegistry.compile()
+
+    assert sized(registry, "pause_menu", 480, 270, captured=(3840, 2160)) == sized(registry, "pause_menu", 480, 270)
+
+
+def test_sized_registries_are_cached_and_keep_their_rules(defaults):
+    defaults["detection"]["reference_size"] = [1920, 1080]
+    registry = DetectorRegistry.compile()
+
+    small = registry.for_size(960, 540)
+    assert registry.for_size(960, 540) is small
+    assert registry.for_size(480, 270, captured=(1920, 1080)) is registry.for_size(480, 270)
+
+    # Rules check the scaled detectors
+    skip = small.rules[1]
+    assert [d.region for d in skip.detectors] == [small.detectors["pause_menu"].region,
+                                                  small.detectors["exit_course"].region]
+    assert small.used_detectors()[0] is small.detectors["course_clear"]
@@ -0,0 +1,132 @@
+import os
+import copy
+
+import numpy as np
+import pytest
+import toml
+
+from as64 import config
+from as64.capture import CaptureBackend
+from mm2.controller import Controller
+from mm2.counter import Counter
+from mm2.sharding import ShardPool
+from mm2.writer import ScoreWriter
+
+
+class FakeBackend(CaptureBackend):
+    def get_handles(self, count):
+        return list(range(1, count + 1))
+
+    def grab(self, handle):
+        return np.zeros((1080, 1920, 3), dtype=np.uint8)
+
+    def get_size(self, handle):
+        return [1920, 1080]
+
+
+def bad_stride(data):
+    data["thresholds"]["course_clear_stride"] = 0
+
+
+def unknown_detector(data):
+    data["rules"]["clear"]["detectors"] = ["course_clear", "no_such_detector"]
+
+
+@pytest.fixture
+def defaults(monkeypatch, tmp_path):
+    """ The default config, read from a config file of the test's own """
+    with open(os.path.join(os.path.dirname(__file__), "..", "defaults")) as file:
+        data = toml.load(file)
+    data["startup"]["assignment_file"] = ""
+
+    monkeypatch.setattr(config, "_config", {})
+    monkeypatch.setattr(config, "_defaults", copy.deepcopy(data))
+    monkeypatch.setattr(config, "_cache", None)
+    monkeypatch.setattr(config, "_CACHE_FILE", str(tmp_path / "config.cache"))
+    monkeypatch.setattr(config, "_CONFIG_FILE", str(tmp_path / "config"))
+    return data
+
+
+def write_config(data):
+    with open(config._CONFIG_FILE, 'w') as file:
+        toml.dump(data, file)
+
+
+@pytest.fixture
+def writer(tmp_path):
+    writer = ScoreWriter(directory=str(tmp_path), coalesce=0.01)
+    writer.start()
+    yield writer
+    writer.stop()
+
+
+def start(data, writer, mode="round_robin"):
+    """ Returns a counter compiled from the config, which reports itself running without capturing """
+    data = copy.deepcopy(data)
+    data["settings"]["capture_mode"] = mode
+    data["thresholds"]["course_clear_threshold"] = 0.6
+    write_config(data)
+    config.load()
+
+    counter = Counter(backend=FakeBackend(), writer=writer)
+    counter._running = True
+    return counter
+
+
+@pytest.mark.parametrize("invalid", [bad_stride, unknown_detector])
+def test_invalid_reload_is_rolled_back(defaults, writer, invalid):
+    counter = start(defaults, writer)
+    detection = counter._detection
+    before = config.snapshot()
+
+    controller = Controller.__new__(Controller)
+    controller.counter = counter
+
+    data = copy.deepcopy(before)
+    data["thresholds"]["course_clear_threshold"] = 0.9
+    invalid(data)
+    write_config(data)
+
+    with pytest.raises(ValueError):
+        controller._reload()
+
+    # The config is the one the counter is still running on, and the counter kept its detection
+    assert config.snapshot() == before
+    assert config.get("thresholds", "course_clear_threshold") == 0.6
+    assert counter._detection is detection
+    assert counter._detection.registry.detectors["course_clear"].threshold == 0.6
+
+    # Nothing was queued for the counter
+    counter._apply_commands()
+    assert counter._detection is detection
+
+
+def test_sharded_reload_only_bumps_the_version_once_compiled(defaults, writer):
+    counter = start(defaults, writer, mode="sharded")
+    counter._shards = ShardPool(windows=2, processes=1, settings=counter._shard_settings(counter._settings))
+
+    data = copy.deepcopy(config.snapshot())
+    bad_stride(data)
+    write_config(data)
+    config.reload()
+
+    with pytest.raises(ValueError):
+        counter.reload()
+    config.rollback()
+    assert counter._shards._version == 0
+
+    data["thresholds"]["course_clear_stride"] = 4
+    write_config(data)
+    config.reload()
+
+    future = counter.reload()
+    # Applied with the counter's next frame
+    assert not future.done()
+    counter._apply_commands()
+    future.result(timeout=0)
+
+    settings, near_fraction, black = counter._shards._settings
+    assert counter._shards._version == 1
+    assert settings["thresholds"]["course_clear_stride"] == 4
+    assert counter._detection.registry.detectors["course_clear"].stride == 4
+    assert black == "is_black"
@@ -0,0 +1,99 @@
+import pytest
+
+from mm2 import scheduler
+from mm2.scheduler import FrameScheduler, IDLE, NEAR, COOLDOWN
+
+
+class FakeClock(object):
+    """ Stands in for the time module, sleeping only moves the clock forward """
+
+    def __init__(self):
+        self.now = 100.0
+
+    def perf_counter(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(scheduler, "time", clock)
+    return clock
+
+
+def deadlines(frames):
+    return [pytest.approx(d) for d in frames._deadlines]
+
+
+def test_earliest_deadline_goes_next(clock):
+    frames = FrameScheduler(windows=3, idle_fps=10, near_fps=20, cooldown_fps=2)
+
+    assert frames.next() == 0
+    frames.done(0)
+    assert frames.next() == 1
+    frames.done(1, COOLDOWN)
+    assert frames.next() == 2
+    frames.done(2, NEAR)
+
+    # Near windows come back first, the window in cooldown last
+    assert deadlines(frames) == [100.1, 100.5, 100.05]
+    assert frames.next() == 2
+
+    frames.wait(2)
+    assert clock.now == pytest.approx(100.05)
+
+
+def test_interval_follows_the_hint(clock):
+    frames = FrameScheduler(windows=1, idle_fps=10, near_fps=20, cooldown_fps=2)
+
+    frames.done(0, IDLE)
+    clock.now = 100.1
+    frames.done(0, NEAR)
+    clock.now = 100.15
+    frames.done(0, NEAR)
+    assert deadlines(frames) == [100.2]
+
+    # The slower cadence starts from the current deadline
+    clock.now = 100.2
+    frames.done(0, COOLDOWN)
+    assert deadlines(frames) == [100.7]
+    assert frames.get_hints() == [COOLDOWN]
+
+    # A cooldown ending earlier brings the window back by then
+    frames.done(0, COOLDOWN, resume_in=0.2)
+    assert deadlines(frames) == [100.4]
+
+
+def test_overrun_deadlines_are_counted_and_skipped(clock):
+    frames = FrameScheduler(windows=2, idle_fps=10, near_fps=20, cooldown_fps=2)
+
+    frames.done(0)
+    frames.done(1)
+
+    # The frame due at 100.1 only finished at 100.33, the slots at 100.2 and 100.3 were missed
+    clock.now = 100.33
+    frames.done(0)
+
+    assert frames.get_missed() == [2, 0]
+    assert deadlines(frames) == [100.4, 100.1]
+
+
+def test_unthrottled_windows_rotate_without_waiting(clock):
+    frames = FrameScheduler(windows=2, idle_fps=10, near_fps=20, cooldown_fps=2, throttled=False)
+
+    frames.done(0, COOLDOWN)
+    clock.now += 0.001
+    frames.done(1, NEAR)
+
+    assert frames.next() == 0
+    frames.wait(0)
+    assert clock.now == pytest.approx(100.001)
+    assert frames.get_missed() == [0, 0]
+
+
+def test_rates_must_be_above_zero():
+    with pytest.raises(ValueError):
+        FrameScheduler(windows=1, idle_fps=30, near_fps=30, cooldown_fps=0)
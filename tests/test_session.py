@@ -0,0 +1,100 @@
+import numpy as np
+
+from as64.session import BufferPool, CaptureSession, FakeSource
+from mm2.pipeline import FrameQueue, DROP_OLDEST
+
+
+def frame(width, height, value=0):
+    return np.full((height, width, 3), value, dtype=np.uint8)
+
+
+def test_pool_reuses_released_buffers():
+    pool = BufferPool(capacity=2)
+
+    first = pool.acquire(64, 32)
+    assert first.shape == (32, 64, 4)
+
+    pool.release(first)
+    assert pool.acquire(64, 32) is first
+    assert pool.allocations == 1
+
+
+def test_pool_ignores_double_release():
+    pool = BufferPool(capacity=2)
+
+    buffer = pool.acquire(64, 32)
+    pool.release(buffer)
+    pool.release(buffer)
+
+    assert pool.acquire(64, 32) is buffer
+    assert pool.acquire(64, 32) is not buffer
+
+
+def test_pool_drops_buffers_of_old_size():
+    pool = BufferPool(capacity=2)
+
+    old = pool.acquire(64, 32)
+    pool.release(old)
+
+    new = pool.acquire(128, 64)
+    assert new.shape == (64, 128, 4)
+    assert pool.allocations == 2
+
+    # A frame of the old size still in use when the size changed is not taken back
+    pool.release(old)
+    pool.release(new)
+    assert pool.acquire(128, 64) is new
+
+
+def test_session_allocates_once_at_steady_size():
+    session = CaptureSession(FakeSource([frame(64, 32, 1), frame(64, 32, 2)]), buffers=2)
+
+    for i in range(10):
+        image = session.grab()
+        assert image.shape == (32, 64, 4)
+        assert image[0, 0, 0] == i % 2 + 1
+        session.release(image)
+
+    assert session.get_stats() == {"frames": 10, "resizes": 1, "allocations": 1}
+
+
+def test_session_resizes_with_window():
+    source = FakeSource([frame(64, 32), frame(128, 64)])
+    session = CaptureSession(source, buffers=2)
+    session.release(session.grab())
+
+    image = session.grab()
+
+    assert image.shape == (64, 128, 4)
+    assert source.resized == 2
+    assert session.get_stats()["allocations"] == 2
+
+
+def test_session_closes_source():
+    source = FakeSource([frame(64, 32)])
+    CaptureSession(source).close()
+
+    assert source.closed
+
+
+def test_frames_dropped_by_pipeline_are_released():
+    session = CaptureSession(FakeSource([frame(64, 32)]), buffers=3)
+    queue = FrameQueue(size=1, policy=DROP_OLDEST, on_drop=session.release)
+
+    first = session.grab()
+    queue.put(first)
+    second = session.grab()
+    queue.put(second)
+
+    # The first frame was dropped for the second one and is captured into again
+    assert queue.get_stats()["dropped"] == 1
+    third = session.grab()
+    assert third is first
+
+    # Frames put after the queue closed are released as well
+    queue.close()
+    assert not queue.put(third)
+    assert session.grab() is third
+
+    assert queue.get() is second
+    assert session.get_stats()["allocations"] == 2
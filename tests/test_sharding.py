@@ -0,0 +1,96 @@
+import os
+import copy
+
+import numpy as np
+import pytest
+import toml
+
+from as64 import config
+from as64.capture import CaptureBackend
+from mm2.counter import Counter
+from mm2.gamestate import GAMEPLAY
+from mm2.registry import CLEAR
+from mm2.sharding import ShardPool
+from mm2.writer import ScoreWriter
+
+
+class FakeBackend(CaptureBackend):
+    """ Finds only the first window """
+
+    def get_handles(self, count):
+        return [1] + [None] * (count - 1)
+
+    def grab(self, handle):
+        return None
+
+    def get_size(self, handle):
+        return [1920, 1080]
+
+
+@pytest.fixture
+def defaults(monkeypatch):
+    with open(os.path.join(os.path.dirname(__file__), "..", "defaults")) as file:
+        data = toml.load(file)
+    data["startup"]["assignment_file"] = ""
+    data["settings"]["capture_mode"] = "sharded"
+
+    # Workers only get the config, they can not read the defaults from the test's directory. The one key it lacks
+    # is set to what it falls back to
+    data["thresholds"]["game_over_stride"] = 1
+    monkeypatch.setattr(config, "_config", copy.deepcopy(data))
+    monkeypatch.setattr(config, "_defaults", data)
+    return data
+
+
+@pytest.fixture
+def pool(defaults):
+    pool = ShardPool(windows=2, processes=2, settings=(config.snapshot(), 0.25, "is_black"), timeout=10)
+    pool.start()
+    yield pool
+    pool.close()
+
+
+def clear_banner():
+    """ A 1080p frame with the course clear region in the banner's colour """
+    image = np.zeros((1080, 1920, 3), dtype=np.uint8)
+    x, y, width, height = config.get("region", "course_clear")
+    image[y:y + height, x:x + width] = (15, 210, 240)
+    return image
+
+
+def test_killed_worker_is_restarted(pool):
+    image = clear_banner()
+
+    assert pool.check(0, image, GAMEPLAY)[0] == CLEAR
+    assert pool.check(1, image, GAMEPLAY)[0] == CLEAR
+    assert pool.check(0, image, GAMEPLAY)[0] == CLEAR
+
+    # The second frame of window 0 was unchanged
+    assert pool.get_gating_stats()["course_clear"] == (1, 2)
+
+    pool._workers[0].kill()
+    pool._workers[0].join()
+
+    # The frame in flight is lost, the shard's next frame is checked by a new worker
+    assert pool.check(0, image, GAMEPLAY) == (None, False, GAMEPLAY)
+    assert pool.get_stats()["restarts"] == 1
+    assert pool.check(0, image, GAMEPLAY)[0] == CLEAR
+
+    # The other shard kept its worker
+    assert pool.check(1, image, GAMEPLAY)[0] == CLEAR
+    assert pool.get_stats()["restarts"] == 1
+
+    # The new worker's gate started over, window 1's kept counting
+    assert pool.get_gating_stats()["course_clear"] == (1, 2)
+
+
+def test_missing_window_starts_no_workers(defaults, tmp_path):
+    writer = ScoreWriter(directory=str(tmp_path), coalesce=0.01)
+    writer.start()
+
+    counter = Counter(backend=FakeBackend(), writer=writer)
+    counter.run()
+    writer.stop()
+
+    assert not counter.is_running()
+    assert counter._shards is None
@@ -0,0 +1,102 @@
+import os
+
+import pytest
+
+from mm2 import writer
+from mm2.writer import ScoreWriter
+
+
+def read(directory, file):
+    with open(os.path.join(directory, "{}.txt".format(file))) as f:
+        return f.read()
+
+
+@pytest.fixture
+def scores(tmp_path):
+    scores = ScoreWriter(directory=str(tmp_path), coalesce=0.2)
+    scores.start()
+    yield scores
+    scores.stop()
+
+
+def test_updates_within_coalesce_time_are_one_write(scores, tmp_path):
+    scores.write("player_0", 1)
+    scores.write("player_0", 2)
+    scores.write("player_0", 3)
+    assert scores.flush(timeout=5)
+
+    assert read(tmp_path, "player_0") == "3"
+    assert scores.get_stats()["writes"] == 1
+
+
+def test_every_file_is_written(scores, tmp_path):
+    scores.write("player_0", 4)
+    scores.write("skip_0", 1)
+    assert scores.flush(timeout=5)
+
+    assert read(tmp_path, "player_0") == "4"
+    assert read(tmp_path, "skip_0") == "1"
+    assert sorted(os.listdir(tmp_path)) == ["player_0.txt", "skip_0.txt"]
+
+
+def test_files_are_replaced_through_temporary_files(scores, tmp_path, monkeypatch):
+    replaced = []
+    replace = os.replace
+
+    def record(source, destination):
+        replaced.append((os.path.basename(source), os.path.basename(destination)))
+        replace(source, destination)
+
+    monkeypatch.setattr(writer.os, "replace", record)
+
+    scores.write("player_0", 1)
+    assert scores.flush(timeout=5)
+
+    (source, destination), = replaced
+    assert source.startswith("player_0.") and source.endswith(".tmp")
+    assert destination == "player_0.txt"
+
+
+def test_failed_replace_removes_temporary_file(scores, tmp_path, monkeypatch):
+    scores.write("player_0", 1)
+    assert scores.flush(timeout=5)
+
+    def fail(source, destination):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(writer.os, "replace", fail)
+    scores.write("player_0", 2)
+    assert scores.flush(timeout=5)
+
+    # The previous score is left as it was and nothing else is left behind
+    assert read(tmp_path, "player_0") == "1"
+    assert os.listdir(tmp_path) == ["player_0.txt"]
+
+
+def test_stop_writes_pending_updates(tmp_path):
+    scores = ScoreWriter(directory=str(tmp_path), coalesce=0.2)
+    scores.start()
+
+    scores.write("player_1", 7)
+    scores.stop()
+
+    assert read(tmp_path, "player_1") == "7"
+
+
+@pytest.mark.skipif(os.name == "nt", reason="POSIX permissions")
+def test_files_keep_their_permissions(scores, tmp_path):
+    umask = os.umask(0o022)
+    os.umask(umask)
+
+    scores.write("player_0", 1)
+    scores.write("skip_0", 1)
+    assert scores.flush(timeout=5)
+
+    # New files are readable by everyone the umask allows, not only their owner as temporary files are
+    assert os.stat(tmp_path / "player_0.txt").st_mode & 0o777 == 0o644 & ~umask
+
+    os.chmod(tmp_path / "skip_0.txt", 0o640)
+    scores.write("skip_0", 2)
+    assert scores.flush(timeout=5)
+
+    assert os.stat(tmp_path / "skip_0.txt").st_mode & 0o777 == 0o640